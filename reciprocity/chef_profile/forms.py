@@ -1,3 +1,4 @@
+from dal import autocomplete
 from django import forms
 from chef_profile.models import ChefProfile
 from django.contrib.auth.models import User
@@ -20,4 +21,10 @@ class ChefProfileForm(forms.ModelForm):
         """Establish Model and fields for user form."""
 
         model = ChefProfile
-        exclude = ['user', 'favorites', 'disliked_ingredients', 'liked_ingredients']
+        exclude = ['user', 'favorites']
+        widgets = {
+            'liked_ingredients': autocomplete.ModelSelect2Multiple(
+                url='ingredient-autocomplete'),
+            'disliked_ingredients': autocomplete.ModelSelect2Multiple(
+                url='ingredient-autocomplete'),
+        }
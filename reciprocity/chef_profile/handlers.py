@@ -2,10 +2,11 @@
 """Handlers for pop-save and pre-delete events on User model."""
 from __future__ import unicode_literals  # pragma: no cover
 from django.conf import settings  # pragma: no cover
-from django.db.models.signals import post_save, pre_delete  # pragma: no cover
+from django.db.models.signals import m2m_changed, post_save, pre_delete  # pragma: no cover
 from django.dispatch import receiver  # pragma: no cover
 from .models import ChefProfile  # pragma: no cover
 import logging  # pragma: no cover
+from recipe.feed import invalidate_personal_feeds
 from registration.signals import user_activated
 from django.contrib.auth.models import Permission
 from registration.backends.hmac.views import ActivationView
@@ -56,3 +57,23 @@ def add_permissions(sender, **kwargs):
             logger.error('Permission not found.')
     except (KeyError, ValueError):
         logger.error('User not sent with user_activated signal.')
+
+
+@receiver(post_save, sender=ChefProfile)
+def invalidate_saved_profile_feed(sender, **kwargs):
+    """Drop the cached personal feed of a chef whose profile was edited."""
+    invalidate_personal_feeds([kwargs['instance'].user_id])
+
+
+@receiver(m2m_changed, sender=ChefProfile.liked_ingredients.through)
+@receiver(m2m_changed, sender=ChefProfile.disliked_ingredients.through)
+def invalidate_tastes_feed(sender, **kwargs):
+    """Drop the cached personal feeds of chefs whose tastes changed."""
+    if not kwargs['action'].startswith('post_'):
+        return
+    if not kwargs['reverse']:
+        invalidate_personal_feeds([kwargs['instance'].user_id])
+    elif kwargs['pk_set']:
+        invalidate_personal_feeds(
+            ChefProfile.objects.filter(pk__in=kwargs['pk_set'])
+            .values_list('user', flat=True))
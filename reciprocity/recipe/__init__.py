@@ -0,0 +1,3 @@
+"""Initialize recipe package and config."""
+
+default_app_config = 'recipe.apps.RecipeConfig'
@@ -1,6 +1,15 @@
+from collections import Counter  # pragma: no cover
 from django.contrib import admin  # pragma: no cover
+from django.db.models import Count  # pragma: no cover
 from .models import Recipe, Ingredient, RecipeIngredientRelationship  # pragma: no cover
 from recipe.forms import IngredientForm  # pragma: no cover
+from recipe.jobs import show_stored_photo  # pragma: no cover
+from recipe.photos import keep_uploaded_photo, release_photos  # pragma: no cover
+from recipe.services import (  # pragma: no cover
+    adjust_ingredient_usage,
+    refresh_ingredient_ids
+)
+from recipe.similar import update_neighbours  # pragma: no cover
 
 
 class RecipeIngredientRelationshipInline(admin.TabularInline):  # pragma: no cover
@@ -12,6 +21,41 @@ class RecipeIngredientRelationshipInline(admin.TabularInline):  # pragma: no cov
 class RecipeAdmin(admin.ModelAdmin):  # pragma: no cover
     inlines = (RecipeIngredientRelationshipInline,)
 
+    def save_model(self, request, obj, form, change):
+        """Show a placeholder until a new photo has been resized."""
+        if 'photo' in form.changed_data:
+            obj.photo_ready = False
+        super(RecipeAdmin, self).save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        """Refresh data derived from the ingredient rows and photo.
+
+        Ingredient usage counts move by the difference between the
+        recipe's ingredient rows before and after the inlines are saved.
+        """
+        before = self.count_ingredients(form.instance)
+        super(RecipeAdmin, self).save_related(request, form, formsets, change)
+        usage = self.count_ingredients(form.instance)
+        usage.subtract(before)
+        adjust_ingredient_usage(usage)
+        refresh_ingredient_ids([form.instance.pk])
+        update_neighbours(form.instance.pk)
+        if 'photo' in form.changed_data:
+            if form.instance.photo:
+                show_stored_photo(form.instance, form.instance.photo.name)
+                keep_uploaded_photo(form.instance.photo.name,
+                                    form.cleaned_data['photo'])
+            if form.initial.get('photo'):
+                release_photos([form.initial['photo'].name])
+
+    def count_ingredients(self, recipe):
+        """Return how many of the recipe's rows use each ingredient."""
+        return Counter(dict(RecipeIngredientRelationship.objects
+                            .filter(recipe=recipe)
+                            .order_by()
+                            .values_list('ingredient')
+                            .annotate(Count('pk'))))
+
 
 class IngredientAdmin(admin.ModelAdmin):  # pragma: no cover
     pass
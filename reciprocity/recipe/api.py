@@ -0,0 +1,329 @@
+"""Read-only JSON views of recipes, their lineage and ingredients.
+
+Each recipe is read with only the columns the requested fields need, and
+embedded ingredients for a whole page come from one more query. Recipe
+responses carry a strong ETag built from the ids and versions of the
+recipes in them, so a matching If-None-Match is answered with 304 before
+any ingredients are read.
+"""
+import hashlib
+from django.core.paginator import EmptyPage, Paginator
+from django.http import (
+    Http404,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse
+)
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.generic import View
+from .conditional import not_modified, set_validators
+from .exporter import export_lines
+from .models import Ingredient, Recipe, RecipeIngredientRelationship
+from .pagination import KeysetPaginationMixin
+from .photos import THUMBNAIL_SIZES, thumbnail_url
+
+
+def photo_urls(recipe):
+    """Return a recipe's photo state and, once resized, its sizes' URLs."""
+    if not recipe.photo:
+        return None
+    photo = {'ready': recipe.photo_ready}
+    if recipe.photo_ready:
+        for size, width in THUMBNAIL_SIZES:
+            photo[size] = thumbnail_url(recipe.photo.name, size,
+                                        recipe.photo.storage)
+    return photo
+
+
+# Each field names the columns it is read from and how it is written out.
+# The ingredients field is filled from RecipeIngredientRelationship.
+RECIPE_FIELDS = {
+    'title': (('title',), lambda recipe: recipe.title),
+    'description': (('description',), lambda recipe: recipe.description),
+    'directions': (('directions',), lambda recipe: recipe.directions),
+    'prep_time': (('prep_time',), lambda recipe: recipe.prep_time),
+    'cook_time': (('cook_time',), lambda recipe: recipe.cook_time),
+    'privacy': (('privacy',), lambda recipe: recipe.privacy),
+    'author': (('author',), lambda recipe: recipe.author_id),
+    'parent': (('parent',), lambda recipe: recipe.parent_id),
+    'created': (('created',), lambda recipe: recipe.created.isoformat()),
+    'photo': (('photo', 'photo_ready'), photo_urls),
+    'favorite_count': (('favorite_count',),
+                       lambda recipe: recipe.favorite_count),
+    'variation_count': (('variation_count',),
+                        lambda recipe: recipe.variation_count),
+    'descendant_count': (('descendant_count',),
+                         lambda recipe: recipe.descendant_count),
+    'ingredient_count': (('ingredient_count',),
+                         lambda recipe: recipe.ingredient_count),
+    'ingredients': ((), None),
+}
+DETAIL_FIELDS = frozenset(RECIPE_FIELDS)
+LIST_FIELDS = frozenset(('title', 'description', 'author', 'parent',
+                         'created', 'photo', 'favorite_count',
+                         'variation_count'))
+
+
+class ApiError(Exception):
+    """A request the API can not answer, sent back as a 400 response."""
+
+
+def parse_fields(value, default):
+    """Return the set of fields a ?fields= value asks for."""
+    if not value:
+        return default
+    fields = frozenset(field.strip() for field in value.split(','))
+    fields = fields - frozenset(('', 'id'))
+    unknown = fields - DETAIL_FIELDS
+    if unknown:
+        raise ApiError('Unknown fields: {}.'.format(
+            ', '.join(sorted(unknown))))
+    return fields
+
+
+def load_recipes(recipes, fields):
+    """Return recipes with only the columns the fields need loaded."""
+    columns = set(['version', 'privacy'])
+    for field in fields:
+        columns.update(RECIPE_FIELDS[field][0])
+    return recipes.only(*columns)
+
+
+def recipes_etag(recipes, fields, *extra):
+    """Return a strong ETag for a representation of the given recipes."""
+    parts = ['{}:{}'.format(recipe.pk, recipe.version) for recipe in recipes]
+    parts.append(','.join(sorted(fields)))
+    parts.extend(str(part) for part in extra)
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def serialize_recipes(recipes, fields):
+    """Return the given fields of recipes as dicts, in the given order.
+
+    Embedded ingredients of every recipe are read in one query.
+    """
+    if 'ingredients' in fields:
+        ingredients = dict((recipe.pk, []) for recipe in recipes)
+        rows = (RecipeIngredientRelationship.objects
+                .filter(recipe__in=ingredients)
+                .order_by('pk')
+                .values_list('recipe', 'ingredient', 'ingredient__name',
+                             'quantity'))
+        for recipe, ingredient, name, quantity in rows:
+            ingredients[recipe].append({'id': ingredient,
+                                        'name': name,
+                                        'quantity': quantity})
+    data = []
+    for recipe in recipes:
+        item = {'id': recipe.pk}
+        for field in fields:
+            if field == 'ingredients':
+                item[field] = ingredients[recipe.pk]
+            else:
+                item[field] = RECIPE_FIELDS[field][1](recipe)
+        data.append(item)
+    return data
+
+
+def page_url(request, **params):
+    """Return the current URL with its query changed by params."""
+    query = request.GET.copy()
+    for name in ('after', 'before', 'page'):
+        query.pop(name, None)
+    query.update(params)
+    return '{}?{}'.format(request.path, query.urlencode())
+
+
+class RecipeApiView(View):
+    """Base view answering GET with JSON for visible recipes.
+
+    Subclasses load the recipes to send with get_recipes(), which may
+    raise ApiError or Http404, and build the response body from the
+    serialized recipes in get_data(). Responses listing a private recipe
+    are marked private.
+    """
+    http_method_names = ['get', 'head', 'options']
+    default_fields = LIST_FIELDS
+
+    def get(self, request, *args, **kwargs):
+        """Answer with the recipes' JSON, or 304 if the client has it."""
+        try:
+            self.fields = parse_fields(request.GET.get('fields'),
+                                       self.default_fields)
+            recipes = list(self.get_recipes(
+                load_recipes(Recipe.objects.visible_to(request.user),
+                             self.fields)))
+        except ApiError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        except Http404:
+            return JsonResponse({'error': 'Not found.'}, status=404)
+        etag = recipes_etag(recipes, self.fields, *self.get_etag_extra())
+        if not_modified(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = JsonResponse(self.get_data(
+                serialize_recipes(recipes, self.fields)))
+        set_validators(response, etag)
+        if all(recipe.privacy == 'pu' for recipe in recipes):
+            patch_cache_control(response, public=True, max_age=0)
+        else:
+            patch_cache_control(response, private=True, max_age=0)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    def get_etag_extra(self):
+        """Return anything besides recipes the response body depends on."""
+        return ()
+
+
+class RecipeDetailApi(RecipeApiView):
+    """One recipe with every field, ingredients included, by default."""
+    default_fields = DETAIL_FIELDS
+
+    def get_recipes(self, recipes):
+        return [get_object_or_404(recipes, pk=self.kwargs.get('pk'))]
+
+    def get_data(self, recipes):
+        return recipes[0]
+
+
+class RecipeListApi(KeysetPaginationMixin, RecipeApiView):
+    """Visible recipes newest first, a cursor page at a time.
+
+    ?author= limits the list to one chef's recipes.
+    """
+
+    def get_recipes(self, recipes):
+        author = self.request.GET.get('author')
+        if author:
+            if not author.isdigit():
+                raise ApiError('Unknown author.')
+            recipes = recipes.filter(author=author)
+        recipe_ids = self.paginate_keyset(recipes)
+        recipes = recipes.in_bulk(recipe_ids)
+        return [recipes[pk] for pk in recipe_ids]
+
+    def get_etag_extra(self):
+        return (self.next_cursor, self.previous_cursor)
+
+    def get_data(self, recipes):
+        data = {'results': recipes, 'next': None, 'previous': None}
+        if self.next_cursor:
+            data['next'] = page_url(self.request, after=self.next_cursor)
+        if self.previous_cursor:
+            data['previous'] = page_url(self.request,
+                                        before=self.previous_cursor)
+        return data
+
+
+class RecipeLineageApi(RecipeApiView):
+    """A visible recipe's ancestors or descendants, nearest first.
+
+    ?direction=ancestors|descendants picks which, as on the lineage
+    page, and ?page= pages through them.
+    """
+    page_size = 24
+
+    def get_recipes(self, recipes):
+        recipe = get_object_or_404(recipes.only('pk'),
+                                   pk=self.kwargs.get('pk'))
+        self.direction = self.request.GET.get('direction')
+        if self.direction == 'ancestors':
+            lineage = recipes.ancestors_of(recipe)
+        else:
+            self.direction = 'descendants'
+            lineage = recipes.descendants_of(recipe)
+        self.recipe_id = recipe.pk
+        paginator = Paginator(lineage, self.page_size)
+        try:
+            self.page = paginator.page(self.request.GET.get('page', 1))
+        except EmptyPage:
+            raise Http404
+        except ValueError:
+            raise ApiError('Unknown page.')
+        return self.page.object_list
+
+    def get_etag_extra(self):
+        return (self.recipe_id, self.direction, self.page.number,
+                self.page.has_next())
+
+    def get_data(self, recipes):
+        data = {'recipe': self.recipe_id,
+                'direction': self.direction,
+                'results': recipes,
+                'next': None,
+                'previous': None}
+        if self.page.has_next():
+            data['next'] = page_url(self.request,
+                                    page=self.page.next_page_number())
+        if self.page.has_previous():
+            data['previous'] = page_url(
+                self.request, page=self.page.previous_page_number())
+        return data
+
+
+class RecipeExportApi(View):
+    """Every visible recipe as JSON lines, streamed as it is read.
+
+    Recipes come in primary key order with their ingredients and
+    ancestors, in the export_recipes format. ?author= limits the export
+    to one chef's recipes.
+    """
+    http_method_names = ['get', 'head', 'options']
+    batch_size = 500
+
+    def get(self, request, *args, **kwargs):
+        recipes = Recipe.objects.visible_to(request.user)
+        author = request.GET.get('author')
+        if author:
+            if not author.isdigit():
+                return JsonResponse({'error': 'Unknown author.'}, status=400)
+            recipes = recipes.filter(author=author)
+        response = StreamingHttpResponse(
+            export_lines(recipes, self.batch_size),
+            content_type='application/x-ndjson')
+        patch_cache_control(response, private=True, max_age=0)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+
+class IngredientListApi(View):
+    """Ingredients by id, a page at a time, optionally by name prefix.
+
+    Ingredients carry no version, so the ETag is built from the page's
+    rows and cursor, which is all the body holds, and a matching
+    If-None-Match is answered before the body is built.
+    """
+    http_method_names = ['get', 'head', 'options']
+    page_size = 100
+
+    def get(self, request, *args, **kwargs):
+        ingredients = Ingredient.objects.order_by('pk')
+        query = request.GET.get('q', '').strip()
+        if query:
+            ingredients = ingredients.filter(name__istartswith=query)
+        after = request.GET.get('after', '')
+        if after:
+            if not after.isdigit():
+                return JsonResponse({'error': 'Unknown cursor.'}, status=400)
+            ingredients = ingredients.filter(pk__gt=after)
+        rows = list(ingredients.values_list('pk', 'name', 'usage_count')
+                    [:self.page_size + 1])
+        next_url = None
+        if len(rows) > self.page_size:
+            next_url = page_url(request, after=rows[self.page_size - 1][0])
+        rows = rows[:self.page_size]
+        parts = ['{}:{}:{}'.format(*row) for row in rows]
+        parts.append(next_url or '')
+        etag = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+        if not_modified(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = JsonResponse({
+                'results': [{'id': pk, 'name': name, 'usage_count': count}
+                            for pk, name, count in rows],
+                'next': next_url})
+        set_validators(response, etag)
+        patch_cache_control(response, max_age=0, public=True)
+        return response
@@ -4,4 +4,11 @@ from django.apps import AppConfig
 
 
 class RecipeConfig(AppConfig):
+    """Set up config to Recipe."""
     name = 'recipe'
+
+    def ready(self):
+        """Connect signal handlers and warm the ingredient index."""
+        from recipe import handlers
+        from recipe.ingredient_index import ingredient_index
+        ingredient_index.warm()
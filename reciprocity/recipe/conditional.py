@@ -0,0 +1,41 @@
+"""Answer conditional GETs from validators known before rendering."""
+from calendar import timegm
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+
+def etag_matches(request, etag):
+    """Return whether the request's If-None-Match names etag.
+
+    etag is the unquoted value; weak and strong tags compare alike.
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """Return whether the client's copy is still current.
+
+    If-None-Match is checked when sent, and If-Modified-Since otherwise,
+    against the unquoted etag and the last_modified datetime.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.META.get('HTTP_IF_NONE_MATCH'):
+        return etag is not None and etag_matches(request, etag)
+    since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if since is None or last_modified is None:
+        return False
+    return timegm(last_modified.utctimetuple()) <= since
+
+
+def set_validators(response, etag=None, last_modified=None, weak=False):
+    """Add ETag and Last-Modified headers for the given validators."""
+    if etag is not None:
+        response['ETag'] = '{}"{}"'.format('W/' if weak else '', etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(
+            timegm(last_modified.utctimetuple()))
@@ -0,0 +1,76 @@
+"""Export recipes as JSON lines, a batch of recipes at a time.
+
+Recipes are read in primary key order with keyset batches, each batch
+costing one query for its recipes, one for their ingredients, one for
+their ancestors and one for parents from earlier batches, so memory
+stays flat however many recipes there are. Records use the
+import_recipes format with a few more fields, so an export can be
+imported elsewhere.
+"""
+import json
+from django.utils import six
+from .models import RecipeIngredientRelationship, RecipeLineage
+
+EXPORT_COLUMNS = ('pk', 'parent', 'author', 'title', 'description',
+                  'directions', 'prep_time', 'cook_time', 'privacy',
+                  'created')
+
+
+def export_batches(recipes, batch_size=500):
+    """Yield lists of export records for recipes, in primary key order.
+
+    Each record carries the recipe's ingredients and its ancestors'
+    ids, nearest first. Only a parent and ancestors among recipes are
+    listed, so an export limited to what a user can see names no other
+    recipes, and every parent it names is a record of the export.
+    """
+    last = 0
+    while True:
+        rows = list(recipes.filter(pk__gt=last).order_by('pk')
+                    .values(*EXPORT_COLUMNS)[:batch_size])
+        if not rows:
+            return
+        records = {}
+        recipe_ids = [row['pk'] for row in rows]
+        for row in rows:
+            record = {'id': row.pop('pk'),
+                      'created': row.pop('created').isoformat(),
+                      'ingredients': [],
+                      'ancestors': []}
+            record.update(row)
+            records[record['id']] = record
+        parent_ids = set(record['parent'] for record in records.values()
+                         if record['parent'] is not None) - set(records)
+        if parent_ids:
+            parent_ids = set(recipes.filter(pk__in=parent_ids)
+                             .values_list('pk', flat=True))
+        for record in records.values():
+            if not (record['parent'] in records or
+                    record['parent'] in parent_ids):
+                record['parent'] = None
+        ingredients = (RecipeIngredientRelationship.objects
+                       .filter(recipe__in=records)
+                       .order_by('pk')
+                       .values_list('recipe', 'ingredient__name',
+                                    'quantity'))
+        for recipe, name, quantity in ingredients:
+            records[recipe]['ingredients'].append({'name': name,
+                                                   'quantity': quantity})
+        ancestors = (RecipeLineage.objects
+                     .filter(descendant__in=records, ancestor__in=recipes)
+                     .order_by('depth', 'ancestor')
+                     .values_list('descendant', 'ancestor'))
+        for descendant, ancestor in ancestors:
+            records[descendant]['ancestors'].append(ancestor)
+        yield [records[pk] for pk in recipe_ids]
+        last = recipe_ids[-1]
+
+
+def export_lines(recipes, batch_size=500):
+    """Yield each exported recipe as one line of JSON text.
+
+    Python 2's json.dumps returns bytes, which text files refuse.
+    """
+    for batch in export_batches(recipes, batch_size):
+        for record in batch:
+            yield six.text_type(json.dumps(record, sort_keys=True)) + '\n'
@@ -0,0 +1,147 @@
+"""Keep the home page's latest public recipes feed in the cache."""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import Ingredient, Recipe
+from .pantry import parse_ingredient_ids
+
+FEED_VERSION_KEY = 'latest-public-recipes-version'
+FEED_KEY = 'latest-public-recipes:{}'
+FEED_SIZE = 18
+FEED_BUFFER = 36
+PERSONAL_FEED_VERSION_KEY = 'personal-feed-version'
+PERSONAL_FEED_KEY = 'personal-feed:{}:{}'
+PERSONAL_FEED_WINDOW = 500
+
+
+def get_feed_version(key=FEED_VERSION_KEY):
+    """Return the current version of a feed, starting one if needed.
+
+    New versions start from the clock, as tile versions do, so a version
+    that was evicted never lines up with feeds stored under it before.
+    """
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_latest_public_entries(count=FEED_SIZE):
+    """Return (created, pk) of the newest public recipes, loading them once.
+
+    The feed is stored as (created, pk) pairs holding an exact prefix of
+    the public recipes ordered newest first, under the feed version read
+    before loading them.
+    """
+    key = FEED_KEY.format(get_feed_version())
+    entries = cache.get(key)
+    if entries is None:
+        recipes = Recipe.objects.filter(privacy='pu')
+        recipes = recipes.order_by('-created', '-pk')
+        entries = list(recipes.values_list('created', 'pk')[:FEED_BUFFER])
+        cache.set(key, entries, settings.LATEST_PUBLIC_FEED_TIMEOUT)
+    return entries[:count]
+
+
+def get_latest_public_ids(count=FEED_SIZE):
+    """Return the ids of the newest public recipes."""
+    return [pk for created, pk in get_latest_public_entries(count)]
+
+
+def bump_feed_version(key=FEED_VERSION_KEY):
+    """Move a feed version on, so the next read reloads the feed."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def invalidate_latest_public():
+    """Have the feed reloaded once the current transaction commits.
+
+    The feed is never edited in place, so concurrent writers can not
+    lose each other's changes and a rollback leaves nothing behind. A
+    reader that loaded the rows before the commit stores them under the
+    old version, which is no longer read.
+    """
+    transaction.on_commit(bump_feed_version)
+
+
+def update_latest_public(recipe):
+    """Reload the feed after a saved or deleted recipe commits.
+
+    Only public recipes and those the cached feed lists can change it.
+    """
+    if recipe.privacy != 'pu':
+        entries = cache.get(FEED_KEY.format(get_feed_version()))
+        if entries is not None and recipe.pk not in [
+                pk for created, pk in entries]:
+            return
+    invalidate_latest_public()
+
+
+def rank_for_tastes(liked, disliked):
+    """Return ids of recent public recipes ranked by liked ingredients.
+
+    The newest PERSONAL_FEED_WINDOW public recipes are read with their
+    stored ingredient ids in one query. Recipes using a disliked
+    ingredient are dropped and the rest ordered by how many liked
+    ingredients they use, newest first among equals.
+    """
+    recipes = Recipe.objects.filter(privacy='pu').order_by('-created', '-pk')
+    recipes = recipes.values_list('pk', 'ingredient_ids')
+    scored = []
+    for position, (pk, value) in enumerate(
+            recipes[:PERSONAL_FEED_WINDOW].iterator()):
+        uses = parse_ingredient_ids(value)
+        if not uses & disliked:
+            scored.append((-len(uses & liked), position, pk))
+    scored.sort()
+    return [pk for score, position, pk in scored[:FEED_BUFFER]]
+
+
+def get_personal_feed_ids(user, count=FEED_SIZE):
+    """Return the ids of the recipes to show a logged in user.
+
+    Users who have not liked or disliked any ingredient share the latest
+    public feed. Everyone else gets recipes ranked for their tastes,
+    cached per user for PERSONAL_FEED_TIMEOUT seconds. Cached ids are
+    checked against the recipes still public before they are shown, so
+    a recipe made private or deleted since drops out at once.
+    """
+    key = PERSONAL_FEED_KEY.format(
+        get_feed_version(PERSONAL_FEED_VERSION_KEY), user.pk)
+    recipe_ids = cache.get(key)
+    if recipe_ids is None:
+        ingredients = Ingredient.objects.values_list('pk', flat=True)
+        liked = frozenset(ingredients.filter(liked_by__user=user))
+        disliked = frozenset(ingredients.filter(disliked_by__user=user))
+        recipe_ids = ()
+        if liked or disliked:
+            recipe_ids = rank_for_tastes(liked, disliked)
+        cache.set(key, recipe_ids, settings.PERSONAL_FEED_TIMEOUT)
+    if recipe_ids == ():
+        return get_latest_public_ids(count)
+    public = set(Recipe.objects.filter(pk__in=recipe_ids, privacy='pu')
+                 .values_list('pk', flat=True))
+    return [pk for pk in recipe_ids if pk in public][:count]
+
+
+def invalidate_personal_feeds(user_ids):
+    """Forget the cached feeds of the given users."""
+    version = get_feed_version(PERSONAL_FEED_VERSION_KEY)
+    cache.delete_many([PERSONAL_FEED_KEY.format(version, pk)
+                       for pk in user_ids])
+
+
+def invalidate_all_personal_feeds():
+    """Have every personal feed ranked again once the transaction commits.
+
+    Personal feeds are cached per user, so rather than finding the ones
+    listing a recipe, their shared version moves on.
+    """
+    transaction.on_commit(lambda: bump_feed_version(
+        PERSONAL_FEED_VERSION_KEY))
@@ -1,6 +1,6 @@
 from .models import Ingredient, Recipe, RecipeIngredientRelationship
 from dal import autocomplete
-from django.forms import inlineformset_factory, modelformset_factory, ModelChoiceField, ModelForm, TextInput
+from django.forms import Form, inlineformset_factory, modelformset_factory, ModelChoiceField, ModelForm, ModelMultipleChoiceField, TextInput
 
 
 class IngredientForm(ModelForm):
@@ -28,9 +28,18 @@ class RecipeForm(ModelForm):
         ]
 
 
+class PantryForm(Form):
+    ingredients = ModelMultipleChoiceField(
+        queryset=Ingredient.objects.all(),
+        widget=autocomplete.ModelSelect2Multiple(
+            url='pantry-ingredient-autocomplete')
+    )
+
+
 RecipeIngredientRelationshipFormSet = modelformset_factory(
     RecipeIngredientRelationship,
     fields=('ingredient', 'quantity'),
     widgets={'ingredient': autocomplete.ModelSelect2(url='ingredient-autocomplete'),
              'quantity': TextInput(attrs={'class': 'form-control'})},
-    extra=1)
+    extra=1,
+    can_delete=True)
@@ -0,0 +1,214 @@
+"""Handlers for save and delete events on Recipe and Ingredient models."""
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+    pre_delete,
+    pre_save
+)
+from django.dispatch import receiver
+from django.utils import timezone
+from .feed import invalidate_all_personal_feeds, update_latest_public
+from .ingredient_index import ingredient_index
+from .models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredientRelationship,
+    canonical_name,
+    touch
+)
+from .photos import release_photos
+from .search import index_recipes, unindex_recipe
+from .services import adjust_ingredient_usage, adjust_recipe_counts
+from .tiles import bump_tile_versions
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_saved_recipe_tiles(sender, **kwargs):
+    """Invalidate tiles showing a saved recipe.
+
+    That is the recipe's own tile, its parent's (which shows the latest
+    variation) and its variations' (which show their parent's title).
+    """
+    recipe = kwargs['instance']
+    recipe_ids = [recipe.pk, recipe.parent_id]
+    if not kwargs.get('created', False):
+        recipe_ids.extend(Recipe.objects.filter(parent=recipe)
+                          .values_list('pk', flat=True))
+    bump_tile_versions(recipe_ids)
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_deleted_recipe_tiles(sender, **kwargs):
+    """Invalidate the parent tile, which may show the deleted recipe."""
+    recipe = kwargs['instance']
+    bump_tile_versions([recipe.pk, recipe.parent_id])
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_recipe_photo(sender, **kwargs):
+    """Delete the deleted recipe's photo if no other recipe shares it."""
+    release_photos([kwargs['instance'].photo.name])
+
+
+@receiver(post_save, sender=Recipe)
+def update_feed_for_saved_recipe(sender, **kwargs):
+    """Reload the latest public feed if a saved recipe changes it."""
+    update_latest_public(kwargs['instance'])
+
+
+@receiver(pre_save, sender=Recipe)
+def update_personal_feeds_for_private_recipe(sender, **kwargs):
+    """Re-rank personal feeds when a public recipe is made private.
+
+    Only public recipes are ranked into the feeds, so only that change
+    can leave one listing a recipe its readers may no longer see. The
+    stored privacy is read before it is overwritten, and only for
+    recipes being saved as private.
+    """
+    recipe = kwargs['instance']
+    if (not kwargs.get('raw', False) and recipe.pk is not None and
+            recipe.privacy != 'pu' and
+            Recipe.objects.filter(pk=recipe.pk, privacy='pu').exists()):
+        invalidate_all_personal_feeds()
+
+
+@receiver(post_delete, sender=Recipe)
+def update_feed_for_deleted_recipe(sender, **kwargs):
+    """Reload the latest public feed if a deleted recipe was in it."""
+    update_latest_public(kwargs['instance'])
+
+
+@receiver(post_save, sender=Recipe)
+def index_saved_recipe(sender, **kwargs):
+    """Refresh a saved recipe's full-text index entry once committed.
+
+    Waiting for the commit lets the entry pick up ingredient rows saved
+    after the recipe in the same transaction, so this is the one place
+    a saved recipe is indexed.
+    """
+    recipe_id = kwargs['instance'].pk
+    transaction.on_commit(lambda: index_recipes([recipe_id]))
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_deleted_recipe(sender, **kwargs):
+    """Drop a deleted recipe from the full-text index."""
+    unindex_recipe(kwargs['instance'].pk)
+
+
+@receiver(pre_save, sender=Recipe)
+def date_loaded_recipe(sender, **kwargs):
+    """Give recipes loaded raw from fixtures an updated time."""
+    recipe = kwargs['instance']
+    if kwargs.get('raw', False) and recipe.updated is None:
+        recipe.updated = recipe.created or timezone.now()
+
+
+@receiver(pre_save, sender=Ingredient)
+def set_canonical_name(sender, **kwargs):
+    """Keep an ingredient's canonical name in step with its name.
+
+    Fixture loads save raw but still send this signal, so their rows get
+    canonical names too.
+    """
+    ingredient = kwargs['instance']
+    ingredient.canonical_name = canonical_name(ingredient.name)
+
+
+@receiver(post_save, sender=Ingredient)
+def index_saved_ingredient(sender, **kwargs):
+    """Add a new or renamed ingredient to the autocomplete index."""
+    ingredient = kwargs['instance']
+    ingredient_index.add(ingredient.pk, ingredient.name)
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_renamed_ingredient(sender, **kwargs):
+    """Reindex and re-version the recipes using a renamed ingredient."""
+    if not kwargs.get('created', False):
+        recipe_ids = list(RecipeIngredientRelationship.objects
+                          .filter(ingredient=kwargs['instance'])
+                          .values_list('recipe', flat=True).distinct())
+        index_recipes(recipe_ids)
+        if recipe_ids:
+            Recipe.objects.filter(pk__in=recipe_ids).update(**touch())
+
+
+@receiver(post_delete, sender=Ingredient)
+def unindex_deleted_ingredient(sender, **kwargs):
+    """Remove a deleted ingredient from the autocomplete index."""
+    ingredient_index.remove(kwargs['instance'].pk)
+
+
+@receiver(post_migrate)
+def reset_ingredient_index(sender, **kwargs):
+    """Reload the autocomplete index from the freshly migrated database."""
+    ingredient_index.clear()
+
+
+@receiver(pre_delete, sender=Recipe)
+def release_ingredient_usage(sender, **kwargs):
+    """Decrement usage counts of a deleted recipe's ingredients."""
+    counts = (RecipeIngredientRelationship.objects
+              .filter(recipe=kwargs['instance'])
+              .order_by()
+              .values_list('ingredient')
+              .annotate(Count('pk')))
+    adjust_ingredient_usage(dict((pk, -count) for pk, count in counts))
+
+
+@receiver(post_save, sender=Recipe)
+def count_new_variation(sender, **kwargs):
+    """Count a new variation on its parent."""
+    recipe = kwargs['instance']
+    if kwargs.get('created', False) and recipe.parent_id is not None:
+        adjust_recipe_counts('variation_count', {recipe.parent_id: 1})
+
+
+@receiver(pre_delete, sender=Recipe)
+def uncount_deleted_recipe(sender, **kwargs):
+    """Uncount a deleted recipe on its parent and all of its ancestors.
+
+    This runs before any lineage rows are deleted, once for every recipe
+    in a cascade, so ancestors lose one count per deleted descendant.
+    """
+    recipe = kwargs['instance']
+    if recipe.parent_id is not None:
+        adjust_recipe_counts('variation_count', {recipe.parent_id: -1})
+        Recipe.objects.filter(descendant_links__descendant=recipe).update(
+            descendant_count=F('descendant_count') - 1, **touch())
+
+
+@receiver(m2m_changed, sender=Recipe.favorite_of.through)
+def count_favorites(sender, **kwargs):
+    """Keep Recipe.favorite_count in step with ChefProfile.favorites.
+
+    Additions only report rows that were actually inserted. Removals
+    report whatever was asked for, so the rows about to go are counted
+    before they are deleted.
+    """
+    action, instance = kwargs['action'], kwargs['instance']
+    pk_set, reverse = kwargs['pk_set'], kwargs['reverse']
+    if action == 'post_add':
+        if reverse:
+            deltas = {instance.pk: len(pk_set)}
+        else:
+            deltas = dict((pk, 1) for pk in pk_set)
+    elif action in ('pre_remove', 'pre_clear'):
+        if reverse:
+            rows = sender.objects.filter(recipe=instance)
+            if pk_set is not None:
+                rows = rows.filter(chefprofile__in=pk_set)
+        else:
+            rows = sender.objects.filter(chefprofile=instance)
+            if pk_set is not None:
+                rows = rows.filter(recipe__in=pk_set)
+        deltas = dict((pk, -count) for pk, count in rows.order_by()
+                      .values_list('recipe').annotate(Count('pk')))
+    else:
+        return
+    adjust_recipe_counts('favorite_count', deltas)
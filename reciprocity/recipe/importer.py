@@ -0,0 +1,353 @@
+"""Import recipes in bulk from JSON lines or CSV files.
+
+Records stream through generators, so a file of any size is read once
+and never held in memory: rows are read, parsed into ImportRecords and
+grouped into batches, and each batch is written in one transaction with
+a handful of set-based statements. Every imported recipe stores an
+import key made of the source name and the record's id, so records a
+failed run already committed are skipped when the import is repeated.
+
+A JSON lines record is an object such as::
+
+    {"id": "42", "parent": "7", "title": "Soup", "directions": "Stir.",
+     "ingredients": [{"name": "leek", "quantity": "2"}]}
+
+CSV files have the same columns, with ingredients written as
+"name|quantity" pairs separated by semicolons. A parent names the id of
+an earlier record from the same source.
+"""
+import csv
+import io
+import json
+from collections import Counter, OrderedDict, namedtuple
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+from django.utils import six
+from .feed import invalidate_latest_public
+from .ingredient_index import ingredient_index
+from .models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredientRelationship,
+    RecipeLineage,
+    canonical_name
+)
+from .search import index_recipes
+from .services import (
+    adjust_ingredient_usage,
+    adjust_recipe_counts,
+    format_ingredient_ids
+)
+from .tiles import bump_tile_versions
+
+RECIPE_COLUMNS = ('title', 'description', 'directions', 'prep_time',
+                  'cook_time', 'privacy')
+NAME_LENGTH = Ingredient._meta.get_field('name').max_length
+QUANTITY_LENGTH = RecipeIngredientRelationship._meta.get_field(
+    'quantity').max_length
+
+ImportRecord = namedtuple('ImportRecord', ('line', 'key', 'parent_key',
+                                           'recipe', 'ingredients'))
+
+
+class RecordError(Exception):
+    """A record that can not be imported, reported and skipped."""
+
+
+class ImportStats(object):
+    """Running counts of one import, for progress reports."""
+
+    def __init__(self):
+        self.records = 0
+        self.created = 0
+        self.existing = 0
+        self.skipped = 0
+        self.ingredients = 0
+        self.line = 0
+
+
+def read_jsonl(lines):
+    """Yield (line number, record) for each non-blank JSON line."""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            record = RecordError('Invalid JSON: {}'.format(error))
+        yield number, record
+
+
+def open_records(path, file_format):
+    """Open a file of records for its reader.
+
+    Python 2's csv module reads bytes, so CSV files are opened in binary
+    there and their cells decoded by read_csv; everything else is read
+    as UTF-8 text.
+    """
+    if six.PY2 and file_format == 'csv':
+        return open(path, 'rb')
+    return io.open(path, encoding='utf-8', newline='')
+
+
+def decode_cell(value):
+    """Return a CSV cell read as UTF-8 bytes as text."""
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, list):
+        return [decode_cell(item) for item in value]
+    return value
+
+
+def read_csv(lines):
+    """Yield (line number, record) for each CSV row after the header.
+
+    On Python 2 lines are bytes, and every cell is decoded from UTF-8.
+    """
+    reader = csv.DictReader(lines)
+    for row in reader:
+        if six.PY2:
+            row = dict((decode_cell(key), decode_cell(value))
+                       for key, value in row.items())
+        ingredients = []
+        for pair in (row.get('ingredients') or '').split(';'):
+            if pair.strip():
+                name, _, quantity = pair.partition('|')
+                ingredients.append({'name': name, 'quantity': quantity})
+        row['ingredients'] = ingredients
+        yield reader.line_num, row
+
+
+def import_key(source, record_id):
+    """Return the key a recipe imported from source is stored under."""
+    return '{}:{}'.format(source, record_id)
+
+
+def parse_record(line, data, source):
+    """Return an ImportRecord for one record read from source.
+
+    Recipe fields are cleaned as the recipe form would clean them.
+    Records without an id are keyed by their line number.
+    """
+    if isinstance(data, RecordError):
+        raise data
+    if not isinstance(data, dict):
+        raise RecordError('Expected an object.')
+    record_id = data.get('id')
+    if record_id in (None, ''):
+        record_id = 'line-{}'.format(line)
+    parent = data.get('parent')
+    recipe = Recipe(**dict((column, data[column]) for column in RECIPE_COLUMNS
+                           if data.get(column) not in (None, '')))
+    recipe.import_key = import_key(source, record_id)
+    try:
+        recipe.clean_fields(exclude=['author'])
+    except ValidationError as error:
+        raise RecordError('; '.join(
+            '{}: {}'.format(field, ' '.join(messages))
+            for field, messages in sorted(error.message_dict.items())))
+    ingredients = []
+    for ingredient in data.get('ingredients') or ():
+        try:
+            name = ' '.join(ingredient['name'].split())
+            quantity = ingredient.get('quantity') or ''
+            quantity = ' '.join(six.text_type(quantity).split())
+        except (AttributeError, KeyError, TypeError):
+            raise RecordError('Ingredients need a name and a quantity.')
+        if not canonical_name(name) or len(name) > NAME_LENGTH:
+            raise RecordError('Invalid ingredient name: {!r}.'.format(name))
+        if len(quantity) > QUANTITY_LENGTH:
+            raise RecordError('Quantity too long: {!r}.'.format(quantity))
+        ingredients.append((name, quantity))
+    return ImportRecord(
+        line=line,
+        key=recipe.import_key,
+        parent_key=(None if parent in (None, '') else
+                    import_key(source, parent)),
+        recipe=recipe,
+        ingredients=ingredients)
+
+
+def parse_records(rows, source, stats, report):
+    """Yield ImportRecords, reporting and counting unreadable ones."""
+    for line, data in rows:
+        stats.records += 1
+        stats.line = line
+        try:
+            yield parse_record(line, data, source)
+        except RecordError as error:
+            stats.skipped += 1
+            report(line, error)
+
+
+def batches(iterable, size):
+    """Yield lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def lookup_ingredients(canonical_names, chunk_size):
+    """Return the oldest ingredient id for each canonical name found."""
+    found = {}
+    for chunk in batches(canonical_names, chunk_size):
+        rows = (Ingredient.objects.filter(canonical_name__in=chunk)
+                .order_by('-pk').values_list('canonical_name', 'pk'))
+        found.update(rows)
+    return found
+
+
+def resolve_ingredients(names, chunk_size):
+    """Return ingredient ids by name and how many had to be created.
+
+    Names match existing ingredients canonically, as on the recipe
+    form. Missing ingredients are created with one bulk INSERT, under
+    the first of their spellings in names, and added to the autocomplete
+    index.
+    """
+    keys = dict((name, canonical_name(name)) for name in names)
+    found = lookup_ingredients(set(keys.values()), chunk_size)
+    missing = {}
+    for name in names:
+        if keys[name] not in found:
+            missing.setdefault(keys[name], name)
+    if missing:
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, canonical_name=key)
+             for key, name in missing.items()],
+            batch_size=chunk_size)
+        created = lookup_ingredients(missing, chunk_size)
+        for key, pk in created.items():
+            ingredient_index.add(pk, missing[key], publish=False)
+        ingredient_index.publish()
+        found.update(created)
+    return dict((name, found[key]) for name, key in keys.items()), len(missing)
+
+
+def import_batch(records, author, stats, report, chunk_size=500):
+    """Write one batch of records in a single transaction.
+
+    Records already imported are skipped, as are records whose parent
+    is neither imported nor earlier in the batch. Ingredients are
+    resolved with one lookup, then recipes, ingredient rows and lineage
+    rows are each inserted in bulk. The denormalized counters, stored
+    ingredient ids and search entries are kept as saving each recipe
+    through the form would keep them.
+    """
+    keys = [record.key for record in records]
+    with transaction.atomic():
+        existing = set()
+        for chunk in batches(keys, chunk_size):
+            existing.update(Recipe.objects.filter(import_key__in=chunk)
+                            .values_list('import_key', flat=True))
+        parents = {}
+        for chunk in batches(set(record.parent_key for record in records
+                                 if record.parent_key), chunk_size):
+            parents.update(Recipe.objects.filter(import_key__in=chunk)
+                           .values_list('import_key', 'pk'))
+        new, added = [], set()
+        for record in records:
+            if record.key in existing or record.key in added:
+                stats.existing += 1
+                continue
+            if record.parent_key and not (record.parent_key in parents or
+                                          record.parent_key in added):
+                stats.skipped += 1
+                report(record.line, RecordError(
+                    'Unknown parent {!r}.'.format(record.parent_key)))
+                continue
+            added.add(record.key)
+            new.append(record)
+        if not new:
+            return
+        names = OrderedDict((name, None) for record in new
+                            for name, quantity in record.ingredients)
+        ingredient_ids, created_ingredients = resolve_ingredients(
+            list(names), chunk_size)
+        for record in new:
+            record.recipe.author = author
+            record.recipe.parent_id = parents.get(record.parent_key)
+            ids = [ingredient_ids[name] for name, quantity in
+                   record.ingredients]
+            record.recipe.ingredient_ids = format_ingredient_ids(ids)
+            record.recipe.ingredient_count = len(ids)
+        Recipe.objects.bulk_create([record.recipe for record in new],
+                                   batch_size=chunk_size)
+        recipe_ids = {}
+        for chunk in batches([record.key for record in new], chunk_size):
+            recipe_ids.update(Recipe.objects.filter(import_key__in=chunk)
+                              .values_list('import_key', 'pk'))
+        recipe_ids.update(parents)
+        _link_parents(new, recipe_ids)
+        RecipeIngredientRelationship.objects.bulk_create(
+            [RecipeIngredientRelationship(recipe_id=recipe_ids[record.key],
+                                          ingredient_id=ingredient_ids[name],
+                                          quantity=quantity)
+             for record in new for name, quantity in record.ingredients],
+            batch_size=chunk_size)
+        adjust_ingredient_usage(Counter(
+            ingredient_ids[name]
+            for record in new for name, quantity in record.ingredients))
+        _add_lineage(new, recipe_ids, set(parents.values()), chunk_size)
+        index_recipes(recipe_ids[record.key] for record in new)
+        bump_tile_versions(list(parents.values()))
+        if any(record.recipe.privacy == 'pu' for record in new):
+            invalidate_latest_public()
+    stats.created += len(new)
+    stats.ingredients += created_ingredients
+
+
+def _link_parents(records, recipe_ids):
+    """Point recipes at parents imported in their own batch."""
+    linked = dict((recipe_ids[record.key], recipe_ids[record.parent_key])
+                  for record in records
+                  if record.parent_key and record.recipe.parent_id is None)
+    if linked:
+        Recipe.objects.filter(pk__in=linked).update(parent=Case(
+            *[When(pk=pk, then=Value(parent)) for pk, parent in
+              linked.items()],
+            output_field=IntegerField()))
+
+
+def _add_lineage(records, recipe_ids, known_parents, chunk_size):
+    """Insert the lineage rows of new variations and count them.
+
+    The ancestors of parents imported earlier are read in one query;
+    those of parents from this batch follow from the records before
+    them, so the rows are built in file order without further reads.
+    """
+    lineage = dict((pk, []) for pk in known_parents)
+    rows = (RecipeLineage.objects.filter(descendant__in=known_parents)
+            .values_list('descendant', 'ancestor', 'depth'))
+    for descendant, ancestor, depth in rows:
+        lineage[descendant].append((ancestor, depth))
+    links, variations, descendants = [], Counter(), Counter()
+    for record in records:
+        if not record.parent_key:
+            continue
+        pk, parent = recipe_ids[record.key], recipe_ids[record.parent_key]
+        lineage[pk] = [(parent, 1)] + [(ancestor, depth + 1) for
+                                       ancestor, depth in
+                                       lineage.get(parent, ())]
+        variations[parent] += 1
+        for ancestor, depth in lineage[pk]:
+            links.append(RecipeLineage(ancestor_id=ancestor,
+                                       descendant_id=pk,
+                                       depth=depth))
+            descendants[ancestor] += 1
+    if not links:
+        return
+    RecipeLineage.objects.bulk_create(links, batch_size=chunk_size)
+    Recipe.ancestors.through.objects.bulk_create(
+        [Recipe.ancestors.through(from_recipe_id=link.descendant_id,
+                                  to_recipe_id=link.ancestor_id)
+         for link in links],
+        batch_size=chunk_size)
+    adjust_recipe_counts('variation_count', variations)
+    adjust_recipe_counts('descendant_count', descendants)
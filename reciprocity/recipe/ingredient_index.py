@@ -0,0 +1,260 @@
+"""Answer ingredient name prefix lookups from an in-process sorted index."""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.utils import six
+from .models import Ingredient
+
+VERSION_KEY = 'ingredient-index-version'
+SYNC_INTERVAL = 5
+RELOAD_INTERVAL = 60 * 60
+SHORT_PREFIX = 2
+TOP_MATCHES = 50
+
+
+def normalize_name(name):
+    """Return an ingredient name lowercased with whitespace collapsed."""
+    return ' '.join(name.lower().split())
+
+
+def short_prefixes(name):
+    """Return the prefixes of a normalized name that keep top lists."""
+    return set(name[:length] for length in range(SHORT_PREFIX + 1))
+
+
+class IngredientMatches(object):
+    """Lazy sequence of the ingredients in a range of the index.
+
+    Matches are ranked by usage count, most used first, then by name.
+    Slicing resolves only the sliced ids against the database, dropping
+    rows that were deleted or renamed since the index was built. Short
+    prefixes come with their ranked top list, which answers the first
+    TOP_MATCHES without scanning the range.
+    """
+    model = Ingredient
+
+    def __init__(self, entries, usage, prefix, start, stop, top=None):
+        self.entries = entries
+        self.usage = usage
+        self.prefix = prefix
+        self.start = start
+        self.stop = stop
+        self.top = top
+
+    def rank(self, entry):
+        """Return the sort key placing popular ingredients first."""
+        return -self.usage.get(entry[1], 0), entry
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, step = index.indices(len(self))
+        if self.top is not None and (stop <= len(self.top) or
+                                     len(self.top) < TOP_MATCHES):
+            ranked = self.top
+        else:
+            ranked = heapq.nsmallest(stop,
+                                     self.entries[self.start:self.stop],
+                                     key=self.rank)
+        ids = [pk for name, pk in ranked[start:stop:step]]
+        ingredients = Ingredient.objects.in_bulk(ids)
+        return [ingredients[pk] for pk in ids if pk in ingredients and
+                normalize_name(ingredients[pk].name).startswith(self.prefix)]
+
+
+class IngredientIndex(object):
+    """Sorted list of (normalized name, pk) pairs for every ingredient.
+
+    Writers replace the list rather than mutating it, so lookups can use
+    a snapshot without locking. Ingredients created by other processes
+    are pulled in by id every SYNC_INTERVAL seconds once the shared
+    version in the cache moves; renames, deletions and usage counts from
+    other processes are picked up by a full reload every RELOAD_INTERVAL.
+
+    Prefixes of up to SHORT_PREFIX characters match most of the index,
+    so their TOP_MATCHES best ranked entries are kept in self.top, built
+    on first use and then kept in order as entries and usage change.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Forget all entries so the next lookup reloads them."""
+        self.entries = None
+        self.names = {}
+        self.usage = {}
+        self.top = {}
+        self.max_pk = 0
+        self.version = None
+        self.loaded = 0
+        self.synced = 0
+
+    def warm(self):
+        """Load the index, leaving it empty if the table is not there yet."""
+        try:
+            self.load()
+        except DatabaseError:
+            self.clear()
+
+    def load(self):
+        """Build the index from every ingredient in the database."""
+        with self.lock:
+            version = cache.get(VERSION_KEY)
+            rows = Ingredient.objects.values_list('pk', 'name', 'usage_count')
+            names, usage = {}, {}
+            for pk, name, usage_count in rows:
+                names[pk] = normalize_name(name)
+                usage[pk] = usage_count
+            self.entries = sorted((name, pk) for pk, name in names.items())
+            self.names = names
+            self.usage = usage
+            self.top = {}
+            self.max_pk = max(names) if names else 0
+            self.version = version
+            self.loaded = self.synced = time.time()
+
+    def sync(self):
+        """Pull in ingredients created elsewhere since the last sync."""
+        if (self.entries is None or
+                time.time() - self.loaded > RELOAD_INTERVAL):
+            self.load()
+            return
+        if time.time() - self.synced < SYNC_INTERVAL:
+            return
+        self.synced = time.time()
+        version = cache.get(VERSION_KEY)
+        if version == self.version:
+            return
+        rows = Ingredient.objects.filter(pk__gt=self.max_pk)
+        for pk, name, usage_count in rows.values_list('pk', 'name',
+                                                      'usage_count'):
+            self.usage[pk] = usage_count
+            self.add(pk, name, publish=False)
+        self.version = version
+
+    def rank(self, entry):
+        """Return the sort key placing popular ingredients first."""
+        return -self.usage.get(entry[1], 0), entry
+
+    def adjust_usage(self, deltas):
+        """Apply usage count changes made by this process."""
+        if self.entries is not None:
+            with self.lock:
+                for pk, delta in deltas.items():
+                    self.usage[pk] = self.usage.get(pk, 0) + delta
+                    if pk in self.names:
+                        self._rerank(pk, self.names[pk])
+
+    def add(self, pk, name, publish=True):
+        """Insert or rename one ingredient."""
+        if self.entries is not None:
+            with self.lock:
+                entries = self._without(pk)
+                if pk in self.names:
+                    self._rerank(pk, self.names[pk], dropped=True)
+                name = normalize_name(name)
+                entries.insert(bisect_left(entries, (name, pk)), (name, pk))
+                self._rerank(pk, name)
+                self.names[pk] = name
+                self.max_pk = max(self.max_pk, pk)
+                self.entries = entries
+        if publish:
+            self.publish()
+
+    def remove(self, pk):
+        """Drop one ingredient."""
+        if self.entries is not None:
+            with self.lock:
+                self.entries = self._without(pk)
+                if pk in self.names:
+                    self._rerank(pk, self.names[pk], dropped=True)
+                self.names.pop(pk, None)
+                self.usage.pop(pk, None)
+        self.publish()
+
+    def publish(self):
+        """Tell other processes that the ingredient table changed."""
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, None)
+
+    def search(self, prefix):
+        """Return the ingredients whose normalized names start with prefix."""
+        self.sync()
+        entries = self.entries
+        prefix = normalize_name(prefix)
+        start = bisect_left(entries, (prefix,))
+        if prefix:
+            upper = prefix[:-1] + six.unichr(ord(prefix[-1]) + 1)
+            stop = bisect_left(entries, (upper,), start)
+        else:
+            stop = len(entries)
+        top = None
+        if len(prefix) <= SHORT_PREFIX:
+            top = self.top.get(prefix)
+            if top is None:
+                top = self._build_top(prefix, entries, start, stop)
+        return IngredientMatches(entries, self.usage, prefix, start, stop,
+                                 top)
+
+    def _build_top(self, prefix, entries, start, stop):
+        """Rank one short prefix's range once and keep its top list."""
+        with self.lock:
+            top = heapq.nsmallest(TOP_MATCHES, entries[start:stop],
+                                  key=self.rank)
+            if entries is self.entries:
+                tops = dict(self.top)
+                tops[prefix] = top
+                self.top = tops
+        return top
+
+    def _rerank(self, pk, name, dropped=False):
+        """Move one entry within the top lists of its name's prefixes.
+
+        A full list that loses an entry, or sees it fall below its last
+        one, may now miss an entry it never held, so it is forgotten and
+        rebuilt on the next search. Lists are replaced, never changed.
+        """
+        entry = (name, pk)
+        top = dict(self.top)
+        for prefix in short_prefixes(name):
+            ranked = top.get(prefix)
+            if ranked is None:
+                continue
+            full = len(ranked) >= TOP_MATCHES
+            rest = [other for other in ranked if other != entry]
+            held = len(rest) < len(ranked)
+            if not dropped and (not full or
+                                self.rank(entry) < self.rank(rest[-1])):
+                rest.append(entry)
+                top[prefix] = sorted(rest, key=self.rank)[:TOP_MATCHES]
+            elif held and full:
+                del top[prefix]
+            else:
+                top[prefix] = rest
+        self.top = top
+
+    def _without(self, pk):
+        """Return a copy of the entries without the given ingredient."""
+        entries = list(self.entries)
+        name = self.names.get(pk)
+        if name is not None:
+            position = bisect_left(entries, (name, pk))
+            if position < len(entries) and entries[position] == (name, pk):
+                del entries[position]
+        return entries
+
+
+ingredient_index = IngredientIndex()
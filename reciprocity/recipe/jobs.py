@@ -0,0 +1,117 @@
+"""Queue photo resizing outside the request that stored the photo.
+
+Jobs are rows in the PhotoJob table, so queuing one is a single INSERT
+in the uploading request's transaction and no broker is needed. The
+photo_worker command claims pending jobs with a conditional UPDATE that
+names the worker, so several workers can share the table without
+running a job twice. Recipes show a placeholder until their photo's
+job is done.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import PhotoJob, Recipe, touch
+from .photos import generate_thumbnails
+from .tiles import bump_tile_versions
+
+MAX_ATTEMPTS = 3
+
+
+def queue_photos(names):
+    """Queue stored photos for resizing."""
+    PhotoJob.objects.bulk_create([PhotoJob(photo=name) for name in names])
+
+
+def show_stored_photo(recipe, name):
+    """Queue a recipe's newly stored photo unless it is resized already.
+
+    Identical uploads share one stored file, so a photo another recipe
+    already shows is ready at once. Returns whether it is ready.
+    """
+    if Recipe.objects.filter(photo=name, photo_ready=True).exists():
+        Recipe.objects.filter(pk=recipe.pk).update(
+            photo_ready=True, **touch())
+        recipe.photo_ready = True
+    else:
+        queue_photos([name])
+    return recipe.photo_ready
+
+
+def claim_jobs(worker, limit):
+    """Mark up to limit pending jobs as run by worker and return them.
+
+    A job another worker claimed between the two statements is not
+    updated again and so is not returned.
+    """
+    pending = PhotoJob.objects.filter(status='pe')
+    job_ids = list(pending.order_by('pk').values_list('pk', flat=True)[:limit])
+    if not job_ids:
+        return []
+    pending.filter(pk__in=job_ids).update(status='ru',
+                                          worker=worker,
+                                          started=timezone.now(),
+                                          attempts=F('attempts') + 1)
+    return list(PhotoJob.objects.filter(pk__in=job_ids,
+                                        status='ru',
+                                        worker=worker))
+
+
+def requeue_stale_jobs(timeout, max_attempts=MAX_ATTEMPTS):
+    """Return jobs running for longer than timeout seconds to the queue.
+
+    Their worker is taken to have died, which counts as a failed
+    attempt: claiming already counted it, so jobs that have been tried
+    max_attempts times fail rather than take down worker after worker.
+    Returns the number requeued.
+    """
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    stale = PhotoJob.objects.filter(status='ru', started__lt=cutoff)
+    stale.filter(attempts__gte=max_attempts).update(
+        status='fa', worker='', error='Worker stopped responding.')
+    return stale.filter(attempts__lt=max_attempts).update(status='pe',
+                                                          worker='')
+
+
+def resize_photo(name):
+    """Write one photo's thumbnails and return (name, error).
+
+    Runs in worker processes, which only touch photo files. The error
+    is empty on success; any failure is reported rather than raised so
+    one broken upload does not stop the pool.
+    """
+    try:
+        generate_thumbnails(name)
+    except Exception as error:
+        return name, '{}: {}'.format(type(error).__name__, error)
+    return name, ''
+
+
+def mark_photos_ready(names):
+    """Show the thumbnails of photos on every recipe using them."""
+    recipes = Recipe.objects.filter(photo__in=names, photo_ready=False)
+    recipe_ids = list(recipes.values_list('pk', flat=True))
+    if recipe_ids:
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            photo_ready=True, **touch())
+        bump_tile_versions(recipe_ids)
+
+
+def finish_jobs(jobs, errors, max_attempts=MAX_ATTEMPTS):
+    """Record the outcome of claimed jobs.
+
+    errors maps the names of photos that could not be resized to their
+    error. Those jobs go back to the queue until they have been tried
+    max_attempts times; the others are done and their photos shown.
+    """
+    done = [job for job in jobs if job.photo not in errors]
+    with transaction.atomic():
+        PhotoJob.objects.filter(pk__in=[job.pk for job in done]).update(
+            status='do', error='')
+        for job in jobs:
+            if job.photo in errors:
+                PhotoJob.objects.filter(pk=job.pk).update(
+                    status='fa' if job.attempts >= max_attempts else 'pe',
+                    worker='',
+                    error=errors[job.photo])
+        mark_photos_ready(set(job.photo for job in done))
@@ -0,0 +1,79 @@
+"""Rebuild the recipe lineage closure table from existing recipe data."""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from recipe.models import Recipe, RecipeLineage
+
+
+class Command(BaseCommand):
+    help = ('Rebuild RecipeLineage from Recipe.parent, one generation per '
+            'statement, and sync Recipe.ancestors and descendant counts '
+            'to match.')
+
+    def handle(self, *args, **options):
+        """Fill the closure table level by level inside one transaction.
+
+        Recipes whose descendant count the rebuild changes are recounted
+        and touched in the same transaction, so cached copies expire.
+        """
+        recipes = Recipe._meta.db_table
+        lineage = RecipeLineage._meta.db_table
+        ancestors = Recipe.ancestors.through._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(lineage))
+            cursor.execute(
+                'INSERT INTO {lineage} (ancestor_id, descendant_id, depth) '
+                'SELECT parent_id, id, 1 FROM {recipes} '
+                'WHERE parent_id IS NOT NULL'.format(lineage=lineage,
+                                                     recipes=recipes)
+            )
+            total = cursor.rowcount
+            depth = 1
+            while cursor.rowcount:
+                cursor.execute(
+                    'INSERT INTO {lineage} '
+                    '(ancestor_id, descendant_id, depth) '
+                    'SELECT l.ancestor_id, r.id, l.depth + 1 '
+                    'FROM {lineage} l '
+                    'JOIN {recipes} r ON r.parent_id = l.descendant_id '
+                    'WHERE l.depth = %s'.format(lineage=lineage,
+                                                recipes=recipes),
+                    [depth]
+                )
+                total += cursor.rowcount
+                depth += 1
+            cursor.execute(
+                'SELECT COUNT(*) FROM {ancestors} a WHERE NOT EXISTS ('
+                'SELECT 1 FROM {lineage} l '
+                'WHERE l.descendant_id = a.from_recipe_id '
+                'AND l.ancestor_id = a.to_recipe_id)'.format(
+                    ancestors=ancestors, lineage=lineage)
+            )
+            orphaned = cursor.fetchone()[0]
+            cursor.execute(
+                'INSERT INTO {ancestors} (from_recipe_id, to_recipe_id) '
+                'SELECT l.descendant_id, l.ancestor_id FROM {lineage} l '
+                'WHERE NOT EXISTS (SELECT 1 FROM {ancestors} a '
+                'WHERE a.from_recipe_id = l.descendant_id '
+                'AND a.to_recipe_id = l.ancestor_id)'.format(
+                    ancestors=ancestors, lineage=lineage)
+            )
+            descendants = ('(SELECT COUNT(*) FROM {lineage} l '
+                           'WHERE l.ancestor_id = {recipes}.id)'.format(
+                               lineage=lineage, recipes=recipes))
+            cursor.execute(
+                'UPDATE {recipes} SET descendant_count = {descendants}, '
+                'version = version + 1, updated = %s '
+                'WHERE descendant_count <> {descendants}'.format(
+                    recipes=recipes, descendants=descendants),
+                [timezone.now()]
+            )
+            recounted = cursor.rowcount
+        self.stdout.write('Stored {} lineage rows over {} generations.'.format(
+            total, depth - 1))
+        self.stdout.write('Recounted descendants of {} recipes.'.format(
+            recounted))
+        if orphaned:
+            self.stderr.write('{} Recipe.ancestors rows are not reachable '
+                              'through Recipe.parent and were skipped.'.format(
+                                  orphaned))
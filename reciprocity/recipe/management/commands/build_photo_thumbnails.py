@@ -0,0 +1,28 @@
+"""Generate the thumbnail sizes of stored recipe photos."""
+from django.core.management.base import BaseCommand
+from recipe.jobs import mark_photos_ready
+from recipe.models import Recipe
+from recipe.photos import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = ('Write the tile, detail and retina sizes of every recipe photo '
+            'in this process, keeping thumbnails already stored.')
+
+    def handle(self, *args, **options):
+        """Resize each distinct stored photo once."""
+        names = (Recipe.objects.exclude(photo='').order_by('photo')
+                 .values_list('photo', flat=True).distinct())
+        done = failed = 0
+        for name in names.iterator():
+            try:
+                generate_thumbnails(name)
+            except (IOError, OSError) as error:
+                failed += 1
+                self.stderr.write('Could not resize {}: {}'.format(
+                    name, error))
+            else:
+                mark_photos_ready([name])
+                done += 1
+        self.stdout.write('Resized {} photos, {} failed.'.format(
+            done, failed))
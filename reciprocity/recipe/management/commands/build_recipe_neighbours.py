@@ -0,0 +1,55 @@
+"""Rebuild the similar recipes table from every recipe's ingredients."""
+import heapq
+from collections import Counter, defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipe.models import Recipe
+from recipe.pantry import parse_ingredient_ids
+from recipe.similar import NEIGHBOURS, jaccard, store_neighbours
+
+
+class Command(BaseCommand):
+    help = ('Recompute the most similar public recipes of every recipe '
+            'and store them in RecipeNeighbour.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Recipes whose neighbours are stored per '
+                                 'transaction.')
+        parser.add_argument('--neighbours', type=int, default=NEIGHBOURS,
+                            help='Neighbours kept per recipe.')
+
+    def handle(self, *args, **options):
+        """Score every recipe against the public recipes sharing ingredients.
+
+        Ingredient sets are loaded once and inverted into posting lists of
+        public recipes per ingredient. Counting a recipe's postings gives
+        its overlap with every candidate, which is one sparse row of the
+        recipe-by-recipe co-occurrence matrix, without touching recipes
+        that share nothing with it.
+        """
+        batch_size = options['batch_size']
+        count = options['neighbours']
+        vectors, postings = {}, defaultdict(list)
+        rows = Recipe.objects.values_list('pk', 'privacy', 'ingredient_ids')
+        for pk, privacy, value in rows.iterator():
+            vectors[pk] = uses = parse_ingredient_ids(value)
+            if privacy == 'pu':
+                for ingredient in uses:
+                    postings[ingredient].append(pk)
+        recipe_ids = sorted(vectors)
+        for start in range(0, len(recipe_ids), batch_size):
+            neighbours = {}
+            for pk in recipe_ids[start:start + batch_size]:
+                uses = vectors[pk]
+                shared = Counter()
+                for ingredient in uses:
+                    shared.update(postings[ingredient])
+                shared.pop(pk, None)
+                neighbours[pk] = heapq.nlargest(count, (
+                    (jaccard(overlap, len(uses), len(vectors[other])), other)
+                    for other, overlap in shared.items()))
+            with transaction.atomic():
+                store_neighbours(neighbours)
+            self.stdout.write('Stored neighbours of {} of {} recipes.'.format(
+                min(start + batch_size, len(recipe_ids)), len(recipe_ids)))
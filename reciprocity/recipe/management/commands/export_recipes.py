@@ -0,0 +1,55 @@
+"""Export recipes with their ingredients and lineage as JSON lines."""
+import io
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from recipe.exporter import export_lines
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Write every recipe, or one chef\'s, as JSON lines that '
+            'import_recipes can read, a keyset batch at a time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output',
+                            help='File to write; standard output by '
+                                 'default.')
+        parser.add_argument('--author',
+                            help='Only export recipes by this username.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Recipes read per batch of queries.')
+
+    def handle(self, *args, **options):
+        """Stream the export to the output, then report how it went.
+
+        The report goes to standard error when the export itself is
+        written to standard output.
+        """
+        recipes = Recipe.objects.all()
+        if options['author']:
+            user_model = get_user_model()
+            try:
+                author = user_model.objects.get(
+                    **{user_model.USERNAME_FIELD: options['author']})
+            except user_model.DoesNotExist:
+                raise CommandError('Unknown author {!r}.'.format(
+                    options['author']))
+            recipes = recipes.filter(author=author)
+        started = time.time()
+        count = 0
+        if options['output']:
+            output = io.open(options['output'], 'w', encoding='utf-8')
+            report = self.stdout
+        else:
+            output, report = self.stdout, self.stderr
+        try:
+            for line in export_lines(recipes, options['batch_size']):
+                output.write(line)
+                count += 1
+        finally:
+            if output is not self.stdout:
+                output.close()
+        elapsed = time.time() - started
+        report.write('Exported {} recipes in {:.1f}s ({:.0f} recipes/s).'
+                     .format(count, elapsed, count / max(elapsed, 1e-6)))
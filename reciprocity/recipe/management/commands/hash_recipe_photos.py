@@ -0,0 +1,50 @@
+"""Move recipe photos stored under upload names to content hash names."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipe.jobs import queue_photos
+from recipe.models import Recipe, touch
+from recipe.photos import release_photos
+from recipe.storage import is_content_addressed, photo_storage
+from recipe.tiles import bump_tile_versions
+
+
+class Command(BaseCommand):
+    help = ('Rename recipe photos uploaded before content addressed storage '
+            'to the hash of their content, merging identical files.')
+
+    def handle(self, *args, **options):
+        """Store each old photo under its hash and repoint its recipes.
+
+        Recipes show a placeholder until the photo worker has resized the
+        renamed photo, unless another recipe already shows it. Renamed
+        files are deleted once no recipe uses them, so an interrupted
+        run picks up where it stopped when started again.
+        """
+        names = (Recipe.objects.exclude(photo='').order_by('photo')
+                 .values_list('photo', flat=True).distinct())
+        old_names = [name for name in names.iterator()
+                     if not is_content_addressed(name)]
+        moved = missing = 0
+        for name in old_names:
+            if not photo_storage.exists(name):
+                missing += 1
+                self.stderr.write('Photo {} is missing.'.format(name))
+                continue
+            with photo_storage.open(name) as photo:
+                new_name = photo_storage.save(name, photo)
+            with transaction.atomic():
+                ready = Recipe.objects.filter(photo=new_name,
+                                              photo_ready=True).exists()
+                recipe_ids = list(Recipe.objects.filter(photo=name)
+                                  .values_list('pk', flat=True))
+                Recipe.objects.filter(pk__in=recipe_ids).update(
+                    photo=new_name,
+                    photo_ready=ready,
+                    **touch())
+                if not ready:
+                    queue_photos([new_name])
+            bump_tile_versions(recipe_ids)
+            release_photos([name])
+            moved += 1
+        self.stdout.write('Moved {} of {} photos, {} missing.'.format(
+            moved, len(old_names), missing))
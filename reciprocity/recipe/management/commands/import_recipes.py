@@ -0,0 +1,99 @@
+"""Import recipes from a JSON lines or CSV file."""
+import os
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from recipe.importer import (
+    ImportStats,
+    batches,
+    import_batch,
+    open_records,
+    parse_records,
+    read_csv,
+    read_jsonl
+)
+
+READERS = {
+    'jsonl': read_jsonl,
+    'csv': read_csv,
+}
+
+
+class Command(BaseCommand):
+    help = ('Import recipes from a JSON lines or CSV file, a batch per '
+            'transaction. Records an earlier run committed are skipped, '
+            'so a failed import is resumed by running it again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import.')
+        parser.add_argument('--author',
+                            help='Username the recipes are imported for.')
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='File format; by default taken from the '
+                                 'file extension.')
+        parser.add_argument('--source',
+                            help='Name the record ids are scoped to; the '
+                                 'file name by default.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Records imported per transaction.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Rows inserted per INSERT statement.')
+
+    def handle(self, *args, **options):
+        """Stream the file through the importer, reporting each batch.
+
+        Neighbours of the new recipes are left for build_recipe_neighbours.
+        """
+        path = options['path']
+        name = os.path.basename(path)
+        file_format = options['format'] or os.path.splitext(name)[1][1:]
+        if file_format not in READERS:
+            raise CommandError('Unknown format {!r}; pass --format.'.format(
+                file_format))
+        if not options['author']:
+            raise CommandError('Pass the --author to import recipes for.')
+        user_model = get_user_model()
+        try:
+            author = user_model.objects.get(
+                **{user_model.USERNAME_FIELD: options['author']})
+        except user_model.DoesNotExist:
+            raise CommandError('Unknown author {!r}.'.format(
+                options['author']))
+        source = options['source'] or name
+        stats = ImportStats()
+        started = time.time()
+        with open_records(path, file_format) as lines:
+            records = parse_records(READERS[file_format](lines), source,
+                                    stats, self.report)
+            try:
+                for batch in batches(records, options['batch_size']):
+                    import_batch(batch, author, stats, self.report,
+                                 options['chunk_size'])
+                    self.stdout.write(
+                        'Line {}: {} recipes imported, {} already there, '
+                        '{} skipped ({:.0f} records/s).'.format(
+                            stats.line, stats.created, stats.existing,
+                            stats.skipped, self.rate(stats.records, started)))
+            except Exception:
+                self.stderr.write(
+                    'Import stopped in the batch ending at line {}. Batches '
+                    'before it are saved; run the command again to '
+                    'resume.'.format(stats.line))
+                raise
+        self.stdout.write(
+            'Imported {} recipes and {} new ingredients from {} records in '
+            '{:.1f}s ({:.0f} records/s, {:.0f} recipes/s).'.format(
+                stats.created, stats.ingredients, stats.records,
+                time.time() - started, self.rate(stats.records, started),
+                self.rate(stats.created, started)))
+        if stats.created:
+            self.stdout.write('Run build_recipe_neighbours to find similar '
+                              'recipes for the imported ones.')
+
+    def report(self, line, error):
+        """Report a record that was skipped."""
+        self.stderr.write('Line {}: {}'.format(line, error))
+
+    def rate(self, count, started):
+        """Return count per second since started."""
+        return count / max(time.time() - started, 1e-6)
@@ -0,0 +1,130 @@
+"""Merge ingredients whose names share a canonical name."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, CharField, Count, IntegerField, Value, When
+from recipe.feed import invalidate_personal_feeds
+from recipe.models import (
+    Ingredient,
+    RecipeIngredientRelationship,
+    canonical_name
+)
+from recipe.search import index_recipes
+from recipe.services import adjust_ingredient_usage, refresh_ingredient_ids
+
+
+class Command(BaseCommand):
+    help = ('Fold duplicate ingredients into the oldest ingredient with the '
+            'same canonical name, repointing recipes and chef preferences.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Duplicate groups merged per transaction.')
+        parser.add_argument('--recompute', action='store_true',
+                            help='Recompute every canonical name first.')
+
+    def handle(self, *args, **options):
+        """Merge duplicate groups a batch at a time.
+
+        Each batch commits on its own and merged groups no longer show up
+        as duplicates, so an interrupted run picks up where it stopped
+        when started again.
+        """
+        batch_size = options['batch_size']
+        if options['recompute']:
+            self.recompute(batch_size)
+        groups = (Ingredient.objects.exclude(canonical_name='')
+                  .order_by().values('canonical_name')
+                  .annotate(count=Count('pk')).filter(count__gt=1))
+        total = groups.count()
+        merged = removed = 0
+        while True:
+            names = [group['canonical_name'] for group in
+                     groups.order_by('canonical_name')[:batch_size]]
+            if not names:
+                break
+            removed += self.merge(names)
+            merged += len(names)
+            self.stdout.write('Merged {} of {} duplicate groups.'.format(
+                merged, total))
+        self.stdout.write('Removed {} duplicate ingredients.'.format(removed))
+        if removed:
+            self.stdout.write('Run build_recipe_neighbours to find similar '
+                              'recipes for the merged ones.')
+
+    def recompute(self, batch_size):
+        """Refresh stored canonical names in batches of CASE UPDATEs."""
+        rows = Ingredient.objects.order_by('pk').values_list('pk', 'name')
+        last_pk = changed = 0
+        while True:
+            batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            changed += Ingredient.objects.filter(
+                pk__in=[pk for pk, name in batch]).update(
+                    canonical_name=Case(
+                        *[When(pk=pk, then=Value(canonical_name(name)))
+                          for pk, name in batch],
+                        output_field=CharField()))
+            last_pk = batch[-1][0]
+        self.stdout.write('Recomputed {} canonical names.'.format(changed))
+
+    def merge(self, names):
+        """Merge the ingredients sharing the given canonical names.
+
+        Recipe rows are repointed with one CASE UPDATE and the affected
+        recipes' stored ingredient ids and search entries are rewritten;
+        their neighbours are left for build_recipe_neighbours. Preference rows are unique per chef and ingredient, so
+        missing ones are inserted for the surviving ingredient before the
+        duplicates' rows go, and the feeds ranked from them are dropped.
+        Returns the number of ingredients removed.
+        """
+        keepers, duplicates, usage = {}, {}, {}
+        rows = (Ingredient.objects.filter(canonical_name__in=names)
+                .order_by('canonical_name', 'pk')
+                .values_list('pk', 'canonical_name', 'usage_count'))
+        for pk, name, usage_count in rows:
+            if name not in keepers:
+                keepers[name] = pk
+            else:
+                keeper = keepers[name]
+                duplicates[pk] = keeper
+                usage[keeper] = usage.get(keeper, 0) + usage_count
+        if not duplicates:
+            return 0
+        with transaction.atomic():
+            relationships = RecipeIngredientRelationship.objects.filter(
+                ingredient__in=duplicates)
+            recipe_ids = set(relationships.values_list('recipe', flat=True))
+            merged = set(duplicates) | set(duplicates.values())
+            user_ids = set()
+            relationships.update(ingredient=Case(
+                *[When(ingredient=pk, then=Value(keeper))
+                  for pk, keeper in duplicates.items()],
+                output_field=IntegerField()))
+            for through in (Ingredient.liked_by.through,
+                            Ingredient.disliked_by.through):
+                user_ids.update(through.objects.filter(ingredient__in=merged)
+                                .values_list('chefprofile__user', flat=True))
+                self.repoint_preferences(through, duplicates)
+            adjust_ingredient_usage(usage)
+            refresh_ingredient_ids(recipe_ids)
+            Ingredient.objects.filter(pk__in=duplicates).delete()
+            index_recipes(recipe_ids)
+        invalidate_personal_feeds(user_ids)
+        return len(duplicates)
+
+    def repoint_preferences(self, through, duplicates):
+        """Move chef preference rows from duplicates to their keepers."""
+        rows = through.objects.filter(ingredient__in=duplicates)
+        wanted = set((profile, duplicates[ingredient]) for profile, ingredient
+                     in rows.values_list('chefprofile', 'ingredient'))
+        if not wanted:
+            return
+        existing = set(through.objects.filter(
+            chefprofile__in=set(profile for profile, keeper in wanted),
+            ingredient__in=set(duplicates.values()),
+        ).values_list('chefprofile', 'ingredient'))
+        through.objects.bulk_create([
+            through(chefprofile_id=profile, ingredient_id=keeper)
+            for profile, keeper in wanted - existing])
+        rows.delete()
@@ -0,0 +1,61 @@
+"""Resize queued recipe photos with a pool of worker processes."""
+import os
+import socket
+import time
+from multiprocessing import Pool, cpu_count
+from django.core.management.base import BaseCommand
+from recipe.jobs import (
+    claim_jobs,
+    finish_jobs,
+    requeue_stale_jobs,
+    resize_photo
+)
+
+
+class Command(BaseCommand):
+    help = ('Process queued photo jobs, writing thumbnails in a pool of '
+            'worker processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=cpu_count(),
+                            help='Worker processes resizing photos.')
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Jobs claimed at a time.')
+        parser.add_argument('--poll', type=float, default=2.0,
+                            help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Seconds after which a running job is '
+                                 'given to another worker.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        """Claim batches of jobs and resize their photos in the pool.
+
+        The main process does all database work; pool processes only
+        read and write photo files.
+        """
+        worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+        pool = Pool(options['processes'])
+        processed = failed = 0
+        try:
+            while True:
+                requeue_stale_jobs(options['stale_after'])
+                jobs = claim_jobs(worker, options['batch_size'])
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+                names = set(job.photo for job in jobs)
+                errors = dict(
+                    (name, error) for name, error in
+                    pool.imap_unordered(resize_photo, names) if error)
+                finish_jobs(jobs, errors)
+                processed += len(jobs)
+                failed += sum(1 for job in jobs if job.photo in errors)
+                self.stdout.write('Processed {} jobs, {} failed.'.format(
+                    processed, failed))
+        finally:
+            pool.close()
+            pool.join()
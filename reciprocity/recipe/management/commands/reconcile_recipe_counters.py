@@ -0,0 +1,34 @@
+"""Recount the denormalized counters stored on every recipe."""
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from recipe.models import Recipe, RecipeIngredientRelationship, RecipeLineage
+
+
+class Command(BaseCommand):
+    help = ('Recompute the variation, descendant, favorite and ingredient '
+            'counts of every recipe in one UPDATE.')
+
+    def handle(self, *args, **options):
+        """Reset every counter with correlated COUNT subqueries."""
+        recipes = Recipe._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE {recipes} SET '
+                'variation_count = (SELECT COUNT(*) FROM {recipes} v '
+                'WHERE v.parent_id = {recipes}.id), '
+                'descendant_count = (SELECT COUNT(*) FROM {lineage} l '
+                'WHERE l.ancestor_id = {recipes}.id), '
+                'favorite_count = (SELECT COUNT(*) FROM {favorites} f '
+                'WHERE f.recipe_id = {recipes}.id), '
+                'ingredient_count = (SELECT COUNT(*) FROM {relationships} r '
+                'WHERE r.recipe_id = {recipes}.id), '
+                'version = version + 1, updated = %s'.format(
+                    recipes=recipes,
+                    lineage=RecipeLineage._meta.db_table,
+                    favorites=Recipe.favorite_of.through._meta.db_table,
+                    relationships=RecipeIngredientRelationship._meta.db_table),
+                [timezone.now()]
+            )
+            self.stdout.write('Reconciled counters of {} recipes.'.format(
+                cursor.rowcount))
@@ -0,0 +1,23 @@
+"""Recount how many recipe rows use each ingredient."""
+from django.core.management.base import BaseCommand
+from django.db import connection
+from recipe.models import Ingredient, RecipeIngredientRelationship
+
+
+class Command(BaseCommand):
+    help = ('Recompute Ingredient.usage_count from '
+            'RecipeIngredientRelationship in one UPDATE.')
+
+    def handle(self, *args, **options):
+        """Reset every usage count with a correlated COUNT subquery."""
+        ingredients = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE {ingredients} SET usage_count = ('
+                'SELECT COUNT(*) FROM {relationships} r '
+                'WHERE r.ingredient_id = {ingredients}.id)'.format(
+                    ingredients=ingredients,
+                    relationships=RecipeIngredientRelationship._meta.db_table)
+            )
+            self.stdout.write('Recounted usage of {} ingredients.'.format(
+                cursor.rowcount))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 18:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_lineage(apps, schema_editor):
+    """Fill the closure table from Recipe.parent, a generation at a time.
+
+    The same statements as the backfill_lineage command, which stays
+    for repairs.
+    """
+    Recipe = apps.get_model('recipe', 'Recipe')
+    RecipeLineage = apps.get_model('recipe', 'RecipeLineage')
+    recipes = Recipe._meta.db_table
+    lineage = RecipeLineage._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {lineage} (ancestor_id, descendant_id, depth) '
+            'SELECT parent_id, id, 1 FROM {recipes} '
+            'WHERE parent_id IS NOT NULL'.format(lineage=lineage,
+                                                 recipes=recipes)
+        )
+        depth = 1
+        while cursor.rowcount:
+            cursor.execute(
+                'INSERT INTO {lineage} (ancestor_id, descendant_id, depth) '
+                'SELECT l.ancestor_id, r.id, l.depth + 1 '
+                'FROM {lineage} l '
+                'JOIN {recipes} r ON r.parent_id = l.descendant_id '
+                'WHERE l.depth = %s'.format(lineage=lineage,
+                                            recipes=recipes),
+                [depth]
+            )
+            depth += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0016_recipe_photo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeLineage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='recipe.Recipe')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='recipe.Recipe')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='recipelineage',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='recipelineage',
+            index_together=set([('descendant', 'depth'), ('ancestor', 'depth')]),
+        ),
+        migrations.RunPython(fill_lineage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 18:12
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+INGREDIENT_NAME_INDEX = 'recipe_ingredient_name_prefix'
+
+# istartswith compiles to UPPER("name"::text) LIKE UPPER(%s) on Postgres
+# and to a case-insensitive LIKE on SQLite, so each needs its own index.
+# Ingredient autocomplete now answers from the in-memory
+# recipe.ingredient_index, so this index only serves the ?q= prefix
+# filter of IngredientListApi.
+CREATE_INGREDIENT_NAME_INDEX = {
+    'postgresql': ('CREATE INDEX {} ON recipe_ingredient '
+                   '(UPPER(name::text) text_pattern_ops)'),
+    'sqlite': ('CREATE INDEX {} ON recipe_ingredient '
+               '(name COLLATE NOCASE)'),
+}
+
+
+def create_ingredient_name_index(apps, schema_editor):
+    """Add a case-insensitive prefix index on Ingredient.name."""
+    sql = CREATE_INGREDIENT_NAME_INDEX.get(schema_editor.connection.vendor)
+    if sql:
+        schema_editor.execute(sql.format(INGREDIENT_NAME_INDEX))
+
+
+def drop_ingredient_name_index(apps, schema_editor):
+    """Remove the case-insensitive prefix index on Ingredient.name."""
+    if schema_editor.connection.vendor in CREATE_INGREDIENT_NAME_INDEX:
+        schema_editor.execute('DROP INDEX {}'.format(INGREDIENT_NAME_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0017_recipelineage'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='recipe',
+            index_together=set([('author', 'created'), ('privacy', 'created')]),
+        ),
+        migrations.RunPython(create_ingredient_name_index,
+                             drop_ingredient_name_index),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 18:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+COUNT_INGREDIENT_USAGE = (
+    'UPDATE recipe_ingredient SET usage_count = ('
+    'SELECT COUNT(*) FROM recipe_recipeingredientrelationship r '
+    'WHERE r.ingredient_id = recipe_ingredient.id)'
+)
+
+
+def count_ingredient_usage(apps, schema_editor):
+    """Fill usage_count for ingredients already used by recipes."""
+    schema_editor.execute(COUNT_INGREDIENT_USAGE)
+
+
+def restore_ingredient_name_index(apps, schema_editor):
+    """Recreate 0018's name index, lost when SQLite rebuilds the table."""
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS recipe_ingredient_name_prefix '
+            'ON recipe_ingredient (name COLLATE NOCASE)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0018_recipe_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='usage_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(restore_ingredient_name_index,
+                             migrations.RunPython.noop),
+        migrations.RunPython(count_ingredient_usage,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 19:02
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+from django.db.models import Case, CharField, Value, When
+
+BATCH_SIZE = 500
+PLURAL_ENDINGS = (
+    ('ies', 'y'),
+    ('oes', 'o'),
+    ('ches', 'ch'),
+    ('shes', 'sh'),
+    ('sses', 'ss'),
+    ('xes', 'x'),
+    ('s', ''),
+)
+SINGULAR_ENDINGS = ('ss', 'us', 'is')
+
+
+def canonical_name(name):
+    """Return the canonical name as recipe.models computed it here.
+
+    A copy, so later changes to the model's rule do not change what
+    this migration writes; merge_duplicate_ingredients --recompute
+    brings stored names up to date with the current rule.
+    """
+    words = re.sub(r'[^\w\s]', ' ', name.lower(), flags=re.UNICODE).split()
+    if not words:
+        return ''
+    last = words[-1]
+    if len(last) > 3 and not last.endswith(SINGULAR_ENDINGS):
+        for plural, singular in PLURAL_ENDINGS:
+            if last.endswith(plural):
+                words[-1] = last[:-len(plural)] + singular
+                break
+    return ' '.join(words)
+
+
+def fill_canonical_names(apps, schema_editor):
+    """Compute canonical names for existing ingredients in batches."""
+    Ingredient = apps.get_model('recipe', 'Ingredient')
+    rows = Ingredient.objects.order_by('pk').values_list('pk', 'name')
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        Ingredient.objects.filter(pk__in=[pk for pk, name in batch]).update(
+            canonical_name=Case(
+                *[When(pk=pk, then=Value(canonical_name(name)))
+                  for pk, name in batch],
+                output_field=CharField()))
+        last_pk = batch[-1][0]
+
+
+def restore_ingredient_name_index(apps, schema_editor):
+    """Recreate 0018's name index, lost when SQLite rebuilds the table."""
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS recipe_ingredient_name_prefix '
+            'ON recipe_ingredient (name COLLATE NOCASE)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0019_ingredient_usage_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='canonical_name',
+            field=models.CharField(db_index=True, default='', editable=False,
+                                   max_length=128),
+            preserve_default=False,
+        ),
+        migrations.RunPython(restore_ingredient_name_index,
+                             migrations.RunPython.noop),
+        migrations.RunPython(fill_canonical_names,
+                             migrations.RunPython.noop),
+    ]
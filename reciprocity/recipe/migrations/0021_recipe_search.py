@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 19:40
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+CREATE_SEARCH_INDEX = {
+    'postgresql': [
+        'CREATE TABLE recipe_search ('
+        'recipe_id integer PRIMARY KEY REFERENCES recipe_recipe (id) '
+        'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+        'document tsvector NOT NULL)',
+        'CREATE INDEX recipe_search_document '
+        'ON recipe_search USING GIN (document)',
+        'INSERT INTO recipe_search (recipe_id, document) '
+        "SELECT r.id, setweight(to_tsvector('english', r.title), 'A') || "
+        "setweight(to_tsvector('english', "
+        "coalesce(string_agg(i.name, ' '), '')), 'B') || "
+        "setweight(to_tsvector('english', "
+        "coalesce(r.description, '')), 'C') || "
+        "setweight(to_tsvector('english', r.directions), 'D') "
+        'FROM recipe_recipe r '
+        'LEFT JOIN recipe_recipeingredientrelationship ri '
+        'ON ri.recipe_id = r.id '
+        'LEFT JOIN recipe_ingredient i ON i.id = ri.ingredient_id '
+        'GROUP BY r.id',
+    ],
+    'sqlite': [
+        'CREATE VIRTUAL TABLE recipe_search USING fts5('
+        'title, ingredients, description, directions, '
+        "tokenize='porter unicode61')",
+        'INSERT INTO recipe_search '
+        '(rowid, title, ingredients, description, directions) '
+        "SELECT r.id, r.title, coalesce(group_concat(i.name, ' '), ''), "
+        "coalesce(r.description, ''), r.directions "
+        'FROM recipe_recipe r '
+        'LEFT JOIN recipe_recipeingredientrelationship ri '
+        'ON ri.recipe_id = r.id '
+        'LEFT JOIN recipe_ingredient i ON i.id = ri.ingredient_id '
+        'GROUP BY r.id',
+    ],
+}
+
+
+def create_search_index(apps, schema_editor):
+    """Create and fill the full-text index where the database has one."""
+    vendor = schema_editor.connection.vendor
+    for statement in CREATE_SEARCH_INDEX.get(vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    """Drop the full-text index."""
+    if schema_editor.connection.vendor in CREATE_SEARCH_INDEX:
+        schema_editor.execute('DROP TABLE recipe_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0020_ingredient_canonical_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
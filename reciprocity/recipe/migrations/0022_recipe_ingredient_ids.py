@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 20:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, TextField, Value, When
+
+BATCH_SIZE = 500
+
+
+def fill_ingredient_ids(apps, schema_editor):
+    """Store each recipe's sorted ingredient ids, a batch at a time."""
+    Recipe = apps.get_model('recipe', 'Recipe')
+    RecipeIngredientRelationship = apps.get_model(
+        'recipe', 'RecipeIngredientRelationship')
+    ingredient_ids = {}
+    rows = (RecipeIngredientRelationship.objects.order_by()
+            .values_list('recipe', 'ingredient'))
+    for recipe, ingredient in rows.iterator():
+        ingredient_ids.setdefault(recipe, set()).add(ingredient)
+    items = sorted((pk, ' '.join(str(ingredient) for ingredient in
+                                 sorted(ids)))
+                   for pk, ids in ingredient_ids.items())
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        Recipe.objects.filter(pk__in=[pk for pk, ids in batch]).update(
+            ingredient_ids=Case(
+                *[When(pk=pk, then=Value(ids)) for pk, ids in batch],
+                output_field=TextField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0021_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_ingredient_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 20:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+COUNT_RECIPE_RELATIONS = (
+    'UPDATE recipe_recipe SET '
+    'variation_count = (SELECT COUNT(*) FROM recipe_recipe v '
+    'WHERE v.parent_id = recipe_recipe.id), '
+    'descendant_count = (SELECT COUNT(*) FROM recipe_recipelineage l '
+    'WHERE l.ancestor_id = recipe_recipe.id), '
+    'favorite_count = (SELECT COUNT(*) '
+    'FROM chef_profile_chefprofile_favorites f '
+    'WHERE f.recipe_id = recipe_recipe.id), '
+    'ingredient_count = (SELECT COUNT(*) '
+    'FROM recipe_recipeingredientrelationship r '
+    'WHERE r.recipe_id = recipe_recipe.id)'
+)
+
+
+def count_recipe_relations(apps, schema_editor):
+    """Fill the counters of existing recipes."""
+    schema_editor.execute(COUNT_RECIPE_RELATIONS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chef_profile', '0003_auto_20160505_1708'),
+        ('recipe', '0023_recipeneighbour'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='descendant_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorite_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='variation_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='recipe',
+            index_together=set([('privacy', 'favorite_count'), ('privacy', 'variation_count'), ('author', 'created'), ('privacy', 'created')]),
+        ),
+        migrations.RunPython(count_recipe_relations,
+                             migrations.RunPython.noop),
+    ]
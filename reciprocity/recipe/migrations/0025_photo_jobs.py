@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 18:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def queue_existing_photos(apps, schema_editor):
+    """Queue the photos uploaded so far for resizing."""
+    Recipe = apps.get_model('recipe', 'Recipe')
+    PhotoJob = apps.get_model('recipe', 'PhotoJob')
+    names = (Recipe.objects.exclude(photo='').order_by('photo')
+             .values_list('photo', flat=True).distinct())
+    PhotoJob.objects.bulk_create(
+        [PhotoJob(photo=name) for name in names.iterator()],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0024_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('photo', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('pe', 'Pending'), ('ru', 'Running'), ('do', 'Done'), ('fa', 'Failed')], default='pe', max_length=2)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('worker', models.CharField(blank=True, default='', max_length=64)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='photo_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='photojob',
+            index_together=set([('status', 'started')]),
+        ),
+        migrations.RunPython(queue_existing_photos,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.5 on 2026-10-18 18:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import recipe.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0025_photo_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='photo',
+            field=models.ImageField(blank=True, db_index=True, storage=recipe.storage.ContentAddressedStorage(), upload_to='recipe_photos'),
+        ),
+    ]
@@ -1,8 +1,14 @@
 from __future__ import unicode_literals
 
+import re
+
 from django.conf import settings
-from django.db import models
+from django.db import connection, models
+from django.db.models import Max
+from django.db.models.query import ModelIterable
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
+from .storage import photo_storage
 
 TIME_CHOICES = (
     (.25, '15 minutes'),
@@ -29,6 +35,54 @@ PRIVACY_CHOICES = (
     # ('fr', 'Friends Only'),
 )
 
+JOB_STATUS_CHOICES = (
+    ('pe', 'Pending'),
+    ('ru', 'Running'),
+    ('do', 'Done'),
+    ('fa', 'Failed'),
+)
+
+
+PLURAL_ENDINGS = (
+    ('ies', 'y'),
+    ('oes', 'o'),
+    ('ches', 'ch'),
+    ('shes', 'sh'),
+    ('sses', 'ss'),
+    ('xes', 'x'),
+    ('s', ''),
+)
+SINGULAR_ENDINGS = ('ss', 'us', 'is')
+
+
+def canonical_name(name):
+    """Return the key under which spellings of an ingredient coincide.
+
+    The name is lowercased, stripped of punctuation and extra whitespace,
+    and its last word is reduced to a naive singular, so "Tomato",
+    "tomatoes" and " tomato " share the key "tomato".
+    """
+    words = re.sub(r'[^\w\s]', ' ', name.lower(), flags=re.UNICODE).split()
+    if not words:
+        return ''
+    last = words[-1]
+    if len(last) > 3 and not last.endswith(SINGULAR_ENDINGS):
+        for plural, singular in PLURAL_ENDINGS:
+            if last.endswith(plural):
+                words[-1] = last[:-len(plural)] + singular
+                break
+    return ' '.join(words)
+
+
+class IngredientManager(models.Manager):
+    def get_or_create_by_name(self, name):
+        """Return the ingredient matching name canonically, or create it."""
+        ingredient = (self.filter(canonical_name=canonical_name(name))
+                      .order_by('pk').first())
+        if ingredient is None:
+            ingredient = self.create(name=' '.join(name.split()))
+        return ingredient
+
 
 @python_2_unicode_compatible
 class Ingredient(models.Model):
@@ -39,6 +93,65 @@ class Ingredient(models.Model):
         return self.name
 
     name = models.CharField(max_length=128)
+    canonical_name = models.CharField(max_length=128, db_index=True,
+                                      editable=False)
+    usage_count = models.IntegerField(default=0, editable=False)
+
+    objects = IngredientManager()
+
+
+class TileIterable(ModelIterable):
+    """Yield recipes with their latest variation attached in bulk."""
+
+    def __iter__(self):
+        recipes = list(super(TileIterable, self).__iter__())
+        if recipes:
+            latest_ids = dict(
+                Recipe.objects.filter(parent__in=recipes)
+                .order_by()
+                .values_list('parent')
+                .annotate(Max('pk'))
+            )
+            variations = Recipe.objects.in_bulk(latest_ids.values())
+            for recipe in recipes:
+                recipe._latest_variation = variations.get(
+                    latest_ids.get(recipe.pk))
+        return iter(recipes)
+
+
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet of Recipes with helpers for rendering recipe tiles."""
+
+    def visible_to(self, user):
+        """Return recipes that are public or authored by the given user."""
+        if user.is_authenticated():
+            return self.filter(models.Q(privacy='pu') | models.Q(author=user))
+        return self.filter(privacy='pu')
+
+    def ancestors_of(self, recipe):
+        """Return the ancestors of a recipe, nearest generation first."""
+        return self.filter(descendant_links__descendant=recipe).order_by(
+            'descendant_links__depth', 'pk')
+
+    def descendants_of(self, recipe):
+        """Return the descendants of a recipe, nearest generation first."""
+        return self.filter(ancestor_links__ancestor=recipe).order_by(
+            'ancestor_links__depth', 'pk')
+
+    def tiles(self):
+        """Return recipes with parent and latest variation preloaded."""
+        queryset = self.select_related('parent')
+        queryset._iterable_class = TileIterable
+        return queryset
+
+
+def touch():
+    """Return update() arguments marking recipes as changed.
+
+    Every statement changing what a recipe shows uses these, so its
+    version and updated time can validate cached copies of it.
+    """
+    return {'version': models.F('version') + 1, 'updated': timezone.now()}
 
 
 @python_2_unicode_compatible
@@ -49,6 +162,15 @@ class Recipe(models.Model):
         """Display model instance."""
         return self.title
 
+    @property
+    def latest_variation(self):
+        """Return the most recent direct variation of this recipe."""
+        try:
+            return self._latest_variation
+        except AttributeError:
+            self._latest_variation = self.variations.last()
+            return self._latest_variation
+
     title = models.CharField(help_text='What is your recipe called?',
                              max_length=128)
     description = models.TextField(blank=True,
@@ -80,7 +202,50 @@ class Recipe(models.Model):
                                        related_name='total_variations',
                                        blank=True,
                                        symmetrical=False)
-    photo = models.ImageField(upload_to='recipe_photos', blank=True)
+    photo = models.ImageField(upload_to='recipe_photos',
+                              blank=True,
+                              db_index=True,
+                              storage=photo_storage)
+    photo_ready = models.BooleanField(default=False, editable=False)
+    ingredient_ids = models.TextField(blank=True, default='', editable=False)
+    variation_count = models.IntegerField(default=0, editable=False)
+    descendant_count = models.IntegerField(default=0, editable=False)
+    favorite_count = models.IntegerField(default=0, editable=False)
+    ingredient_count = models.IntegerField(default=0, editable=False)
+    version = models.IntegerField(default=0, editable=False)
+    updated = models.DateTimeField(auto_now=True)
+    import_key = models.CharField(max_length=128,
+                                  blank=True,
+                                  null=True,
+                                  unique=True,
+                                  editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        """Save the recipe, moving its version on when it already exists.
+
+        The version is raised in the UPDATE itself, so concurrent writes
+        never hand out the same version twice; see touch(). The new
+        version is read back, so the instance never holds the expression.
+        """
+        bumped = self.pk is not None and not kwargs.get('force_insert',
+                                                        False)
+        if bumped:
+            self.version = models.F('version') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = (list(update_fields) +
+                                           ['version', 'updated'])
+        super(Recipe, self).save(*args, **kwargs)
+        if bumped:
+            self.refresh_from_db(fields=['version'])
+
+    class Meta:
+        index_together = (('privacy', 'created'),
+                          ('author', 'created'),
+                          ('privacy', 'variation_count'),
+                          ('privacy', 'favorite_count'))
 
 
 @python_2_unicode_compatible
@@ -95,3 +260,96 @@ class RecipeIngredientRelationship(models.Model):
     recipe = models.ForeignKey(Recipe, related_name='ingredients_in_recipe')
     ingredient = models.ForeignKey(Ingredient)
     quantity = models.CharField(max_length=128)
+
+
+class RecipeLineageManager(models.Manager):
+    """Maintain the lineage closure table with set-based statements."""
+
+    def add_recipe(self, recipe):
+        """Link a new variation to its parent and all of its ancestors.
+
+        The parent's own lineage rows are copied one level deeper in a
+        single INSERT ... SELECT, then mirrored into Recipe.ancestors,
+        and every ancestor's descendant count goes up by one.
+        """
+        if recipe.parent_id is None:
+            return
+        table = self.model._meta.db_table
+        ancestors = Recipe.ancestors.through._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} (ancestor_id, descendant_id, depth) '
+                'SELECT ancestor_id, %s, depth + 1 FROM {table} '
+                'WHERE descendant_id = %s '
+                'UNION ALL SELECT %s, %s, 1'.format(table=table),
+                [recipe.pk, recipe.parent_id, recipe.parent_id, recipe.pk]
+            )
+            cursor.execute(
+                'INSERT INTO {ancestors} (from_recipe_id, to_recipe_id) '
+                'SELECT descendant_id, ancestor_id FROM {table} '
+                'WHERE descendant_id = %s'.format(table=table,
+                                                  ancestors=ancestors),
+                [recipe.pk]
+            )
+        Recipe.objects.filter(descendant_links__descendant=recipe).update(
+            descendant_count=models.F('descendant_count') + 1, **touch())
+
+
+@python_2_unicode_compatible
+class RecipeLineage(models.Model):
+    """Closure table row linking a recipe to one of its descendants."""
+
+    def __str__(self):
+        """Display ancestor, descendant and distance between them."""
+        return 'Ancestor: {}, Descendant: {}, Depth: {}'.format(
+            self.ancestor, self.descendant, self.depth)
+
+    ancestor = models.ForeignKey(Recipe, related_name='descendant_links')
+    descendant = models.ForeignKey(Recipe, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    objects = RecipeLineageManager()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        index_together = (('ancestor', 'depth'), ('descendant', 'depth'))
+
+
+@python_2_unicode_compatible
+class RecipeNeighbour(models.Model):
+    """Row linking a recipe to one of its most similar public recipes."""
+
+    def __str__(self):
+        """Display both recipes and their similarity."""
+        return 'Recipe: {}, Neighbour: {}, Similarity: {:.2f}'.format(
+            self.recipe, self.neighbour, self.similarity)
+
+    recipe = models.ForeignKey(Recipe, related_name='neighbour_links')
+    neighbour = models.ForeignKey(Recipe, related_name='neighbour_of_links')
+    similarity = models.FloatField()
+
+    class Meta:
+        unique_together = ('recipe', 'neighbour')
+
+
+@python_2_unicode_compatible
+class PhotoJob(models.Model):
+    """Queued resizing of a stored photo, run by the photo_worker command."""
+
+    def __str__(self):
+        """Display photo and status."""
+        return 'Photo: {}, Status: {}'.format(self.photo,
+                                              self.get_status_display())
+
+    photo = models.CharField(max_length=100)
+    status = models.CharField(max_length=2,
+                              choices=JOB_STATUS_CHOICES,
+                              default='pe')
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=64, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = (('status', 'started'),)
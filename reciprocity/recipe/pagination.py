@@ -0,0 +1,79 @@
+"""Page recipe lists by (created, id) cursors instead of OFFSET.
+
+A cursor names the row a page starts after, so a deep page costs the
+same index range scan as the first one and stays put while new recipes
+are added in front of it.
+"""
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(created, pk):
+    """Return the URL form of a (created, pk) position."""
+    if timezone.is_aware(created):
+        created = timezone.make_naive(created, timezone.utc)
+    return '{}-{}'.format(created.strftime(CURSOR_FORMAT), pk)
+
+
+def decode_cursor(value):
+    """Return the (created, pk) position in a cursor, or None if invalid."""
+    try:
+        created, pk = value.split('-')
+        created = datetime.strptime(created, CURSOR_FORMAT)
+        pk = int(pk)
+    except (AttributeError, ValueError):
+        return None
+    if settings.USE_TZ:
+        created = timezone.make_aware(created, timezone.utc)
+    return created, pk
+
+
+class KeysetPaginationMixin(object):
+    """Serve a ListView's recipes newest first, a cursor page at a time.
+
+    Views pass their filtered recipes to paginate_keyset() and return the
+    ids it gives back. ?after= pages towards older recipes and ?before=
+    towards newer ones; the cursors for both directions are added to the
+    context as next_cursor and previous_cursor.
+    """
+    page_size = 24
+
+    def paginate_keyset(self, recipes):
+        """Return the ids of the requested page of recipes."""
+        after = decode_cursor(self.request.GET.get('after'))
+        before = decode_cursor(self.request.GET.get('before'))
+        if before is not None:
+            created, pk = before
+            recipes = recipes.filter(Q(created__gt=created) |
+                                     Q(created=created, pk__gt=pk))
+            recipes = recipes.order_by('created', 'pk')
+        else:
+            if after is not None:
+                created, pk = after
+                recipes = recipes.filter(Q(created__lt=created) |
+                                         Q(created=created, pk__lt=pk))
+            recipes = recipes.order_by('-created', '-pk')
+        rows = list(recipes.values_list('created', 'pk')[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if before is not None:
+            rows.reverse()
+        has_next = more if before is None else True
+        has_previous = more if before is not None else after is not None
+        self.next_cursor = self.previous_cursor = None
+        if rows and has_next:
+            self.next_cursor = encode_cursor(*rows[-1])
+        if rows and has_previous:
+            self.previous_cursor = encode_cursor(*rows[0])
+        return [pk for created, pk in rows]
+
+    def get_context_data(self, **kwargs):
+        """Add the cursors of the neighbouring pages."""
+        context = super(KeysetPaginationMixin, self).get_context_data(**kwargs)
+        context['next_cursor'] = self.next_cursor
+        context['previous_cursor'] = self.previous_cursor
+        return context
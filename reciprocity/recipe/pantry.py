@@ -0,0 +1,51 @@
+"""Rank public recipes by how much of each a set of ingredients covers."""
+from django.db.models import (
+    Count,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Value
+)
+from .models import RecipeIngredientRelationship
+
+MAX_RESULTS = 1000
+
+
+def parse_ingredient_ids(value):
+    """Return the ingredient ids stored on a recipe as a frozenset."""
+    return frozenset(int(pk) for pk in value.split())
+
+
+def rank_by_coverage(ingredient_ids, excluded_ids=()):
+    """Return (pk, matched, total) for the recipes best covered, best first.
+
+    Coverage is the fraction of a recipe's ingredient rows using one of
+    ingredient_ids. The ingredient rows of public recipes matching any
+    of them are grouped by recipe in one query, which counts the matches
+    against the stored ingredient count, itself a count of rows, so a
+    recipe listing an ingredient twice can still be fully covered. Only
+    the best MAX_RESULTS are returned, and recipes using any excluded
+    ingredient are skipped. Ties go to recipes matching more
+    ingredients, then to newer recipes.
+    """
+    have = frozenset(ingredient_ids)
+    if not have:
+        return []
+    rows = RecipeIngredientRelationship.objects.filter(
+        ingredient__in=have,
+        recipe__privacy='pu',
+        recipe__ingredient_count__gt=0)
+    excluded = frozenset(excluded_ids)
+    if excluded:
+        rows = rows.exclude(recipe__in=RecipeIngredientRelationship.objects
+                            .filter(ingredient__in=excluded)
+                            .values('recipe'))
+    ranked = (rows.order_by()
+              .values('recipe', 'recipe__ingredient_count')
+              .annotate(matched=Count('pk'))
+              .annotate(coverage=ExpressionWrapper(
+                  F('matched') * Value(1.0) / F('recipe__ingredient_count'),
+                  output_field=FloatField()))
+              .order_by('-coverage', '-matched', '-recipe')
+              .values_list('recipe', 'matched', 'recipe__ingredient_count'))
+    return list(ranked[:MAX_RESULTS])
@@ -0,0 +1,176 @@
+"""Generate resized copies of recipe photos for tiles and detail pages.
+
+Each size is stored next to the original photo with the size name,
+width and quality added before the extension, re-encoded as progressive
+JPEG without the original's EXIF data. Changing how a size is made
+changes its name, so a stored thumbnail never has to be rewritten.
+"""
+import os
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image
+from .models import PhotoJob, Recipe, touch
+from .storage import photo_storage
+from .tiles import bump_tile_versions
+
+THUMBNAIL_SIZES = (
+    ('tile', 300),
+    ('detail', 800),
+    ('retina', 1600),
+)
+THUMBNAIL_FORMAT = 'JPEG'
+THUMBNAIL_EXTENSION = '.jpg'
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_NAME = '{root}.{size}.{width}q{quality}{extension}'
+EXIF_ORIENTATION = 274
+ORIENTATIONS = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_90),
+    6: (Image.ROTATE_270,),
+    7: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_270),
+    8: (Image.ROTATE_90,),
+}
+
+
+def thumbnail_name(name, size):
+    """Return the storage name of one size of the photo stored as name."""
+    root, extension = os.path.splitext(name)
+    return THUMBNAIL_NAME.format(root=root,
+                                 size=size,
+                                 width=dict(THUMBNAIL_SIZES)[size],
+                                 quality=THUMBNAIL_QUALITY,
+                                 extension=THUMBNAIL_EXTENSION)
+
+
+def upright(image):
+    """Return the image turned the way its EXIF orientation says."""
+    try:
+        exif = image._getexif() or {}
+    except (AttributeError, IndexError, KeyError, SyntaxError, ValueError):
+        exif = {}
+    for operation in ORIENTATIONS.get(exif.get(EXIF_ORIENTATION), ()):
+        image = image.transpose(operation)
+    return image
+
+
+def flatten(image):
+    """Return the image in RGB, with any transparency over white."""
+    if image.mode == 'RGB':
+        return image
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def resize(image, width):
+    """Return the image scaled down to width, keeping its proportions."""
+    if image.size[0] <= width:
+        return image
+    height = max(1, int(round(image.size[1] * float(width) / image.size[0])))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def generate_thumbnails(name, storage=photo_storage):
+    """Write every thumbnail size of the photo stored as name.
+
+    The photo is decoded once, turned upright and converted to RGB; each
+    size is then scaled down from the previous, larger one. Thumbnails
+    already stored under the same names are kept as they are. Returns
+    the stored names by size.
+    """
+    with storage.open(name) as photo:
+        image = Image.open(photo)
+        image.load()
+    image = flatten(upright(image))
+    names = {}
+    for size, width in sorted(THUMBNAIL_SIZES, key=lambda size: -size[1]):
+        image = resize(image, width)
+        output = BytesIO()
+        image.save(output, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY,
+                   optimize=True, progressive=True)
+        names[size] = storage.write(thumbnail_name(name, size),
+                                    ContentFile(output.getvalue()))
+    return names
+
+
+def thumbnail_url(name, size, storage=photo_storage):
+    """Return the URL of one size of the photo stored as name."""
+    return storage.url(thumbnail_name(name, size))
+
+
+def release_photos(names, storage=photo_storage):
+    """Delete the given photos once committed, if no recipe uses them.
+
+    Counting references before the commit would miss recipes that a
+    concurrent upload of the same photo has committed since, and a
+    rollback would leave the rows naming a file already deleted.
+    """
+    names = set(name for name in names if name)
+    if names:
+        transaction.on_commit(lambda: delete_unused_photos(names, storage))
+
+
+def delete_unused_photos(names, storage=photo_storage):
+    """Delete the stored photos that no recipe uses any more.
+
+    Recipes with identical photos share one file, so the recipe rows
+    naming a file are its reference count. Unused files lose their
+    thumbnails and queued jobs first, then are moved aside and counted
+    again: a file an upload committed a recipe for in between is put
+    back and resized anew, and only the rest are deleted. An upload
+    committing later finds its file gone and writes it again; see
+    keep_uploaded_photo().
+    """
+    unused = names - set(Recipe.objects.filter(photo__in=names)
+                         .values_list('photo', flat=True))
+    if not unused:
+        return
+    PhotoJob.objects.filter(photo__in=unused, status='pe').delete()
+    for name in unused:
+        for size, width in THUMBNAIL_SIZES:
+            storage.delete(thumbnail_name(name, size))
+    aside = dict((name, storage.set_aside(name)) for name in unused)
+    aside = dict((name, moved) for name, moved in aside.items() if moved)
+    used = set(Recipe.objects.filter(photo__in=aside)
+               .values_list('photo', flat=True))
+    for name, moved in aside.items():
+        if name in used:
+            storage.put_back(name, moved)
+        else:
+            storage.delete(moved)
+    resize_again(used)
+
+
+def keep_uploaded_photo(name, content, storage=photo_storage):
+    """Write an uploaded photo again once committed, if it was deleted.
+
+    Saving an upload whose content is already stored writes nothing, so
+    the last recipe using that file may release it before the upload
+    commits. Checking after the commit, when the new recipe counts as a
+    reference, catches every file deleted that way.
+    """
+    def restore():
+        if not storage.exists(name):
+            content.seek(0)
+            storage.write(name, content)
+            resize_again([name])
+    transaction.on_commit(restore)
+
+
+def resize_again(names):
+    """Queue photos whose thumbnails were deleted and hide them until done."""
+    names = set(names)
+    if not names:
+        return
+    recipe_ids = list(Recipe.objects.filter(photo__in=names)
+                      .values_list('pk', flat=True))
+    Recipe.objects.filter(pk__in=recipe_ids).update(photo_ready=False,
+                                                     **touch())
+    bump_tile_versions(recipe_ids)
+    PhotoJob.objects.bulk_create([PhotoJob(photo=name) for name in names])
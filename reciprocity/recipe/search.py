@@ -0,0 +1,163 @@
+"""Keep the recipe full-text index current and answer searches from it.
+
+The index lives in the recipe_search table created by migration 0021:
+a tsvector column with a GIN index on PostgreSQL and an FTS5 virtual
+table on SQLite. Other databases fall back to unindexed LIKE matching.
+"""
+from django.db import connection
+from .models import Recipe
+
+MAX_RESULTS = 1000
+BATCH_SIZE = 500
+
+RECIPE_TEXT_JOINS = (
+    'FROM recipe_recipe r '
+    'LEFT JOIN recipe_recipeingredientrelationship ri ON ri.recipe_id = r.id '
+    'LEFT JOIN recipe_ingredient i ON i.id = ri.ingredient_id '
+    'WHERE r.id IN ({ids}) GROUP BY r.id'
+)
+
+POSTGRES = {
+    'delete': 'DELETE FROM recipe_search WHERE recipe_id IN ({ids})',
+    'insert': (
+        'INSERT INTO recipe_search (recipe_id, document) '
+        "SELECT r.id, setweight(to_tsvector('english', r.title), 'A') || "
+        "setweight(to_tsvector('english', "
+        "coalesce(string_agg(i.name, ' '), '')), 'B') || "
+        "setweight(to_tsvector('english', "
+        "coalesce(r.description, '')), 'C') || "
+        "setweight(to_tsvector('english', r.directions), 'D') "
+        + RECIPE_TEXT_JOINS
+    ),
+    'matches': (
+        'FROM recipe_search s '
+        "CROSS JOIN plainto_tsquery('english', %s) q "
+        'JOIN recipe_recipe r ON r.id = s.recipe_id '
+        'WHERE s.document @@ q '
+        "AND (r.privacy = 'pu' OR r.author_id = %s)"
+    ),
+    'id': 's.recipe_id',
+    'rank': 'ts_rank_cd(s.document, q) DESC',
+}
+
+SQLITE = {
+    'delete': 'DELETE FROM recipe_search WHERE rowid IN ({ids})',
+    'insert': (
+        'INSERT INTO recipe_search '
+        '(rowid, title, ingredients, description, directions) '
+        "SELECT r.id, r.title, coalesce(group_concat(i.name, ' '), ''), "
+        "coalesce(r.description, ''), r.directions "
+        + RECIPE_TEXT_JOINS
+    ),
+    'matches': (
+        'FROM recipe_search s '
+        'JOIN recipe_recipe r ON r.id = s.rowid '
+        'WHERE recipe_search MATCH %s '
+        "AND (r.privacy = 'pu' OR r.author_id = %s)"
+    ),
+    'id': 's.rowid',
+    'rank': 'bm25(recipe_search, 10.0, 5.0, 2.0, 1.0)',
+}
+
+BACKENDS = {
+    'postgresql': POSTGRES,
+    'sqlite': SQLITE,
+}
+
+
+def backend():
+    """Return the SQL for the current database, or None if unsupported."""
+    return BACKENDS.get(connection.vendor)
+
+
+def index_recipes(recipe_ids):
+    """Rewrite the index entries of the given recipes.
+
+    Entries are deleted and reinserted from the recipes' current text and
+    ingredient names, BATCH_SIZE recipes per statement. Ids of recipes
+    that no longer exist simply lose their entries.
+    """
+    sql = backend()
+    recipe_ids = list(recipe_ids)
+    if sql is None or not recipe_ids:
+        return
+    with connection.cursor() as cursor:
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            batch = recipe_ids[start:start + BATCH_SIZE]
+            ids = ', '.join(['%s'] * len(batch))
+            cursor.execute(sql['delete'].format(ids=ids), batch)
+            cursor.execute(sql['insert'].format(ids=ids), batch)
+
+
+def unindex_recipe(recipe_id):
+    """Drop one recipe from the index."""
+    sql = backend()
+    if sql is not None:
+        with connection.cursor() as cursor:
+            cursor.execute(sql['delete'].format(ids='%s'), [recipe_id])
+
+
+def fts5_query(query):
+    """Quote each word so FTS5 matches them all without parsing syntax."""
+    return ' '.join('"{}"'.format(word.replace('"', '""'))
+                    for word in query.split())
+
+
+class SearchResults(object):
+    """Lazy, ranked sequence of the ids of recipes matching a query.
+
+    Slicing runs one LIMIT/OFFSET query against the index. Counting stops
+    at MAX_RESULTS so that broad queries stay cheap to paginate.
+    """
+    model = Recipe
+
+    def __init__(self, sql, query, user_id):
+        self.sql = sql
+        self.params = [query, user_id]
+        self._count = None
+
+    def count(self):
+        """Return the number of matches, capped at MAX_RESULTS."""
+        if self._count is None:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT COUNT(*) FROM (SELECT 1 {} LIMIT %s) m'.format(
+                        self.sql['matches']),
+                    self.params + [MAX_RESULTS])
+                self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, step = index.indices(MAX_RESULTS)
+        if stop <= start:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT {id} {matches} ORDER BY {rank}, {id} DESC '
+                'LIMIT %s OFFSET %s'.format(**self.sql),
+                self.params + [stop - start, start])
+            return [row[0] for row in cursor.fetchall()][::step]
+
+
+def search_recipes(query, user):
+    """Return ids of recipes visible to user that match query, best first."""
+    user_id = user.pk if user.is_authenticated() else None
+    sql = backend()
+    if sql is SQLITE:
+        query = fts5_query(query)
+    if not query.strip():
+        return []
+    if sql is None:
+        return (Recipe.objects.visible_to(user)
+                .filter(title__icontains=query)
+                .order_by('-created', '-pk')
+                .values_list('pk', flat=True))
+    return SearchResults(sql, query, user_id)
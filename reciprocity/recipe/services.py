@@ -0,0 +1,275 @@
+"""Save recipes together with their ingredient formsets."""
+from collections import Counter
+from django.db import connection, transaction
+from django.db.models import (
+    Case,
+    CharField,
+    Count,
+    F,
+    IntegerField,
+    TextField,
+    Value,
+    When
+)
+from django.utils import timezone
+from .feed import update_latest_public
+from .ingredient_index import ingredient_index
+from .jobs import show_stored_photo
+from .models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredientRelationship,
+    RecipeLineage,
+    touch
+)
+from .photos import keep_uploaded_photo, release_photos
+from .search import index_recipes
+from .similar import update_neighbours
+from .tiles import bump_tile_versions
+
+
+def adjust_ingredient_usage(deltas):
+    """Apply per-ingredient usage count changes in one UPDATE."""
+    deltas = dict((pk, delta) for pk, delta in deltas.items() if delta)
+    if not deltas:
+        return
+    Ingredient.objects.filter(pk__in=deltas).update(
+        usage_count=F('usage_count') + Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+            output_field=IntegerField()))
+    ingredient_index.adjust_usage(deltas)
+
+
+def adjust_recipe_counts(field, deltas):
+    """Apply per-recipe changes to one counter field in one UPDATE."""
+    deltas = dict((pk, delta) for pk, delta in deltas.items() if delta)
+    if not deltas:
+        return
+    changes = touch()
+    changes[field] = F(field) + Case(
+        *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+        output_field=IntegerField())
+    Recipe.objects.filter(pk__in=deltas).update(**changes)
+
+
+INSERT_FAVORITE = {
+    'postgresql': (
+        'INSERT INTO {favorites} (chefprofile_id, recipe_id) '
+        'SELECT id, %s FROM {profiles} WHERE user_id = %s '
+        'ON CONFLICT DO NOTHING'),
+    'sqlite': (
+        'INSERT OR IGNORE INTO {favorites} (chefprofile_id, recipe_id) '
+        'SELECT id, %s FROM {profiles} WHERE user_id = %s'),
+}
+INSERT_MISSING_FAVORITE = (
+    'INSERT INTO {favorites} (chefprofile_id, recipe_id) '
+    'SELECT id, %s FROM {profiles} p WHERE user_id = %s '
+    'AND NOT EXISTS (SELECT 1 FROM {favorites} f '
+    'WHERE f.chefprofile_id = p.id AND f.recipe_id = %s)')
+DELETE_FAVORITE = (
+    'DELETE FROM {favorites} WHERE recipe_id = %s AND chefprofile_id IN ('
+    'SELECT id FROM {profiles} WHERE user_id = %s)')
+
+
+def set_favorite(user, recipe, favorite=True):
+    """Add or remove a favorite, returning whether anything changed.
+
+    The favorite row is written with one statement that does nothing when
+    it is already in the wanted state, and the recipe's favorite count
+    moves with F() only when a row was actually inserted or deleted.
+    """
+    through = Recipe.favorite_of.through
+    tables = {'favorites': through._meta.db_table,
+              'profiles': through._meta.get_field(
+                  'chefprofile').related_model._meta.db_table}
+    if not favorite:
+        sql, params = DELETE_FAVORITE, [recipe.pk, user.pk]
+    elif connection.vendor in INSERT_FAVORITE:
+        sql, params = INSERT_FAVORITE[connection.vendor], [recipe.pk, user.pk]
+    else:
+        sql = INSERT_MISSING_FAVORITE
+        params = [recipe.pk, user.pk, recipe.pk]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql.format(**tables), params)
+        changed = cursor.rowcount
+        if changed:
+            adjust_recipe_counts('favorite_count', {
+                recipe.pk: changed if favorite else -changed})
+    return bool(changed)
+
+
+def format_ingredient_ids(ingredient_ids):
+    """Return ingredient ids as the sorted text stored on a recipe."""
+    return ' '.join(str(pk) for pk in sorted(set(ingredient_ids)))
+
+
+def refresh_ingredient_ids(recipe_ids, batch_size=500):
+    """Store the sorted ingredient ids and ingredient counts of recipes.
+
+    Each batch of recipes costs one SELECT of their ingredient rows and
+    one CASE UPDATE.
+    """
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), batch_size):
+        batch = recipe_ids[start:start + batch_size]
+        ingredient_ids = dict((pk, []) for pk in batch)
+        rows = (RecipeIngredientRelationship.objects
+                .filter(recipe__in=batch)
+                .values_list('recipe', 'ingredient'))
+        for recipe, ingredient in rows:
+            ingredient_ids[recipe].append(ingredient)
+        Recipe.objects.filter(pk__in=batch).update(
+            ingredient_ids=Case(
+                *[When(pk=pk, then=Value(format_ingredient_ids(ids)))
+                  for pk, ids in ingredient_ids.items()],
+                output_field=TextField()),
+            ingredient_count=Case(
+                *[When(pk=pk, then=Value(len(ids)))
+                  for pk, ids in ingredient_ids.items()],
+                output_field=IntegerField()),
+            **touch())
+
+
+def save_recipe(recipe_form, formset, author=None, parent=None):
+    """Save a recipe and its ingredients in one transaction.
+
+    Submitted rows that already belong to the recipe are updated with a
+    single CASE UPDATE or removed with a single DELETE when marked for
+    deletion; all other rows, including ones copied from a parent
+    recipe, are inserted with one bulk INSERT. Ingredient usage counts
+    follow with one more UPDATE. Once the ingredients are in place the
+    recipe's stored ingredient ids and ingredient count are rewritten
+    and its similar recipes recomputed; its full-text entry follows on
+    commit from the post_save handler. A newly uploaded
+    photo is queued for the photo worker, and the recipe shows a
+    placeholder until its thumbnails are written; the photo it replaced
+    is deleted once no recipe uses it, and the new one is written again
+    if a recipe releasing it deleted it before the commit.
+    """
+    replaced = recipe_form.initial.get('photo')
+    with transaction.atomic():
+        if author is not None:
+            recipe_form.instance.author = author
+        if parent is not None:
+            recipe_form.instance.parent = parent
+        recipe = recipe_form.save(commit=False)
+        new_photo = 'photo' in recipe_form.changed_data
+        if new_photo:
+            recipe.photo_ready = False
+        if recipe.pk is None:
+            recipe.save()
+        else:
+            # Leave counters other requests may have moved untouched.
+            recipe.save(update_fields=list(recipe_form._meta.fields) +
+                        ['photo_ready'])
+        if new_photo and recipe.photo:
+            show_stored_photo(recipe, recipe.photo.name)
+            keep_uploaded_photo(recipe.photo.name,
+                                recipe_form.cleaned_data['photo'])
+        recipe_form.save_m2m()
+        if parent is not None:
+            RecipeLineage.objects.add_recipe(recipe)
+        new, changed, removed = [], {}, []
+        usage = Counter()
+        for ingredient in formset.cleaned_data:
+            if not ingredient:
+                continue
+            existing = ingredient.get('id')
+            if existing is not None and existing.recipe_id == recipe.pk:
+                usage[existing.ingredient_id] -= 1
+                if ingredient.get('DELETE'):
+                    removed.append(existing.pk)
+                else:
+                    changed[existing.pk] = ingredient
+                    usage[ingredient['ingredient'].pk] += 1
+            elif not ingredient.get('DELETE'):
+                new.append(RecipeIngredientRelationship(
+                    recipe=recipe,
+                    quantity=ingredient['quantity'],
+                    ingredient=ingredient['ingredient']))
+                usage[ingredient['ingredient'].pk] += 1
+        relationships = RecipeIngredientRelationship.objects.filter(
+            recipe=recipe)
+        if removed:
+            relationships.filter(pk__in=removed).delete()
+        if changed:
+            relationships.filter(pk__in=changed).update(
+                quantity=Case(
+                    *[When(pk=pk, then=Value(row['quantity']))
+                      for pk, row in changed.items()],
+                    output_field=CharField()),
+                ingredient=Case(
+                    *[When(pk=pk, then=Value(row['ingredient'].pk))
+                      for pk, row in changed.items()],
+                    output_field=IntegerField()))
+        if new:
+            RecipeIngredientRelationship.objects.bulk_create(new)
+        adjust_ingredient_usage(usage)
+        if new or changed or removed:
+            refresh_ingredient_ids([recipe.pk])
+        update_neighbours(recipe.pk)
+    if new_photo and replaced:
+        release_photos([replaced.name])
+    return recipe
+
+
+def create_variation(parent, author):
+    """Copy a recipe as a new variation by author and return its id.
+
+    The recipe row and its ingredient rows are each copied with one
+    INSERT ... SELECT, so none of them pass through Python, and lineage
+    rows follow through RecipeLineage.objects.add_recipe(). The copy
+    starts with fresh counters and its own timestamps; everything else,
+    photo included, is the parent's. Counters, search entry, neighbours,
+    tiles and the public feed are kept as saving a variation through
+    the form would keep them, all in one transaction. The copy's id
+    comes from the INSERT and its privacy from parent, which needs only
+    its pk and privacy loaded, so the new row is never read back.
+    """
+    table = Recipe._meta.db_table
+    now = timezone.now()
+    fresh = {'author_id': author.pk, 'parent_id': parent.pk,
+             'created': now, 'updated': now, 'version': 0,
+             'variation_count': 0, 'descendant_count': 0,
+             'favorite_count': 0, 'import_key': None}
+    columns, values, params = [], [], []
+    for field in Recipe._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        columns.append(field.column)
+        if field.attname in fresh:
+            values.append('%s')
+            params.append(field.get_db_prep_save(fresh[field.attname],
+                                                 connection))
+        else:
+            values.append(field.column)
+    params.append(parent.pk)
+    relationships = RecipeIngredientRelationship._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {table} ({columns}) SELECT {values} FROM {table} '
+            'WHERE id = %s'.format(table=table,
+                                   columns=', '.join(columns),
+                                   values=', '.join(values)),
+            params)
+        recipe_id = connection.ops.last_insert_id(cursor, table, 'id')
+        cursor.execute(
+            'INSERT INTO {relationships} (recipe_id, ingredient_id, quantity) '
+            'SELECT %s, ingredient_id, quantity FROM {relationships} '
+            'WHERE recipe_id = %s ORDER BY id'.format(
+                relationships=relationships),
+            [recipe_id, parent.pk])
+        recipe = Recipe(pk=recipe_id, parent_id=parent.pk,
+                        privacy=parent.privacy)
+        RecipeLineage.objects.add_recipe(recipe)
+        adjust_recipe_counts('variation_count', {parent.pk: 1})
+        adjust_ingredient_usage(dict(
+            RecipeIngredientRelationship.objects.filter(recipe=recipe_id)
+            .order_by()
+            .values_list('ingredient')
+            .annotate(Count('pk'))))
+        index_recipes([recipe_id])
+        update_neighbours(recipe_id)
+        bump_tile_versions([parent.pk])
+        update_latest_public(recipe)
+    return recipe_id
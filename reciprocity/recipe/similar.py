@@ -0,0 +1,102 @@
+"""Find and store the public recipes most similar to each recipe.
+
+Similarity is the Jaccard index of two recipes' ingredient sets, read
+from the ids stored in Recipe.ingredient_ids.
+"""
+import heapq
+from .models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredientRelationship,
+    RecipeNeighbour,
+    touch
+)
+from .pantry import parse_ingredient_ids
+
+NEIGHBOURS = 6
+COMMON_INGREDIENT_USAGE = 1000
+FALLBACK_NOMINATORS = 2
+MAX_CANDIDATES = 500
+
+
+def jaccard(shared, size, other_size):
+    """Return the Jaccard index of two sets from their sizes and overlap."""
+    return float(shared) / (size + other_size - shared)
+
+
+def store_neighbours(neighbours):
+    """Replace the stored neighbours of recipes with the given lists.
+
+    neighbours maps recipe ids to lists of (similarity, neighbour id).
+    The recipes are marked changed, as their pages list their neighbours.
+    """
+    Recipe.objects.filter(pk__in=neighbours).update(**touch())
+    RecipeNeighbour.objects.filter(recipe__in=neighbours).delete()
+    RecipeNeighbour.objects.bulk_create([
+        RecipeNeighbour(recipe_id=pk, neighbour_id=neighbour,
+                        similarity=similarity)
+        for pk, nearest in neighbours.items()
+        for similarity, neighbour in nearest])
+
+
+def update_neighbours(recipe_id, count=NEIGHBOURS):
+    """Recompute one recipe's neighbours and offer it to similar recipes.
+
+    Candidates are the newest MAX_CANDIDATES public recipes sharing one
+    of its ingredients used by at most COMMON_INGREDIENT_USAGE recipes;
+    staples such as salt would otherwise make every recipe a candidate.
+    A recipe using only staples is matched on its FALLBACK_NOMINATORS
+    least used ones. Candidates' stored ingredient ids are read in one
+    query and scored on all ingredients. The recipe's own list is
+    rewritten, unless skipping staples left no candidates at all, and
+    if it is public it joins the lists of candidates it is now closer
+    to than their least similar neighbour. Lists it drops out of stay
+    one short until the next build_recipe_neighbours run.
+    """
+    recipe = (Recipe.objects.filter(pk=recipe_id)
+              .values_list('ingredient_ids', 'privacy').first())
+    if recipe is None:
+        return
+    uses = parse_ingredient_ids(recipe[0])
+    usage = list(Ingredient.objects.filter(pk__in=uses)
+                 .order_by('usage_count', 'pk')
+                 .values_list('pk', 'usage_count'))
+    nominators = [pk for pk, usage_count in usage
+                  if usage_count <= COMMON_INGREDIENT_USAGE]
+    if not nominators:
+        nominators = [pk for pk, usage_count in
+                      usage[:FALLBACK_NOMINATORS]]
+    candidate_ids = list(RecipeIngredientRelationship.objects
+                         .filter(ingredient__in=nominators,
+                                 recipe__privacy='pu')
+                         .exclude(recipe=recipe_id)
+                         .order_by('-recipe')
+                         .values_list('recipe', flat=True)
+                         .distinct()[:MAX_CANDIDATES])
+    candidates = (Recipe.objects.filter(pk__in=candidate_ids)
+                  .values_list('pk', 'ingredient_ids'))
+    scored = {}
+    for pk, value in candidates:
+        other = parse_ingredient_ids(value)
+        scored[pk] = jaccard(len(uses & other), len(uses), len(other))
+    changed = {}
+    if scored or len(nominators) == len(usage):
+        changed[recipe_id] = heapq.nlargest(
+            count, ((similarity, pk) for pk, similarity in scored.items()))
+    dropped = RecipeNeighbour.objects.filter(neighbour=recipe_id)
+    dropped_ids = set(dropped.values_list('recipe', flat=True))
+    dropped.delete()
+    if recipe[1] == 'pu' and scored:
+        lists = dict((pk, []) for pk in scored)
+        rows = (RecipeNeighbour.objects.filter(recipe__in=scored)
+                .values_list('recipe', 'similarity', 'neighbour'))
+        for pk, similarity, neighbour in rows:
+            lists[pk].append((similarity, neighbour))
+        for pk, nearest in lists.items():
+            entry = (scored[pk], recipe_id)
+            if len(nearest) < count or entry > min(nearest):
+                changed[pk] = heapq.nlargest(count, nearest + [entry])
+    store_neighbours(changed)
+    dropped_ids.difference_update(changed)
+    if dropped_ids:
+        Recipe.objects.filter(pk__in=dropped_ids).update(**touch())
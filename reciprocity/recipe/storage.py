@@ -0,0 +1,111 @@
+"""Store recipe photos under the hash of their content.
+
+Identical uploads share one file, and a stored file never changes, so
+its URL can be cached forever.
+"""
+import hashlib
+import os
+import re
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, get_storage_class
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.functional import LazyObject, empty
+
+CONTENT_ADDRESSED_NAME = re.compile(r'(^|/)[0-9a-f]{64}(\.\w+)+$')
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+ASIDE_SUFFIX = '.deleting'
+
+
+def is_content_addressed(name):
+    """Return whether a stored name is a content hash, or derived from one."""
+    return CONTENT_ADDRESSED_NAME.search(name) is not None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage naming files by the SHA-256 of their content.
+
+    Saving content that is already stored returns the existing name
+    without writing anything. Files are shared between the recipes using
+    them, so they are deleted with photos.release_photos() once unused,
+    and an upload that found its file stored checks it is still there
+    with photos.keep_uploaded_photo() once committed.
+    """
+
+    def content_name(self, name, content):
+        """Return the name content is stored under, in name's directory."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return '/'.join(part for part in (
+            directory, digest.hexdigest() + extension) if part)
+
+    def save(self, name, content, max_length=None):
+        """Store content once under its hash and return that name."""
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        return super(ContentAddressedStorage, self).save(name, content,
+                                                         max_length)
+
+    def write(self, name, content):
+        """Store content under exactly name unless a file is there already.
+
+        For files derived from a stored photo, such as its thumbnails,
+        whose names follow from the photo's hash and how they were made.
+        A file under such a name already holds that content and is served
+        as immutable, so it is never replaced.
+        """
+        if self.exists(name):
+            return name
+        return super(ContentAddressedStorage, self).save(name, content)
+
+    def set_aside(self, name):
+        """Move a stored file out of its name and return where it went.
+
+        The move is a single rename, so an upload finding the name empty
+        afterwards knows to write the file again. Returns None if
+        nothing is stored under name.
+        """
+        aside = name + ASIDE_SUFFIX
+        try:
+            os.rename(self.path(name), self.path(aside))
+        except OSError:
+            if self.exists(name):
+                raise
+            return None
+        return aside
+
+    def put_back(self, name, aside):
+        """Return a file moved by set_aside() to its name.
+
+        A file an upload wrote there meanwhile has the same content, so
+        it is simply replaced.
+        """
+        os.rename(self.path(aside), self.path(name))
+
+
+class PhotoStorage(LazyObject):
+    """The storage class named by settings.RECIPE_PHOTO_STORAGE."""
+
+    def _setup(self):
+        self._wrapped = get_storage_class(settings.RECIPE_PHOTO_STORAGE)()
+
+
+photo_storage = PhotoStorage()
+
+
+@receiver(setting_changed)
+def reset_photo_storage(sender, **kwargs):
+    """Pick up changed media settings, as Django does for default_storage."""
+    if kwargs['setting'] in ('MEDIA_ROOT', 'MEDIA_URL',
+                             'RECIPE_PHOTO_STORAGE'):
+        photo_storage._wrapped = empty
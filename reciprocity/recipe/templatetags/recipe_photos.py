@@ -0,0 +1,11 @@
+"""Template filters for the resized copies of recipe photos."""
+from django import template
+from recipe.photos import thumbnail_url
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail(photo, size):
+    """Return the URL of one size of a recipe photo, e.g. 'tile'."""
+    return thumbnail_url(photo.name, size, photo.storage)
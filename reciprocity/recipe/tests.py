@@ -1,16 +1,92 @@
 from django.conf import settings
-from django.test import Client, TestCase
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max
+from django.test import Client, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
 from factory.django import DjangoModelFactory
-from .models import Ingredient, Recipe, RecipeIngredientRelationship
+from .models import (
+    Ingredient,
+    PhotoJob,
+    Recipe,
+    RecipeIngredientRelationship,
+    RecipeLineage,
+    RecipeNeighbour,
+    canonical_name
+)
 from .forms import RecipeIngredientRelationshipFormSet, IngredientForm, RecipeForm
+from .exporter import export_lines
+from .feed import (
+    FEED_BUFFER,
+    PERSONAL_FEED_KEY,
+    PERSONAL_FEED_VERSION_KEY,
+    get_feed_version,
+    get_latest_public_entries,
+    get_latest_public_ids,
+    get_personal_feed_ids
+)
+from .ingredient_index import ingredient_index
+from .jobs import (
+    MAX_ATTEMPTS,
+    claim_jobs,
+    finish_jobs,
+    queue_photos,
+    requeue_stale_jobs,
+    resize_photo
+)
+from .pantry import rank_by_coverage
+from .photos import (
+    delete_unused_photos,
+    generate_thumbnails,
+    keep_uploaded_photo,
+    thumbnail_name
+)
+from .services import (
+    adjust_ingredient_usage,
+    refresh_ingredient_ids,
+    set_favorite
+)
+from .similar import COMMON_INGREDIENT_USAGE, update_neighbours
+from .storage import (
+    ContentAddressedStorage,
+    is_content_addressed,
+    photo_storage
+)
+from .tiles import render_tiles
 from .views import vary_recipe
+from reciprocity.views import serve_media
 from django.forms import formsets
-from datetime import datetime
+from datetime import datetime, timedelta
+from io import BytesIO
+from PIL import Image
+from django.utils import six, timezone
+from django.utils.six import StringIO
 import factory
+import json
+import os
+import shutil
+import tempfile
 
 PASSWORD = 'this is the password'
 
 
+def run_commit_hooks():
+    """Run the on_commit callbacks held back by TestCase's transaction.
+
+    TestCase never commits, so work deferred until commit only happens
+    where a test calls this, as it would when a request's transaction
+    commits.
+    """
+    while connection.run_on_commit:
+        savepoint_ids, callback = connection.run_on_commit.pop(0)
+        callback()
+
+
 class UserFactory(DjangoModelFactory):
     """Instantiate a user model instance for testing."""
     class Meta:
@@ -76,6 +152,15 @@ class RecipeModelTest(TestCase):
         self.assertEqual(self.variant, self.ants_on_a_log.variations.first())
         self.assertEqual(self.variant.parent, self.ants_on_a_log)
 
+    def test_version(self):
+        """Confirm saving raises the version and leaves it readable."""
+        version = self.no_work_bread.version
+        self.no_work_bread.save()
+        self.assertEqual(self.no_work_bread.version, version + 1)
+        self.no_work_bread.save(update_fields=['title'])
+        self.assertEqual(self.no_work_bread.version, version + 2)
+        self.assertEqual(Recipe.objects.get(pk=1).version, version + 2)
+
 
 class IngredientModelTest(TestCase):
     """Test the Ingredient model."""
@@ -93,6 +178,15 @@ class IngredientModelTest(TestCase):
         """Test basic field for model instance."""
         self.assertEqual(self.yeast.name, 'yeast')
 
+    def test_canonical_name(self):
+        """Confirm spellings of one ingredient share a canonical name."""
+        names = ['Tomato', 'tomatoes', ' tomato ', 'Tomatoes!']
+        self.assertEqual(set(canonical_name(name) for name in names),
+                         set(['tomato']))
+        self.assertEqual(canonical_name('Berries'), 'berry')
+        self.assertEqual(canonical_name('asparagus'), 'asparagus')
+        self.assertEqual(IngredientFactory(name='Eggs').canonical_name, 'egg')
+
 
 class RecipeIngredientModelTest(TestCase):
     """Test the RecipeIngredientRelationship model."""
@@ -126,6 +220,7 @@ class TestView(TestCase):
     """Generic class for testing views."""
     def setUp(self):
         """Provide user and client authenticated as user."""
+        cache.clear()
         self.user = UserFactory()
         self.user.set_password(PASSWORD)
         self.user.save()
@@ -150,6 +245,86 @@ class ViewMyFavorites(TestView):
         response = self.client.get('/recipe/view/favorites/')
         self.assertNotIn(str(self.unfavorited_recipe), str(response.content))
 
+    def test_paginated(self):
+        """Confirm favorites are listed newest first, a page at a time."""
+        author = UserFactory(username='favorite author')
+        recipes = [RecipeFactory(author=author) for _ in range(30)]
+        self.user.profile.favorites.add(*recipes)
+        response = self.client.get('/recipe/view/favorites/')
+        ids = [recipe.pk for recipe in reversed(recipes)]
+        self.assertEqual(list(response.context['object_list']), ids[:24])
+        self.assertEqual(response.context['tiles'], render_tiles(ids[:24]))
+        response = self.client.get('/recipe/view/favorites/?after={}'.format(
+            response.context['next_cursor']))
+        self.assertEqual(list(response.context['object_list']),
+                         ids[24:] + [self.favorite_recipe.pk])
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_private_hidden(self):
+        """Confirm favorites made private by their authors are hidden."""
+        self.favorite_recipe.privacy = 'pr'
+        self.favorite_recipe.save()
+        response = self.client.get('/recipe/view/favorites/')
+        self.assertEqual(list(response.context['object_list']), [])
+
+
+class FavoriteEndpoint(TestView):
+    """Test favoriting and unfavoriting recipes."""
+    def setUp(self):
+        super(FavoriteEndpoint, self).setUp()
+        self.recipe = RecipeFactory(author=UserFactory(username='chef'))
+        self.url = '/recipe/view/{}/favorite/'.format(self.recipe.pk)
+
+    def favorite_count(self):
+        """Return the stored favorite count of the recipe."""
+        return Recipe.objects.get(pk=self.recipe.pk).favorite_count
+
+    def test_favorite(self):
+        """Confirm favoriting twice adds one row and counts it once."""
+        # Session, user, recipe, savepoint, insert, update and release.
+        with self.assertNumQueries(7):
+            response = self.client.post(self.url)
+        self.assertEqual(response.json(), {'recipe': self.recipe.pk,
+                                           'favorite': True,
+                                           'favorite_count': 1})
+        with self.assertNumQueries(6):
+            response = self.client.post(self.url)
+        self.assertEqual(response.json()['favorite_count'], 1)
+        self.assertEqual(list(self.user.profile.favorites.all()),
+                         [self.recipe])
+        self.assertEqual(self.favorite_count(), 1)
+
+    def test_unfavorite(self):
+        """Confirm unfavoriting removes the row and uncounts it once."""
+        self.client.post(self.url)
+        response = self.client.delete(self.url)
+        self.assertEqual(response.json(), {'recipe': self.recipe.pk,
+                                           'favorite': False,
+                                           'favorite_count': 0})
+        response = self.client.delete(self.url)
+        self.assertEqual(response.json()['favorite_count'], 0)
+        self.assertFalse(self.user.profile.favorites.exists())
+        self.assertEqual(self.favorite_count(), 0)
+
+    def test_private(self):
+        """Confirm other chefs' private recipes can not be favorited."""
+        self.recipe.privacy = 'pr'
+        self.recipe.save()
+        self.assertEqual(self.client.post(self.url).status_code, 404)
+
+    def test_methods(self):
+        """Confirm only logged in POST and DELETE requests are accepted."""
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.assertEqual(Client().post(self.url).status_code, 302)
+
+    def test_detail_button(self):
+        """Confirm the recipe page knows whether the chef favorited it."""
+        response = self.client.get('/recipe/view/{}/'.format(self.recipe.pk))
+        self.assertFalse(response.context['is_favorite'])
+        self.client.post(self.url)
+        response = self.client.get('/recipe/view/{}/'.format(self.recipe.pk))
+        self.assertTrue(response.context['is_favorite'])
+
 
 class ViewMyRecipes(TestView):
     def setUp(self):
@@ -167,6 +342,628 @@ class ViewMyRecipes(TestView):
         response = self.client.get('/recipe/view/my_recipes/')
         self.assertNotIn(str(self.unauthored_recipe), str(response.content))
 
+    def test_cursor_pages(self):
+        """Confirm cursors page both ways through recipes sharing a time."""
+        created = self.authored_recipe.created
+        recipes = [RecipeFactory(author=self.user) for _ in range(29)]
+        Recipe.objects.filter(author=self.user).update(created=created)
+        ids = sorted((recipe.pk for recipe in recipes), reverse=True)
+        ids.append(self.authored_recipe.pk)
+        response = self.client.get('/recipe/view/my_recipes/')
+        self.assertEqual(list(response.context['object_list']), ids[:24])
+        self.assertIsNone(response.context['previous_cursor'])
+        with self.assertNumQueries(5):
+            response = self.client.get('/recipe/view/my_recipes/?after=' +
+                                       response.context['next_cursor'])
+        self.assertEqual(list(response.context['object_list']), ids[24:])
+        self.assertIsNone(response.context['next_cursor'])
+        response = self.client.get('/recipe/view/my_recipes/?before=' +
+                                   response.context['previous_cursor'])
+        self.assertEqual(list(response.context['object_list']), ids[:24])
+        self.assertIsNone(response.context['previous_cursor'])
+
+    def test_cursor_stable(self):
+        """Confirm a page does not shift when newer recipes are added."""
+        recipes = [RecipeFactory(author=self.user) for _ in range(25)]
+        response = self.client.get('/recipe/view/my_recipes/')
+        cursor = response.context['next_cursor']
+        RecipeFactory(author=self.user)
+        response = self.client.get('/recipe/view/my_recipes/?after=' + cursor)
+        self.assertEqual(list(response.context['object_list']),
+                         [recipes[0].pk, self.authored_recipe.pk])
+
+    def test_bad_cursor(self):
+        """Confirm an unreadable cursor serves the first page."""
+        response = self.client.get('/recipe/view/my_recipes/?after=soup')
+        self.assertEqual(list(response.context['object_list']),
+                         [self.authored_recipe.pk])
+
+
+class PhotoTestView(TestView):
+    """Generic class for testing views storing photos."""
+    def setUp(self):
+        """Store photos in a temporary media root."""
+        super(PhotoTestView, self).setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = self.settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def photo(self, size=(2000, 1000), mode='RGB', fmt='JPEG', **kwargs):
+        """Return an uploaded photo of the given size and format."""
+        output = BytesIO()
+        Image.new(mode, size).save(output, fmt, **kwargs)
+        return SimpleUploadedFile('photo.' + fmt.lower(), output.getvalue())
+
+    def stored(self, name, size):
+        """Return one stored size of a photo, opened with Pillow."""
+        with default_storage.open(thumbnail_name(name, size)) as thumbnail:
+            image = Image.open(BytesIO(thumbnail.read()))
+            image.load()
+        return image
+
+
+class PhotoThumbnails(PhotoTestView):
+    """Test the resized copies written for uploaded photos."""
+    def test_upload(self):
+        """Confirm uploads are resized upright, without their EXIF data."""
+        # A big-endian EXIF block whose only tag is orientation 6, which
+        # means the camera was turned a quarter turn clockwise.
+        exif = (b'Exif\x00\x00MM\x00\x2a\x00\x00\x00\x08\x00\x01'
+                b'\x01\x12\x00\x03\x00\x00\x00\x01\x00\x06\x00\x00'
+                b'\x00\x00\x00\x00')
+        response = self.client.post('/recipe/add/', {
+            'title': 'Photographed',
+            'directions': 'Look.',
+            'privacy': 'pu',
+            'photo': self.photo(exif=exif),
+            'ingredient_form-TOTAL_FORMS': '0',
+            'ingredient_form-INITIAL_FORMS': '0'})
+        self.assertEqual(response.status_code, 302)
+        recipe = Recipe.objects.get(title='Photographed')
+        name = recipe.photo.name
+        self.assertTrue(default_storage.exists(name))
+        self.assertFalse(recipe.photo_ready)
+        self.assertFalse(default_storage.exists(thumbnail_name(name, 'tile')))
+        self.assertEqual(PhotoJob.objects.get().photo, name)
+        call_command('photo_worker', once=True, processes=1,
+                     stdout=StringIO())
+        self.assertTrue(Recipe.objects.get(pk=recipe.pk).photo_ready)
+        self.assertEqual(PhotoJob.objects.get().status, 'do')
+        sizes = {'tile': (300, 600), 'detail': (800, 1600),
+                 'retina': (1000, 2000)}
+        for size, dimensions in sizes.items():
+            image = self.stored(name, size)
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, dimensions)
+            self.assertNotIn('exif', image.info)
+
+    def test_transparent(self):
+        """Confirm transparent photos are flattened onto white."""
+        name = default_storage.save('recipe_photos/clear.png', self.photo(
+            size=(10, 10), mode='RGBA', fmt='PNG'))
+        names = generate_thumbnails(name)
+        self.assertEqual(names['tile'], 'recipe_photos/clear.tile.300q80.jpg')
+        image = self.stored(name, 'tile')
+        self.assertEqual(image.size, (10, 10))
+        self.assertEqual(image.getpixel((5, 5)), (255, 255, 255))
+
+    def test_srcset(self):
+        """Confirm tiles and detail pages pick sizes with srcset."""
+        recipe = RecipeFactory(author=self.user,
+                               photo='recipe_photos/dish.jpg',
+                               photo_ready=True)
+        response = self.client.get('/recipe/view/{}/'.format(recipe.pk))
+        self.assertContains(response, 'src="/media/recipe_photos/'
+                                      'dish.detail.800q80.jpg" srcset="'
+                                      '/media/recipe_photos/'
+                                      'dish.detail.800q80.jpg 1x, '
+                                      '/media/recipe_photos/'
+                                      'dish.retina.1600q80.jpg 2x"')
+        self.assertIn('/media/recipe_photos/dish.tile.300q80.jpg 1x, '
+                      '/media/recipe_photos/dish.detail.800q80.jpg 2x',
+                      render_tiles([recipe.pk])[0])
+
+
+class PhotoWorker(PhotoTestView):
+    """Test the photo job queue and its worker command."""
+    def setUp(self):
+        super(PhotoWorker, self).setUp()
+        self.name = default_storage.save('recipe_photos/dish.jpg',
+                                         self.photo())
+        self.recipe = RecipeFactory(author=self.user, photo=self.name)
+        queue_photos([self.name])
+
+    def work(self):
+        """Run the worker until the queue is empty."""
+        call_command('photo_worker', once=True, processes=2,
+                     stdout=StringIO())
+
+    def test_placeholder(self):
+        """Confirm tiles show a placeholder until the photo is resized."""
+        tile = render_tiles([self.recipe.pk])[0]
+        self.assertIn('photo-placeholder.svg', tile)
+        self.work()
+        run_commit_hooks()
+        tile = render_tiles([self.recipe.pk])[0]
+        self.assertNotIn('photo-placeholder.svg', tile)
+        self.assertIn(thumbnail_name(self.name, 'tile'), tile)
+
+    def test_claim_once(self):
+        """Confirm a claimed job is not handed to another worker."""
+        queue_photos([self.name])
+        first = claim_jobs('first', 1)
+        second = claim_jobs('second', 5)
+        self.assertEqual(len(first), 1)
+        self.assertEqual([job.pk for job in second],
+                         [PhotoJob.objects.last().pk])
+        self.assertEqual(claim_jobs('third', 5), [])
+        self.assertEqual(first[0].attempts, 1)
+
+    def test_stale(self):
+        """Confirm jobs of workers that went quiet are run again."""
+        claim_jobs('gone', 1)
+        self.assertEqual(requeue_stale_jobs(60), 0)
+        PhotoJob.objects.update(started=timezone.now() -
+                                timedelta(seconds=120))
+        self.assertEqual(requeue_stale_jobs(60), 1)
+        self.work()
+        self.assertTrue(Recipe.objects.get(pk=self.recipe.pk).photo_ready)
+
+    def test_stale_attempts(self):
+        """Confirm jobs that keep stalling their workers fail in the end."""
+        for attempt in range(MAX_ATTEMPTS):
+            self.assertEqual(PhotoJob.objects.get().status, 'pe')
+            claim_jobs('doomed', 1)
+            PhotoJob.objects.update(started=timezone.now() -
+                                    timedelta(seconds=120))
+            requeue_stale_jobs(60)
+        job = PhotoJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ('fa', MAX_ATTEMPTS))
+        self.assertEqual(claim_jobs('next', 1), [])
+
+    def test_broken_photo(self):
+        """Confirm broken photos are retried, then given up on."""
+        default_storage.delete(self.name)
+        default_storage.save(self.name, SimpleUploadedFile('dish.jpg',
+                                                           b'not a photo'))
+        for attempt in range(MAX_ATTEMPTS):
+            self.assertEqual(PhotoJob.objects.get().status, 'pe')
+            jobs = claim_jobs('worker', 1)
+            finish_jobs(jobs, dict([resize_photo(self.name)]))
+        job = PhotoJob.objects.get()
+        self.assertEqual(job.status, 'fa')
+        self.assertEqual(job.attempts, MAX_ATTEMPTS)
+        self.assertIn('Error', job.error)
+        self.assertFalse(Recipe.objects.get(pk=self.recipe.pk).photo_ready)
+
+
+class ContentAddressedPhotos(PhotoTestView):
+    """Test storing identical photos once and deleting unused ones."""
+    def add(self, title, photo):
+        """Add a recipe with a photo through the view and return it."""
+        self.client.post('/recipe/add/', {
+            'title': title,
+            'directions': 'Look.',
+            'privacy': 'pu',
+            'photo': photo,
+            'ingredient_form-TOTAL_FORMS': '0',
+            'ingredient_form-INITIAL_FORMS': '0'})
+        return Recipe.objects.get(title=title)
+
+    def work(self):
+        """Run the worker until the queue is empty."""
+        call_command('photo_worker', once=True, processes=1,
+                     stdout=StringIO())
+
+    def test_deduplicated(self):
+        """Confirm identical uploads share one file and its thumbnails."""
+        first = self.add('First', self.photo())
+        self.assertTrue(is_content_addressed(first.photo.name))
+        self.work()
+        second = self.add('Second', self.photo())
+        self.assertEqual(second.photo.name, first.photo.name)
+        self.assertTrue(second.photo_ready)
+        self.assertEqual(PhotoJob.objects.count(), 1)
+        names = [first.photo.name] + [thumbnail_name(first.photo.name, size)
+                                      for size in ('detail', 'retina', 'tile')]
+        self.assertEqual(sorted(default_storage.listdir('recipe_photos')[1]),
+                         sorted(os.path.basename(name) for name in names))
+
+    def test_release(self):
+        """Confirm a shared file is deleted with the last recipe using it."""
+        first = self.add('First', self.photo())
+        second = self.add('Second', self.photo())
+        self.work()
+        name = first.photo.name
+        first.delete()
+        run_commit_hooks()
+        self.assertTrue(default_storage.exists(name))
+        second.delete()
+        self.assertTrue(default_storage.exists(name))
+        run_commit_hooks()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(thumbnail_name(name, 'tile')))
+
+    def test_released_before_upload_commits(self):
+        """Confirm an upload whose stored file was deleted writes it again."""
+        name = self.add('First', self.photo()).photo.name
+        run_commit_hooks()
+        self.work()
+        photo = self.photo()
+        self.assertEqual(photo_storage.save('recipe_photos/photo.jpeg', photo),
+                         name)
+        second = RecipeFactory(author=self.user, photo=name, photo_ready=True)
+        keep_uploaded_photo(name, photo)
+        for stored in [name] + [thumbnail_name(name, size)
+                                for size in ('detail', 'retina', 'tile')]:
+            default_storage.delete(stored)
+        run_commit_hooks()
+        self.assertTrue(default_storage.exists(name))
+        self.assertFalse(Recipe.objects.get(pk=second.pk).photo_ready)
+        self.work()
+        self.assertTrue(Recipe.objects.get(pk=second.pk).photo_ready)
+        self.assertTrue(default_storage.exists(thumbnail_name(name, 'tile')))
+
+    def test_upload_commits_during_release(self):
+        """Confirm a file is put back if a recipe uses it once moved aside."""
+        first = self.add('First', self.photo())
+        run_commit_hooks()
+        self.work()
+        name = first.photo.name
+        user = self.user
+
+        class RacingStorage(ContentAddressedStorage):
+            def set_aside(self, name):
+                RecipeFactory(author=user, photo=name, photo_ready=True)
+                return super(RacingStorage, self).set_aside(name)
+
+        first.delete()
+        delete_unused_photos(set([name]), RacingStorage())
+        self.assertTrue(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(thumbnail_name(name, 'tile')))
+        self.assertFalse(Recipe.objects.get(photo=name).photo_ready)
+        self.work()
+        self.assertTrue(Recipe.objects.get(photo=name).photo_ready)
+        self.assertTrue(default_storage.exists(thumbnail_name(name, 'tile')))
+
+    def test_thumbnails_kept(self):
+        """Confirm stored thumbnails are never written over."""
+        name = self.add('Dish', self.photo()).photo.name
+        self.work()
+        tile = thumbnail_name(name, 'tile')
+        with default_storage.open(tile) as thumbnail:
+            content = thumbnail.read()
+        self.assertEqual(photo_storage.write(tile, ContentFile(b'other')),
+                         tile)
+        with default_storage.open(tile) as thumbnail:
+            self.assertEqual(thumbnail.read(), content)
+
+    def test_replaced(self):
+        """Confirm a replaced photo is deleted when no longer used."""
+        recipe = self.add('Dish', self.photo())
+        name = recipe.photo.name
+        self.client.post('/recipe/edit/{}/'.format(recipe.pk), {
+            'title': 'Dish',
+            'directions': 'Look.',
+            'privacy': 'pu',
+            'photo': self.photo(size=(10, 10)),
+            'ingredient_form-TOTAL_FORMS': '0',
+            'ingredient_form-INITIAL_FORMS': '0'})
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        self.assertNotEqual(recipe.photo.name, name)
+        self.assertFalse(recipe.photo_ready)
+        run_commit_hooks()
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(PhotoJob.objects.filter(status='pe').count(), 1)
+
+    def test_hash_old_photos(self):
+        """Confirm photos stored under upload names are merged by hash."""
+        first = default_storage.save('recipe_photos/a.jpg', self.photo())
+        second = default_storage.save('recipe_photos/b.jpg', self.photo())
+        recipes = [RecipeFactory(author=self.user, photo=name)
+                   for name in (first, second, second)]
+        call_command('hash_recipe_photos', stdout=StringIO())
+        run_commit_hooks()
+        names = set(Recipe.objects.filter(pk__in=[
+            recipe.pk for recipe in recipes]).values_list('photo', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertTrue(is_content_addressed(names.pop()))
+        self.assertFalse(default_storage.exists(first))
+        self.assertFalse(default_storage.exists(second))
+        self.work()
+        self.assertEqual(Recipe.objects.filter(photo_ready=True).count(), 3)
+
+    def test_immutable(self):
+        """Confirm hashed files are served with far-future cache headers."""
+        recipe = self.add('Dish', self.photo())
+        request = RequestFactory().get('/media/' + recipe.photo.name)
+        response = serve_media(request, recipe.photo.name,
+                               document_root=settings.MEDIA_ROOT)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        name = default_storage.save('recipe_photos/dish.jpg', self.photo())
+        response = serve_media(request, name,
+                               document_root=settings.MEDIA_ROOT)
+        self.assertFalse(response.has_header('Cache-Control'))
+
+
+class RecipeApi(TestView):
+    """Test the read-only JSON API."""
+    def setUp(self):
+        super(RecipeApi, self).setUp()
+        self.anonymous = Client()
+        self.chef = UserFactory(username='api chef')
+        self.recipe = RecipeFactory(author=self.chef, title='Soup',
+                                    directions='Simmer.')
+        self.ingredients = [
+            IngredientFactory(name=name) for name in ('leek', 'potato')]
+        for ingredient in self.ingredients:
+            RecipeIngredientFactory(recipe=self.recipe,
+                                    ingredient=ingredient,
+                                    quantity='2')
+        self.url = '/recipe/api/recipes/{}/'.format(self.recipe.pk)
+
+    def test_detail(self):
+        """Confirm a recipe is sent with its ingredients in two queries."""
+        with self.assertNumQueries(2):
+            response = self.anonymous.get(self.url)
+        data = response.json()
+        self.assertEqual(data['title'], 'Soup')
+        self.assertEqual(data['author'], self.chef.pk)
+        self.assertIsNone(data['photo'])
+        self.assertEqual(data['ingredients'], [
+            {'id': ingredient.pk, 'name': ingredient.name, 'quantity': '2'}
+            for ingredient in self.ingredients])
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_sparse_fields(self):
+        """Confirm ?fields= picks the fields sent."""
+        response = self.anonymous.get(self.url, {'fields': 'title,photo'})
+        self.assertEqual(response.json(), {'id': self.recipe.pk,
+                                           'title': 'Soup',
+                                           'photo': None})
+        response = self.anonymous.get(self.url, {'fields': 'title,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Unknown fields: secret.'})
+
+    def test_not_modified(self):
+        """Confirm matching ETags get a 304 until the recipe changes."""
+        etag = self.anonymous.get(self.url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.anonymous.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.anonymous.get(self.url, {'fields': 'title'},
+                                      HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.recipe.favorite_of.add(self.user.profile)
+        response = self.anonymous.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['favorite_count'], 1)
+        etag = response['ETag']
+        self.recipe.title = 'Leek soup'
+        self.recipe.save()
+        response = self.anonymous.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['title'], 'Leek soup')
+
+    def test_private(self):
+        """Confirm private recipes are only sent, privately, to authors."""
+        recipe = RecipeFactory(author=self.user, privacy='pr')
+        url = '/recipe/api/recipes/{}/'.format(recipe.pk)
+        self.assertEqual(self.anonymous.get(url).status_code, 404)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_list(self):
+        """Confirm lists page by cursor with ingredients in three queries."""
+        recipes = [RecipeFactory(author=self.chef) for _ in range(30)]
+        for recipe in recipes:
+            RecipeIngredientFactory(recipe=recipe,
+                                    ingredient=self.ingredients[0],
+                                    quantity='1')
+        with self.assertNumQueries(3):
+            response = self.anonymous.get('/recipe/api/recipes/',
+                                          {'fields': 'title,ingredients'})
+        data = response.json()
+        self.assertEqual([item['id'] for item in data['results']],
+                         [recipe.pk for recipe in reversed(recipes)][:24])
+        self.assertEqual(data['results'][0]['ingredients'], [
+            {'id': self.ingredients[0].pk, 'name': 'leek', 'quantity': '1'}])
+        self.assertIsNone(data['previous'])
+        data = self.anonymous.get(data['next']).json()
+        self.assertEqual([item['id'] for item in data['results']],
+                         [recipe.pk for recipe in reversed(recipes[:6])] +
+                         [self.recipe.pk])
+        self.assertEqual(set(data['results'][0]),
+                         set(['id', 'title', 'ingredients']))
+        self.assertIsNone(data['next'])
+        response = self.anonymous.get('/recipe/api/recipes/',
+                                      {'author': self.user.pk})
+        self.assertEqual(response.json()['results'], [])
+
+    def test_lineage(self):
+        """Confirm lineage lists ancestors and descendants nearest first."""
+        variation = RecipeFactory(author=self.chef, parent=self.recipe)
+        RecipeLineage.objects.add_recipe(variation)
+        grandchild = RecipeFactory(author=self.chef, parent=variation)
+        RecipeLineage.objects.add_recipe(grandchild)
+        url = self.url + 'lineage/'
+        data = self.anonymous.get(url, {'fields': 'parent'}).json()
+        self.assertEqual(data['direction'], 'descendants')
+        self.assertEqual(data['results'], [
+            {'id': variation.pk, 'parent': self.recipe.pk},
+            {'id': grandchild.pk, 'parent': variation.pk}])
+        url = '/recipe/api/recipes/{}/lineage/'.format(grandchild.pk)
+        data = self.anonymous.get(url, {'direction': 'ancestors',
+                                        'fields': 'title'}).json()
+        self.assertEqual([item['id'] for item in data['results']],
+                         [variation.pk, self.recipe.pk])
+
+    def test_ingredients(self):
+        """Confirm ingredients are listed by prefix and revalidated."""
+        response = self.anonymous.get('/recipe/api/ingredients/',
+                                      {'q': 'le'})
+        self.assertEqual(response.json()['results'], [
+            {'id': self.ingredients[0].pk, 'name': 'leek', 'usage_count': 0}])
+        response = self.anonymous.get('/recipe/api/ingredients/',
+                                      {'q': 'le'},
+                                      HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        etag = response['ETag']
+        adjust_ingredient_usage({self.ingredients[0].pk: 1})
+        response = self.anonymous.get('/recipe/api/ingredients/',
+                                      {'q': 'le'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['usage_count'], 1)
+
+
+class ConditionalDetail(TestView):
+    """Test revalidating recipe pages with ETag and Last-Modified."""
+    def setUp(self):
+        super(ConditionalDetail, self).setUp()
+        self.anonymous = Client()
+        self.recipe = RecipeFactory(author=self.user)
+        Recipe.objects.filter(pk=self.recipe.pk).update(
+            updated=timezone.now() - timedelta(hours=1))
+        self.url = '/recipe/view/{}/'.format(self.recipe.pk)
+
+    def updated(self):
+        """Return the stored updated time of the recipe."""
+        return Recipe.objects.get(pk=self.recipe.pk).updated
+
+    def test_etag(self):
+        """Confirm a current ETag is answered after one lookup."""
+        response = self.anonymous.get(self.url)
+        self.assertIn('public', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            response = self.anonymous.get(
+                self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_if_modified_since(self):
+        """Confirm Last-Modified revalidates until the recipe changes."""
+        last_modified = self.anonymous.get(self.url)['Last-Modified']
+        response = self.anonymous.get(self.url,
+                                      HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.recipe.title = 'Renamed'
+        self.recipe.save()
+        response = self.anonymous.get(self.url,
+                                      HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_per_chef(self):
+        """Confirm chefs do not revalidate each other's copies."""
+        etag = self.anonymous.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_csrf_cookie(self):
+        """Confirm chefs' 304s carry the CSRF cookie the page script reads."""
+        response = self.client.get(self.url)
+        self.assertNotIn(response.cookies['csrftoken'].value,
+                         response.content.decode('utf-8'))
+        self.client.cookies.pop('csrftoken')
+        response = self.client.get(self.url,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('csrftoken', response.cookies)
+        response = self.anonymous.get(self.url)
+        self.assertNotIn('csrftoken', response.cookies)
+
+    def test_ingredient_change(self):
+        """Confirm ingredient edits move the recipe's updated time on."""
+        before = self.updated()
+        ingredient = IngredientFactory(name='thyme')
+        self.client.post('/recipe/edit/{}/'.format(self.recipe.pk), {
+            'title': self.recipe.title,
+            'directions': 'Stir.',
+            'privacy': 'pu',
+            'ingredient_form-TOTAL_FORMS': '1',
+            'ingredient_form-INITIAL_FORMS': '0',
+            'ingredient_form-0-ingredient': ingredient.pk,
+            'ingredient_form-0-quantity': '1 sprig'})
+        self.assertGreater(self.updated(), before)
+        before = self.updated()
+        ingredient.name = 'lemon thyme'
+        ingredient.save()
+        self.assertGreater(self.updated(), before)
+
+    def test_lineage_change(self):
+        """Confirm new and deleted variations move ancestors on."""
+        before = self.updated()
+        variation = RecipeFactory(author=self.user, parent=self.recipe)
+        RecipeLineage.objects.add_recipe(variation)
+        self.assertGreater(self.updated(), before)
+        Recipe.objects.filter(pk=self.recipe.pk).update(updated=before)
+        variation.delete()
+        self.assertGreater(self.updated(), before)
+
+    def test_private(self):
+        """Confirm privacy is checked before validators, and kept private."""
+        self.recipe.privacy = 'pr'
+        self.recipe.save()
+        response = self.client.get(self.url)
+        self.assertIn('private', response['Cache-Control'])
+        response = self.anonymous.get(self.url,
+                                      HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 404)
+
+
+class RecipeTiles(TestView):
+    """Test the tile queryset used by recipe list views."""
+    def setUp(self):
+        super(RecipeTiles, self).setUp()
+        other = UserFactory(username='other')
+        for _ in range(6):
+            parent = RecipeFactory(author=other)
+            recipe = RecipeFactory(author=self.user, parent=parent)
+            RecipeFactory(author=other, parent=recipe)
+            self.latest = RecipeFactory(author=other,
+                                        parent=recipe,
+                                        title='Latest variation')
+
+    def test_latest_variation(self):
+        """Confirm tiles carry the most recent variation of each recipe."""
+        recipe = Recipe.objects.filter(pk=self.latest.parent.pk).tiles()[0]
+        with self.assertNumQueries(0):
+            self.assertEqual(recipe.latest_variation, self.latest)
+            self.assertEqual(recipe.parent, self.latest.parent.parent)
+
+    def test_no_variation(self):
+        """Confirm a recipe without variations has no latest variation."""
+        recipe = Recipe.objects.filter(pk=self.latest.pk).tiles()[0]
+        with self.assertNumQueries(0):
+            self.assertIsNone(recipe.latest_variation)
+
+    def test_unprefetched_latest_variation(self):
+        """Confirm latest variation falls back to a query when not tiled."""
+        recipe = Recipe.objects.get(pk=self.latest.parent.pk)
+        self.assertEqual(recipe.latest_variation, self.latest)
+
+    def test_tiles_query_count(self):
+        """Confirm a page of tiles loads in a constant number of queries."""
+        with self.assertNumQueries(3):
+            recipes = list(Recipe.objects.all().tiles())
+            for recipe in recipes:
+                recipe.parent
+                recipe.latest_variation
+        self.assertEqual(len(recipes), 24)
+
+    def test_my_recipes_query_count(self):
+        """Confirm my recipes page does not query per tile."""
+        with self.assertNumQueries(6):
+            response = self.client.get('/recipe/view/my_recipes/')
+        self.assertIn('Recent variation: Latest variation',
+                      str(response.content))
+
 
 class ViewRecipe(TestView):
     def setUp(self):
@@ -224,6 +1021,7 @@ class Autocomplete(TestCase):
 
     def setUp(self):
         """Prepare for testing methods."""
+        ingredient_index.clear()
         self.auth_user = UserFactory()
         username = self.auth_user.username
         self.auth_user.set_password(PASSWORD)
@@ -253,6 +1051,124 @@ class Autocomplete(TestCase):
         for item in expected:
             self.assertIn(str(item), str(response.content))
 
+    def test_autocomplete_create(self):
+        """Confirm created ingredients are offered by later lookups."""
+        self.auth_user.user_permissions.add(
+            Permission.objects.get(codename='add_ingredient'))
+        url = '/recipe/ingredient-autocomplete/'
+        response = self.auth_client.post(url, {'text': 'tomatoes'})
+        self.assertIn('"text": "tomatoes"', str(response.content))
+        response = self.auth_client.get(''.join([url, '?q=toma']))
+        self.assertIn('"text": "tomatoes"', str(response.content))
+
+    def test_autocomplete_create_existing(self):
+        """Confirm creating a variant spelling returns the existing row."""
+        self.auth_user.user_permissions.add(
+            Permission.objects.get(codename='add_ingredient'))
+        count = Ingredient.objects.count()
+        url = '/recipe/ingredient-autocomplete/'
+        response = self.auth_client.post(url, {'text': ' Waters'})
+        self.assertIn('"id": 2', str(response.content))
+        self.assertEqual(Ingredient.objects.count(), count)
+
+
+class IngredientIndexTest(TestCase):
+    """Test the in-memory ingredient name index."""
+    def setUp(self):
+        """Load the index over a few ingredients."""
+        cache.clear()
+        ingredient_index.clear()
+        for name in ['Tomato', 'tomato paste', ' Tomatillo ', 'Thyme']:
+            IngredientFactory(name=name)
+        ingredient_index.load()
+
+    def names(self, prefix):
+        """Return the names of the ingredients matching a prefix."""
+        return [ingredient.name for ingredient in
+                ingredient_index.search(prefix)[:10]]
+
+    def test_prefix(self):
+        """Confirm matches are case insensitive and sorted by name."""
+        self.assertEqual(self.names('TOMA'),
+                         [' Tomatillo ', 'Tomato', 'tomato paste'])
+        self.assertEqual(self.names('th'), ['Thyme'])
+        self.assertEqual(self.names('x'), [])
+
+    def test_count_without_database(self):
+        """Confirm counting matches does not query the database."""
+        with self.assertNumQueries(0):
+            self.assertEqual(len(ingredient_index.search('t')), 4)
+
+    def test_resolve_one_query(self):
+        """Confirm a page of matches is resolved in one query."""
+        with self.assertNumQueries(1):
+            self.assertEqual(len(ingredient_index.search('t')[:2]), 2)
+
+    def test_created(self):
+        """Confirm new ingredients are indexed when saved."""
+        IngredientFactory(name='Tomatoes, canned')
+        self.assertIn('Tomatoes, canned', self.names('tomatoe'))
+
+    def test_renamed(self):
+        """Confirm renamed ingredients move within the index."""
+        thyme = Ingredient.objects.get(name='Thyme')
+        thyme.name = 'Tarragon'
+        thyme.save()
+        self.assertEqual(self.names('th'), [])
+        self.assertEqual(self.names('ta'), ['Tarragon'])
+
+    def test_deleted(self):
+        """Confirm deleted ingredients leave the index."""
+        Ingredient.objects.get(name='Thyme').delete()
+        self.assertEqual(self.names('th'), [])
+
+    def test_sync(self):
+        """Confirm ingredients created by other processes are pulled in."""
+        Ingredient.objects.bulk_create([Ingredient(name='Turmeric')])
+        ingredient_index.publish()
+        ingredient_index.synced = 0
+        self.assertEqual(self.names('tu'), ['Turmeric'])
+
+    def test_stale_entries(self):
+        """Confirm rows changed behind the index's back are not returned."""
+        Ingredient.objects.filter(name='Thyme').update(name='Basil')
+        self.assertEqual(self.names('th'), [])
+
+    def test_popular_first(self):
+        """Confirm frequently used ingredients are ranked first."""
+        paste = Ingredient.objects.get(name='tomato paste')
+        tomatillo = Ingredient.objects.get(name=' Tomatillo ')
+        adjust_ingredient_usage({paste.pk: 5, tomatillo.pk: 2})
+        self.assertEqual(self.names('tom'),
+                         ['tomato paste', ' Tomatillo ', 'Tomato'])
+        ingredient_index.load()
+        self.assertEqual(self.names('tom'),
+                         ['tomato paste', ' Tomatillo ', 'Tomato'])
+        self.assertEqual(self.names('t')[:1], ['tomato paste'])
+
+    def test_short_prefix_top(self):
+        """Confirm short prefixes answer from their kept top list."""
+        self.assertEqual(self.names('t')[:1], ['Thyme'])
+        top = ingredient_index.top['t']
+        self.assertEqual(len(top), 4)
+        self.assertIs(ingredient_index.search('T').top, top)
+        self.assertNotIn('tom', ingredient_index.top)
+
+    def test_short_prefix_top_changes(self):
+        """Confirm kept top lists follow usage, new and deleted rows."""
+        self.names('t')
+        paste = Ingredient.objects.get(name='tomato paste')
+        thyme = Ingredient.objects.get(name='Thyme')
+        adjust_ingredient_usage({paste.pk: 2, thyme.pk: 3})
+        self.assertEqual(self.names('t')[:2], ['Thyme', 'tomato paste'])
+        adjust_ingredient_usage({thyme.pk: -3})
+        self.assertEqual(self.names('t')[:2], ['tomato paste', 'Thyme'])
+        IngredientFactory(name='Tarragon')
+        self.assertEqual(self.names('t')[1:3], ['Tarragon', 'Thyme'])
+        thyme.delete()
+        self.assertEqual(len(ingredient_index.top['t']), 4)
+        self.assertNotIn('Thyme', self.names('t'))
+
 
 class CreateRecipe(TestCase):
     """Test create view Functionality."""
@@ -468,6 +1384,1025 @@ class VaryRecipeView(TestView):
 
         self.assertEqual(response.status_code, 200)
 
+    def test_post_links_lineage(self):
+        """Confirm posting a variation records every ancestor with depth."""
+        child = RecipeFactory(author=self.user, parent=self.recipe)
+        RecipeLineage.objects.add_recipe(child)
+        data = {'title': 'Grandchild',
+                'directions': 'Stir.',
+                'privacy': 'pu',
+                'ingredient_form-TOTAL_FORMS': '0',
+                'ingredient_form-INITIAL_FORMS': '0'}
+        url = ''.join(['/recipe/vary/', str(child.pk), '/'])
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        grandchild = Recipe.objects.get(title='Grandchild')
+        depths = dict(grandchild.ancestor_links.values_list('ancestor',
+                                                            'depth'))
+        self.assertEqual(depths, {child.pk: 1, self.recipe.pk: 2})
+        self.assertEqual(set(grandchild.ancestors.all()),
+                         set([child, self.recipe]))
+
+
+class RecipeLineageTest(TestCase):
+    """Test the recipe lineage closure table."""
+    def setUp(self):
+        """Build a chain of five generations of variations."""
+        self.author = UserFactory(username='author')
+        self.chain = [RecipeFactory(author=self.author)]
+        for _ in range(4):
+            recipe = RecipeFactory(author=self.author, parent=self.chain[-1])
+            RecipeLineage.objects.add_recipe(recipe)
+            self.chain.append(recipe)
+
+    def test_depths(self):
+        """Confirm each ancestor is stored at its distance from the recipe."""
+        links = self.chain[-1].ancestor_links.order_by('depth')
+        self.assertEqual([link.ancestor for link in links],
+                         list(reversed(self.chain[:-1])))
+        self.assertEqual([link.depth for link in links], [1, 2, 3, 4])
+
+    def test_descendants(self):
+        """Confirm the root recipe is linked to every descendant."""
+        self.assertEqual(self.chain[0].descendant_links.count(), 4)
+        self.assertEqual(set(self.chain[0].total_variations.all()),
+                         set(self.chain[1:]))
+
+    def test_root_recipe(self):
+        """Confirm a recipe without a parent gets no lineage rows."""
+        root = RecipeFactory(author=self.author)
+        RecipeLineage.objects.add_recipe(root)
+        self.assertFalse(root.ancestor_links.exists())
+
+    def test_constant_queries(self):
+        """Confirm linking a deep variation does not walk the chain."""
+        recipe = RecipeFactory(author=self.author, parent=self.chain[-1])
+        with self.assertNumQueries(3):
+            RecipeLineage.objects.add_recipe(recipe)
+        self.assertEqual(recipe.ancestor_links.count(), 5)
+
+    def test_backfill(self):
+        """Confirm the backfill command rebuilds lineage from parents."""
+        expected = set(RecipeLineage.objects.values_list('ancestor',
+                                                         'descendant',
+                                                         'depth'))
+        RecipeLineage.objects.all().delete()
+        Recipe.ancestors.through.objects.all().delete()
+        out = StringIO()
+        call_command('backfill_lineage', stdout=out)
+        actual = set(RecipeLineage.objects.values_list('ancestor',
+                                                       'descendant',
+                                                       'depth'))
+        self.assertEqual(actual, expected)
+        self.assertEqual(self.chain[-1].ancestors.count(), 4)
+        self.assertIn('10 lineage rows over 4 generations', out.getvalue())
+
+    def test_backfill_recounts(self):
+        """Confirm the backfill recounts and touches only changed recipes."""
+        Recipe.objects.update(descendant_count=0)
+        versions = dict(Recipe.objects.values_list('pk', 'version'))
+        out = StringIO()
+        call_command('backfill_lineage', stdout=out)
+        recipes = Recipe.objects.in_bulk([recipe.pk for recipe in self.chain])
+        self.assertEqual([recipes[r.pk].descendant_count for r in self.chain],
+                         [4, 3, 2, 1, 0])
+        self.assertEqual([recipes[r.pk].version - versions[r.pk]
+                          for r in self.chain], [1, 1, 1, 1, 0])
+        self.assertIn('Recounted descendants of 4 recipes', out.getvalue())
+
+
+class RecipeTileCache(TestCase):
+    """Test the rendered recipe tile cache."""
+    def setUp(self):
+        cache.clear()
+        author = UserFactory(username='author')
+        self.parent = RecipeFactory(author=author, title='Parent')
+        self.recipe = RecipeFactory(author=author,
+                                    parent=self.parent,
+                                    title='Original')
+        run_commit_hooks()
+        self.ids = [self.parent.pk, self.recipe.pk]
+        render_tiles(self.ids)
+
+    def test_hit(self):
+        """Confirm cached tiles skip the database and the template."""
+        with self.assertNumQueries(0):
+            with self.assertTemplateNotUsed('recipe/recipe_tile.html'):
+                tiles = render_tiles(self.ids)
+        self.assertIn('Original', tiles[1])
+        self.assertIn('Recent variation: Original', tiles[0])
+
+    def test_order(self):
+        """Confirm tiles come back in the order of the given ids."""
+        tiles = render_tiles(list(reversed(self.ids)))
+        self.assertIn('variation of: Parent', tiles[0])
+
+    def test_save_invalidates(self):
+        """Confirm saving a recipe refreshes its tile and its parent's."""
+        self.recipe.title = 'Renamed'
+        self.recipe.save()
+        run_commit_hooks()
+        tiles = render_tiles(self.ids)
+        self.assertIn('Recent variation: Renamed', tiles[0])
+        self.assertIn('Renamed', tiles[1])
+
+    def test_parent_save_invalidates(self):
+        """Confirm renaming a parent refreshes its variations' tiles."""
+        self.parent.title = 'New Parent'
+        self.parent.save()
+        run_commit_hooks()
+        self.assertIn('variation of: New Parent', render_tiles(self.ids)[1])
+
+    def test_new_variation_invalidates(self):
+        """Confirm a new variation shows up on its parent's tile."""
+        RecipeFactory(author=self.recipe.author,
+                      parent=self.recipe,
+                      title='Newest')
+        run_commit_hooks()
+        self.assertIn('Recent variation: Newest', render_tiles(self.ids)[1])
+
+    def test_delete_invalidates(self):
+        """Confirm deleting a variation removes it from its parent's tile."""
+        self.recipe.delete()
+        run_commit_hooks()
+        tiles = render_tiles(self.ids)
+        self.assertEqual(len(tiles), 1)
+        self.assertNotIn('Recent variation', tiles[0])
+
+    def test_rollback_keeps_tiles(self):
+        """Confirm a save that is rolled back leaves the tiles cached."""
+        try:
+            with transaction.atomic():
+                self.recipe.title = 'Renamed'
+                self.recipe.save()
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        run_commit_hooks()
+        with self.assertNumQueries(0):
+            self.assertIn('Original', render_tiles(self.ids)[1])
+
+
+class LatestPublicFeed(TestCase):
+    """Test the cached feed of latest public recipes."""
+    def setUp(self):
+        cache.clear()
+        self.author = UserFactory(username='author')
+        self.recipes = [RecipeFactory(author=self.author)
+                        for _ in range(20)]
+        run_commit_hooks()
+        get_latest_public_ids()
+
+    def expected(self):
+        """Return the feed as computed from the database."""
+        recipes = Recipe.objects.filter(privacy='pu')
+        recipes = recipes.order_by('-created', '-pk')
+        return list(recipes.values_list('pk', flat=True)[:18])
+
+    def test_initial(self):
+        """Confirm the feed lists the newest public recipes."""
+        with self.assertNumQueries(0):
+            ids = get_latest_public_ids()
+        self.assertEqual(ids, self.expected())
+
+    def test_created(self):
+        """Confirm a new public recipe is loaded once it is committed."""
+        recipe = RecipeFactory(author=self.author)
+        self.assertNotIn(recipe.pk, get_latest_public_ids())
+        run_commit_hooks()
+        with self.assertNumQueries(1):
+            ids = get_latest_public_ids()
+        self.assertEqual(ids[0], recipe.pk)
+        self.assertEqual(ids, self.expected())
+
+    def test_rolled_back(self):
+        """Confirm a rolled back recipe never reaches the feed."""
+        try:
+            with transaction.atomic():
+                RecipeFactory(author=self.author)
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        run_commit_hooks()
+        with self.assertNumQueries(0):
+            ids = get_latest_public_ids()
+        self.assertEqual(ids, self.expected())
+
+    def test_private(self):
+        """Confirm a recipe made private leaves the feed."""
+        recipe = self.recipes[-1]
+        recipe.privacy = 'pr'
+        recipe.save()
+        run_commit_hooks()
+        ids = get_latest_public_ids()
+        self.assertNotIn(recipe.pk, ids)
+        self.assertEqual(ids, self.expected())
+        recipe.privacy = 'pu'
+        recipe.save()
+        run_commit_hooks()
+        self.assertEqual(get_latest_public_ids(), self.expected())
+
+    def test_unlisted_private(self):
+        """Confirm saving a private recipe the feed lacks keeps the feed."""
+        RecipeFactory(author=self.author, privacy='pr')
+        run_commit_hooks()
+        with self.assertNumQueries(0):
+            get_latest_public_ids()
+
+    def test_deleted(self):
+        """Confirm a deleted recipe leaves the feed."""
+        self.recipes[-1].delete()
+        run_commit_hooks()
+        self.assertEqual(get_latest_public_ids(), self.expected())
+
+    def test_buffer(self):
+        """Confirm the stored feed never grows past its buffer."""
+        for _ in range(FEED_BUFFER):
+            RecipeFactory(author=self.author)
+        run_commit_hooks()
+        self.assertEqual(len(get_latest_public_entries(FEED_BUFFER + 1)),
+                         FEED_BUFFER)
+        self.assertEqual(get_latest_public_ids(), self.expected())
+
+
+class QueryPlans(TestCase):
+    """Confirm the hot recipe and ingredient queries use their indexes."""
+    def setUp(self):
+        self.author = UserFactory(username='author')
+        Recipe.objects.bulk_create(
+            Recipe(author=self.author,
+                   title='Recipe {}'.format(index),
+                   directions='Cook.',
+                   privacy=('pu', 'pr')[index % 2])
+            for index in range(200))
+        Ingredient.objects.bulk_create(
+            Ingredient(name='ingredient {}'.format(index))
+            for index in range(200))
+        self.recipes = list(Recipe.objects.values_list('pk', flat=True)[:18])
+
+    def explain(self, queryset):
+        """Return the database's query plan for a queryset as text."""
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+                return ' '.join(row[0] for row in cursor.fetchall())
+            # SQLite only plans LIKE prefixes against literal patterns.
+            literals = tuple(
+                "'{}'".format(param.replace("'", "''"))
+                if isinstance(param, six.string_types) else str(param)
+                for param in params)
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql % literals)
+            return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def index_name(self, model, columns):
+        """Return the name of the index on exactly the given columns."""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, model._meta.db_table)
+        for name, constraint in constraints.items():
+            if constraint['index'] and constraint['columns'] == columns:
+                return name
+
+    def test_home_feed(self):
+        """Confirm the home feed reads the privacy, created index."""
+        recipes = Recipe.objects.filter(privacy='pu')
+        recipes = recipes.order_by('-created').values_list('pk')[:36]
+        self.assertIn(self.index_name(Recipe, ['privacy', 'created']),
+                      self.explain(recipes))
+
+    def test_most_favorited(self):
+        """Confirm popular lists read the privacy and counter indexes."""
+        for field in ('favorite_count', 'variation_count'):
+            recipes = Recipe.objects.filter(privacy='pu')
+            recipes = recipes.order_by('-' + field, '-pk').values_list('pk')
+            self.assertIn(self.index_name(Recipe, ['privacy', field]),
+                          self.explain(recipes[:24]))
+
+    def test_my_recipes(self):
+        """Confirm an author's recipes read the author, created index."""
+        recipes = Recipe.objects.filter(author=self.author)
+        recipes = recipes.order_by('-created').values_list('pk')
+        self.assertIn(self.index_name(Recipe, ['author_id', 'created']),
+                      self.explain(recipes))
+
+    def test_latest_variation(self):
+        """Confirm latest variations read the parent foreign key index."""
+        recipes = Recipe.objects.filter(parent__in=self.recipes).order_by()
+        recipes = recipes.values_list('parent').annotate(Max('pk'))
+        self.assertIn(self.index_name(Recipe, ['parent_id']),
+                      self.explain(recipes))
+
+    def test_ingredient_prefix(self):
+        """Confirm ingredient autocomplete reads the name prefix index."""
+        ingredients = Ingredient.objects.filter(name__istartswith='ingr')
+        self.assertIn('recipe_ingredient_name_prefix',
+                      self.explain(ingredients))
+
+
+class RecipeLineageViews(TestView):
+    """Test lineage lists on the recipe page and the lineage endpoint."""
+    def setUp(self):
+        """Build a chain of ancestors and a wide set of descendants."""
+        super(RecipeLineageViews, self).setUp()
+        self.chain = [RecipeFactory(author=self.user)]
+        for _ in range(8):
+            self.chain.append(self.vary(self.chain[-1]))
+        self.recipe = self.chain[-1]
+        self.children = [self.vary(self.recipe) for _ in range(30)]
+        self.private = self.vary(self.recipe, author=UserFactory(
+            username='stranger'), privacy='pr')
+        self.url = '/recipe/view/{}/'.format(self.recipe.pk)
+
+    def vary(self, parent, **kwargs):
+        """Create a variation of parent and record its lineage."""
+        kwargs.setdefault('author', self.user)
+        recipe = RecipeFactory(parent=parent, **kwargs)
+        RecipeLineage.objects.add_recipe(recipe)
+        return recipe
+
+    def test_detail_bounded(self):
+        """Confirm the recipe page previews six recipes of each lineage."""
+        response = self.client.get(self.url)
+        ancestors = [recipe.pk for recipe in reversed(self.chain[2:-1])]
+        descendants = [recipe.pk for recipe in self.children[:6]]
+        self.assertEqual(response.context['ancestors'],
+                         render_tiles(ancestors))
+        self.assertEqual(response.context['descendants'],
+                         render_tiles(descendants))
+        self.assertEqual(response.context['ancestor_count'], 8)
+        self.assertEqual(response.context['descendant_count'], 30)
+
+    def test_detail_query_count(self):
+        """Confirm lineage size does not change the recipe page's queries."""
+        with self.assertNumQueries(16):
+            self.client.get(self.url)
+        with self.assertNumQueries(11):
+            self.client.get(self.url)
+        for _ in range(10):
+            self.vary(self.recipe)
+        with self.assertNumQueries(11):
+            self.client.get(self.url)
+
+    def test_lineage_paginated(self):
+        """Confirm the lineage endpoint lists descendants a page at a time."""
+        children = [recipe.pk for recipe in self.children]
+        response = self.client.get(self.url + 'lineage/')
+        self.assertEqual(list(response.context['object_list']),
+                         children[:24])
+        response = self.client.get(self.url + 'lineage/?page=2')
+        self.assertEqual(list(response.context['object_list']),
+                         children[24:])
+        self.assertEqual(len(response.context['tiles']), 6)
+
+    def test_lineage_ancestors(self):
+        """Confirm the lineage endpoint lists ancestors nearest first."""
+        response = self.client.get(self.url + 'lineage/?direction=ancestors')
+        self.assertEqual(list(response.context['object_list']),
+                         [recipe.pk for recipe in reversed(self.chain[:-1])])
+
+    def test_lineage_private(self):
+        """Confirm private recipes are hidden from other users' lineage."""
+        response = self.client.get(self.url + 'lineage/?page=2')
+        self.assertNotIn(self.private.pk, response.context['object_list'])
+        url = '/recipe/view/{}/lineage/'.format(self.private.pk)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class RecipeSearch(TestView):
+    """Test full-text recipe search."""
+    def setUp(self):
+        """Create recipes mentioning tomatoes in different fields."""
+        super(RecipeSearch, self).setUp()
+        self.soup = RecipeFactory(author=self.user, title='Tomato Soup',
+                                  directions='Simmer.')
+        self.bread = RecipeFactory(author=self.user, title='Bread',
+                                   directions='Serve with sliced tomatoes.')
+        self.tart = RecipeFactory(author=self.user, title='Tomato Tart',
+                                  directions='Bake.', privacy='pr')
+        self.pie = RecipeFactory(author=UserFactory(username='stranger'),
+                                 title='Tomato Pie', directions='Bake.',
+                                 privacy='pr')
+        self.basil = IngredientFactory(name='basil')
+        self.client.logout()
+        run_commit_hooks()
+
+    def search(self, query):
+        """Return the recipe ids found for query."""
+        response = self.client.get('/recipe/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['object_list'])
+
+    def test_ranked(self):
+        """Confirm title matches rank above matches in the directions."""
+        self.assertEqual(self.search('tomato'),
+                         [self.soup.pk, self.bread.pk])
+
+    def test_private(self):
+        """Confirm private recipes are only found by their authors."""
+        self.client.login(username=self.user.username, password=PASSWORD)
+        self.assertEqual(set(self.search('tomato')),
+                         set([self.soup.pk, self.bread.pk, self.tart.pk]))
+
+    def test_ingredients(self):
+        """Confirm recipes are found by their ingredients once saved."""
+        self.client.login(username=self.user.username, password=PASSWORD)
+        self.assertEqual(self.search('basil'), [])
+        self.client.post('/recipe/edit/{}/'.format(self.bread.pk), {
+            'title': 'Bread',
+            'directions': 'Serve with sliced tomatoes.',
+            'privacy': 'pu',
+            'ingredient_form-TOTAL_FORMS': '1',
+            'ingredient_form-INITIAL_FORMS': '0',
+            'ingredient_form-0-ingredient': self.basil.pk,
+            'ingredient_form-0-quantity': '1 leaf'})
+        run_commit_hooks()
+        self.assertEqual(self.search('basil'), [self.bread.pk])
+        self.basil.name = 'oregano'
+        self.basil.save()
+        self.assertEqual(self.search('basil'), [])
+        self.assertEqual(self.search('oregano'), [self.bread.pk])
+
+    def test_incremental(self):
+        """Confirm edits and deletions reach the index."""
+        self.soup.title = 'Gazpacho'
+        self.soup.save()
+        run_commit_hooks()
+        self.assertEqual(self.search('gazpacho'), [self.soup.pk])
+        self.assertEqual(self.search('tomato'), [self.bread.pk])
+        self.bread.delete()
+        self.assertEqual(self.search('tomato'), [])
+
+    def test_paginated(self):
+        """Confirm results are served a page at a time."""
+        for _ in range(30):
+            RecipeFactory(author=self.user, title='Tomato',
+                          directions='Slice.')
+        run_commit_hooks()
+        response = self.client.get('/recipe/search/', {'q': 'tomato'})
+        self.assertEqual(len(response.context['object_list']), 24)
+        self.assertEqual(response.context['paginator'].count, 32)
+        response = self.client.get('/recipe/search/',
+                                   {'q': 'tomato', 'page': 2})
+        self.assertEqual(len(response.context['object_list']), 8)
+
+    def test_query_syntax(self):
+        """Confirm search operators typed by users are matched literally."""
+        self.assertEqual(self.search('"tomato AND ('), [])
+        self.assertEqual(self.search('soup tomato'), [self.soup.pk])
+        self.assertEqual(self.search('   '), [])
+
+
+class WhatCanICook(TestView):
+    """Test ranking recipes by the share of their ingredients on hand."""
+    def setUp(self):
+        """Create recipes using overlapping sets of ingredients."""
+        super(WhatCanICook, self).setUp()
+        self.egg, self.flour, self.milk, self.bacon = [
+            IngredientFactory(name=name)
+            for name in ('egg', 'flour', 'milk', 'bacon')]
+        self.omelette = self.recipe([self.egg])
+        self.pancakes = self.recipe([self.egg, self.flour, self.milk])
+        self.carbonara = self.recipe([self.egg, self.bacon])
+        self.bread = self.recipe([self.flour])
+        self.secret = self.recipe([self.egg], privacy='pr')
+
+    def recipe(self, ingredients, **kwargs):
+        """Create a recipe using ingredients and store their ids."""
+        recipe = RecipeFactory(author=self.user, **kwargs)
+        for ingredient in ingredients:
+            RecipeIngredientFactory(recipe=recipe, ingredient=ingredient)
+        refresh_ingredient_ids([recipe.pk])
+        return recipe
+
+    def test_stored_ids(self):
+        """Confirm recipes store their sorted ingredient ids."""
+        self.assertEqual(
+            Recipe.objects.get(pk=self.pancakes.pk).ingredient_ids,
+            ' '.join(str(pk) for pk in sorted(
+                [self.egg.pk, self.flour.pk, self.milk.pk])))
+
+    def test_ranked(self):
+        """Confirm recipes are ranked by coverage, then by matches."""
+        ranked = rank_by_coverage([self.egg.pk, self.flour.pk])
+        self.assertEqual(ranked, [(self.bread.pk, 1, 1),
+                                  (self.omelette.pk, 1, 1),
+                                  (self.pancakes.pk, 2, 3),
+                                  (self.carbonara.pk, 1, 2)])
+
+    def test_repeated_ingredient(self):
+        """Confirm a recipe listing an ingredient twice can be covered."""
+        custard = self.recipe([self.milk, self.milk])
+        self.assertEqual(rank_by_coverage([self.milk.pk])[0],
+                         (custard.pk, 2, 2))
+
+    def test_view(self):
+        """Confirm the endpoint honours the user's disliked ingredients."""
+        self.user.profile.disliked_ingredients.add(self.bacon)
+        with self.assertNumQueries(8):
+            response = self.client.get('/recipe/cook/', {
+                'ingredients': [self.egg.pk, self.bacon.pk]})
+        self.assertEqual(list(response.context['object_list']),
+                         [self.omelette.pk, self.pancakes.pk])
+        response = Client().get('/recipe/cook/', {
+            'ingredients': [self.egg.pk, self.bacon.pk]})
+        self.assertEqual(list(response.context['object_list']),
+                         [self.carbonara.pk, self.omelette.pk,
+                          self.pancakes.pk])
+
+    def test_autocomplete(self):
+        """Confirm the form looks ingredients up without offering new ones."""
+        response = Client().get('/recipe/cook/')
+        self.assertIn('data-autocomplete-light-url='
+                      '"/recipe/cook/ingredient-autocomplete/"',
+                      str(response.content))
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='add_ingredient'))
+        for client in (Client(), self.client):
+            response = client.get('/recipe/cook/ingredient-autocomplete/',
+                                  {'q': 'eg'})
+            self.assertIn('"text": "egg"', str(response.content))
+            self.assertNotIn('create_id', str(response.content))
+        response = self.client.post('/recipe/cook/ingredient-autocomplete/',
+                                    {'text': 'eggs'})
+        self.assertEqual(response.status_code, 405)
+
+    def test_empty(self):
+        """Confirm the endpoint shows just the form without ingredients."""
+        response = self.client.get('/recipe/cook/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['object_list']), [])
+
+
+class PersonalFeed(TestView):
+    """Test the home feed ranked by a chef's ingredient tastes."""
+    def setUp(self):
+        """Create recipes using liked and disliked ingredients."""
+        super(PersonalFeed, self).setUp()
+        self.basil, self.garlic, self.anchovy = [
+            IngredientFactory(name=name)
+            for name in ('basil', 'garlic', 'anchovy')]
+        author = UserFactory(username='feed author')
+        self.pesto = self.recipe(author, [self.basil, self.garlic])
+        self.bread = self.recipe(author, [self.garlic])
+        self.caesar = self.recipe(author, [self.garlic, self.anchovy])
+        self.plain = self.recipe(author, [])
+        self.profile = self.user.profile
+
+    def recipe(self, author, ingredients):
+        """Create a public recipe using ingredients."""
+        recipe = RecipeFactory(author=author)
+        for ingredient in ingredients:
+            RecipeIngredientFactory(recipe=recipe, ingredient=ingredient)
+        refresh_ingredient_ids([recipe.pk])
+        return recipe
+
+    def test_no_tastes(self):
+        """Confirm chefs without tastes get the latest public feed."""
+        self.assertEqual(get_personal_feed_ids(self.user),
+                         get_latest_public_ids())
+
+    def test_ranked(self):
+        """Confirm liked ingredients rank first and disliked are dropped."""
+        self.profile.liked_ingredients.add(self.basil, self.garlic)
+        self.profile.disliked_ingredients.add(self.anchovy)
+        self.assertEqual(get_personal_feed_ids(self.user),
+                         [self.pesto.pk, self.bread.pk, self.plain.pk])
+        with self.assertNumQueries(1):
+            get_personal_feed_ids(self.user)
+
+    def test_private(self):
+        """Confirm recipes made private leave cached feeds at once."""
+        self.profile.liked_ingredients.add(self.basil)
+        run_commit_hooks()
+        self.assertEqual(get_personal_feed_ids(self.user)[0], self.pesto.pk)
+        self.pesto.privacy = 'pr'
+        self.pesto.save()
+        self.assertNotIn(self.pesto.pk, get_personal_feed_ids(self.user))
+        key = PERSONAL_FEED_KEY.format(
+            get_feed_version(PERSONAL_FEED_VERSION_KEY), self.user.pk)
+        self.assertIn(self.pesto.pk, cache.get(key))
+        run_commit_hooks()
+        self.assertNotIn(self.pesto.pk, get_personal_feed_ids(self.user))
+        key = PERSONAL_FEED_KEY.format(
+            get_feed_version(PERSONAL_FEED_VERSION_KEY), self.user.pk)
+        self.assertNotIn(self.pesto.pk, cache.get(key))
+
+    def test_private_edited(self):
+        """Confirm only making a public recipe private re-ranks feeds."""
+        version = get_feed_version(PERSONAL_FEED_VERSION_KEY)
+        self.pesto.title = 'Basil pesto'
+        self.pesto.save()
+        run_commit_hooks()
+        self.assertEqual(get_feed_version(PERSONAL_FEED_VERSION_KEY), version)
+        self.pesto.privacy = 'pr'
+        self.pesto.save()
+        run_commit_hooks()
+        version = get_feed_version(PERSONAL_FEED_VERSION_KEY)
+        self.pesto.title = 'Secret pesto'
+        self.pesto.save()
+        run_commit_hooks()
+        self.assertEqual(get_feed_version(PERSONAL_FEED_VERSION_KEY), version)
+
+    def test_invalidated(self):
+        """Confirm changing a chef's tastes drops their cached feed."""
+        get_personal_feed_ids(self.user)
+        self.anchovy.liked_by.add(self.profile)
+        self.assertEqual(get_personal_feed_ids(self.user)[0], self.caesar.pk)
+        self.client.post('/profile/edit/', {
+            'disliked_ingredients': [self.garlic.pk]})
+        self.assertEqual(get_personal_feed_ids(self.user), [self.plain.pk])
+
+    def test_home(self):
+        """Confirm logged in chefs see their personal feed on the home page."""
+        self.profile.disliked_ingredients.add(self.garlic)
+        response = self.client.get('/')
+        self.assertEqual(response.context['latest_recipes'],
+                         render_tiles([self.plain.pk]))
+
+
+class SimilarRecipes(TestView):
+    """Test the precomputed similar recipes panel."""
+    def setUp(self):
+        """Create recipes with overlapping ingredients."""
+        super(SimilarRecipes, self).setUp()
+        self.ingredients = [IngredientFactory(name='similar {}'.format(n))
+                            for n in range(5)]
+        a, b, c, d, e = self.ingredients
+        self.soup = self.recipe([a, b, c, d])
+        self.stew = self.recipe([a, b, c])
+        self.broth = self.recipe([a, b])
+        self.salad = self.recipe([e])
+        self.secret = self.recipe([a, b, c, d], privacy='pr')
+
+    def recipe(self, ingredients, **kwargs):
+        """Create a recipe using ingredients and store their ids."""
+        recipe = RecipeFactory(author=self.user, **kwargs)
+        for ingredient in ingredients:
+            RecipeIngredientFactory(recipe=recipe, ingredient=ingredient)
+        refresh_ingredient_ids([recipe.pk])
+        return recipe
+
+    def neighbours(self, recipe):
+        """Return the stored neighbours of a recipe, most similar first."""
+        return list(RecipeNeighbour.objects.filter(recipe=recipe)
+                    .order_by('-similarity', 'neighbour')
+                    .values_list('neighbour', 'similarity'))
+
+    def test_build(self):
+        """Confirm the build command stores Jaccard neighbours."""
+        out = StringIO()
+        call_command('build_recipe_neighbours', batch_size=2, stdout=out)
+        self.assertIn('Stored neighbours of 5 of 5 recipes.', out.getvalue())
+        self.assertEqual(self.neighbours(self.soup),
+                         [(self.stew.pk, 0.75), (self.broth.pk, 0.5)])
+        self.assertEqual(self.neighbours(self.secret),
+                         [(self.soup.pk, 1.0), (self.stew.pk, 0.75),
+                          (self.broth.pk, 0.5)])
+        self.assertEqual(self.neighbours(self.salad), [])
+
+    def test_incremental(self):
+        """Confirm saving a recipe updates its lists and its neighbours'."""
+        call_command('build_recipe_neighbours', stdout=StringIO())
+        a, b, c, d, e = self.ingredients
+        twin = self.recipe([a, b, c, d])
+        update_neighbours(twin.pk)
+        self.assertEqual(self.neighbours(twin)[0], (self.soup.pk, 1.0))
+        self.assertEqual(self.neighbours(self.soup)[0], (twin.pk, 1.0))
+        self.assertEqual(self.neighbours(self.secret)[0][1], 1.0)
+        twin.privacy = 'pr'
+        twin.save()
+        update_neighbours(twin.pk)
+        self.assertNotIn(twin.pk, dict(self.neighbours(self.soup)))
+
+    def test_common_ingredients(self):
+        """Confirm staples used everywhere do not nominate candidates."""
+        a, b, c, d, e = self.ingredients
+        Ingredient.objects.filter(pk=a.pk).update(
+            usage_count=COMMON_INGREDIENT_USAGE + 1)
+        salted = self.recipe([a, e])
+        update_neighbours(salted.pk)
+        self.assertEqual(self.neighbours(salted), [(self.salad.pk, 0.5)])
+
+    def test_only_common_ingredients(self):
+        """Confirm recipes using only staples keep finding neighbours."""
+        call_command('build_recipe_neighbours', stdout=StringIO())
+        a, b, c, d, e = self.ingredients
+        Ingredient.objects.update(usage_count=COMMON_INGREDIENT_USAGE + 1)
+        before = self.neighbours(self.broth)
+        self.assertEqual(len(before), 2)
+        update_neighbours(self.broth.pk)
+        self.assertEqual(self.neighbours(self.broth), before)
+
+    def test_panel(self):
+        """Confirm the recipe page shows visible similar recipes."""
+        call_command('build_recipe_neighbours', stdout=StringIO())
+        self.stew.privacy = 'pr'
+        self.stew.save()
+        response = self.client.get('/recipe/view/{}/'.format(self.soup.pk))
+        self.assertEqual(response.context['similar'],
+                         render_tiles([self.broth.pk]))
+
+    def test_saved(self):
+        """Confirm editing a recipe's ingredients refreshes its neighbours."""
+        a, b, c, d, e = self.ingredients
+        self.client.post('/recipe/edit/{}/'.format(self.salad.pk), {
+            'title': 'Salad',
+            'directions': 'Toss.',
+            'privacy': 'pu',
+            'ingredient_form-TOTAL_FORMS': '1',
+            'ingredient_form-INITIAL_FORMS': '0',
+            'ingredient_form-0-ingredient': a.pk,
+            'ingredient_form-0-quantity': '1 cup'})
+        self.assertEqual(self.neighbours(self.salad)[0][0], self.broth.pk)
+        self.assertIn(self.salad.pk, dict(self.neighbours(self.broth)))
+
+
+class RecipeCounters(TestView):
+    """Test the counters stored on recipes."""
+    def setUp(self):
+        """Create a recipe with a chain of variations and some fans."""
+        super(RecipeCounters, self).setUp()
+        self.root = RecipeFactory(author=self.user)
+        self.child = self.vary(self.root)
+        self.grandchild = self.vary(self.child)
+        self.sibling = self.vary(self.root)
+        self.fans = [UserFactory(username='fan {}'.format(n)).profile
+                     for n in range(3)]
+
+    def vary(self, parent):
+        """Create a variation of parent and record its lineage."""
+        recipe = RecipeFactory(author=self.user, parent=parent)
+        RecipeLineage.objects.add_recipe(recipe)
+        return recipe
+
+    def counts(self, recipe):
+        """Return the stored counters of a recipe."""
+        return Recipe.objects.values_list(
+            'variation_count', 'descendant_count', 'favorite_count',
+            'ingredient_count').get(pk=recipe.pk)
+
+    def test_variations(self):
+        """Confirm variations and descendants are counted and uncounted."""
+        self.assertEqual(self.counts(self.root)[:2], (2, 3))
+        self.assertEqual(self.counts(self.child)[:2], (1, 1))
+        self.child.delete()
+        self.assertEqual(self.counts(self.root)[:2], (1, 1))
+
+    def test_favorites(self):
+        """Confirm favorites are counted from either side of the relation."""
+        self.fans[0].favorites.add(self.root, self.child)
+        self.fans[0].favorites.add(self.root)
+        self.root.favorite_of.add(self.fans[1], self.fans[2])
+        self.assertEqual(self.counts(self.root)[2], 3)
+        self.fans[1].favorites.remove(self.root, self.sibling)
+        self.assertEqual(self.counts(self.root)[2], 2)
+        self.root.favorite_of.clear()
+        self.fans[0].favorites.clear()
+        self.assertEqual(self.counts(self.root)[2], 0)
+        self.assertEqual(self.counts(self.child)[2], 0)
+
+    def test_ingredients(self):
+        """Confirm saving a recipe's ingredients counts them."""
+        ingredient = IngredientFactory()
+        self.client.post('/recipe/edit/{}/'.format(self.root.pk), {
+            'title': 'Root',
+            'directions': 'Cook.',
+            'privacy': 'pu',
+            'ingredient_form-TOTAL_FORMS': '1',
+            'ingredient_form-INITIAL_FORMS': '0',
+            'ingredient_form-0-ingredient': ingredient.pk,
+            'ingredient_form-0-quantity': '1 cup'})
+        self.assertEqual(self.counts(self.root)[3], 1)
+
+    def test_reconcile(self):
+        """Confirm the reconcile command recounts every counter."""
+        self.fans[0].favorites.add(self.child)
+        RecipeIngredientFactory(recipe=self.child)
+        Recipe.objects.update(variation_count=9, descendant_count=9,
+                              favorite_count=9, ingredient_count=9)
+        call_command('reconcile_recipe_counters', stdout=StringIO())
+        self.assertEqual(self.counts(self.root), (2, 3, 0, 0))
+        self.assertEqual(self.counts(self.child), (1, 1, 1, 1))
+
+    def test_popular(self):
+        """Confirm popular recipes are listed by the chosen counter."""
+        self.child.favorite_of.add(*self.fans)
+        self.sibling.favorite_of.add(self.fans[0])
+        response = self.client.get('/recipe/popular/')
+        self.assertEqual(list(response.context['object_list'])[:2],
+                         [self.child.pk, self.sibling.pk])
+        response = self.client.get('/recipe/popular/?by=variations')
+        self.assertEqual(list(response.context['object_list'])[:2],
+                         [self.root.pk, self.child.pk])
+
+
+class SaveRecipeIngredients(TestView):
+    """Test ingredient writes made when saving a recipe."""
+    def setUp(self):
+        super(SaveRecipeIngredients, self).setUp()
+        self.ingredients = [IngredientFactory() for _ in range(40)]
+        self.recipe = RecipeFactory(author=self.user, title='Soup')
+        self.relationships = [
+            RecipeIngredientFactory(recipe=self.recipe,
+                                    ingredient=ingredient,
+                                    quantity='1 cup')
+            for ingredient in self.ingredients
+        ]
+
+    def post_data(self, rows, initial=0):
+        """Build recipe and formset POST data from (id, ingredient, qty)."""
+        data = {'title': 'Soup',
+                'directions': 'Simmer.',
+                'privacy': 'pu',
+                'ingredient_form-TOTAL_FORMS': str(len(rows)),
+                'ingredient_form-INITIAL_FORMS': str(initial)}
+        for index, (pk, ingredient, quantity) in enumerate(rows):
+            prefix = 'ingredient_form-{}-'.format(index)
+            data[prefix + 'id'] = pk or ''
+            data[prefix + 'ingredient'] = ingredient.pk
+            data[prefix + 'quantity'] = quantity
+        return data
+
+    def post(self, url, data):
+        """Post data and return the ingredient table writes it caused."""
+        table = RecipeIngredientRelationship._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        return [query['sql'] for query in queries.captured_queries
+                if table in ' '.join(query['sql'].split()[:3]) and
+                not query['sql'].startswith('SELECT')]
+
+    def test_add(self):
+        """Confirm a new recipe's ingredients are inserted at once."""
+        rows = [(None, ingredient, '2 cups')
+                for ingredient in self.ingredients]
+        writes = self.post('/recipe/add/', self.post_data(rows))
+        self.assertEqual(len(writes), 1)
+        recipe = Recipe.objects.exclude(pk=self.recipe.pk).get()
+        self.assertEqual(recipe.ingredients_in_recipe.count(), 40)
+
+    def test_edit(self):
+        """Confirm edits update, delete and insert rows in bulk."""
+        rows = [(rel.pk, rel.ingredient, '3 cups')
+                for rel in self.relationships]
+        data = self.post_data(rows + [(None, self.ingredients[0], 'a pinch')],
+                              initial=len(rows))
+        data['ingredient_form-0-DELETE'] = 'on'
+        data['ingredient_form-1-ingredient'] = self.ingredients[2].pk
+        url = '/recipe/edit/{}/'.format(self.recipe.pk)
+        writes = self.post(url, data)
+        self.assertEqual(len(writes), 3)
+        quantities = self.recipe.ingredients_in_recipe.values_list(
+            'quantity', flat=True)
+        self.assertEqual(sorted(set(quantities)), ['3 cups', 'a pinch'])
+        self.assertEqual(len(quantities), 40)
+        self.assertFalse(RecipeIngredientRelationship.objects.filter(
+            pk=self.relationships[0].pk).exists())
+        self.assertEqual(RecipeIngredientRelationship.objects.get(
+            pk=self.relationships[1].pk).ingredient, self.ingredients[2])
+
+    def test_edit_other_recipe_rows(self):
+        """Confirm editing cannot rewrite another recipe's ingredients."""
+        other = RecipeIngredientFactory(recipe=RecipeFactory(author=self.user),
+                                        quantity='1 cup')
+        data = self.post_data([(other.pk, other.ingredient, '9 cups')],
+                              initial=1)
+        self.post('/recipe/edit/{}/'.format(self.recipe.pk), data)
+        other.refresh_from_db()
+        self.assertEqual(other.quantity, '1 cup')
+
+    def test_vary(self):
+        """Confirm a variation copies its submitted ingredients in bulk."""
+        rows = [(rel.pk, rel.ingredient, rel.quantity)
+                for rel in self.relationships]
+        data = self.post_data(rows, initial=len(rows))
+        data['ingredient_form-5-DELETE'] = 'on'
+        writes = self.post('/recipe/vary/{}/'.format(self.recipe.pk), data)
+        self.assertEqual(len(writes), 1)
+        variation = self.recipe.variations.get()
+        self.assertEqual(variation.ingredients_in_recipe.count(), 39)
+        self.assertEqual(self.recipe.ingredients_in_recipe.count(), 40)
+
+    def usage(self, ingredient):
+        """Return the stored usage count of an ingredient."""
+        return Ingredient.objects.get(pk=ingredient.pk).usage_count
+
+    def test_usage_counts(self):
+        """Confirm saving recipes keeps ingredient usage counts current."""
+        call_command('refresh_ingredient_usage', stdout=StringIO())
+        first, second, third = self.ingredients[:3]
+        self.assertEqual(self.usage(first), 1)
+        rows = [(rel.pk, rel.ingredient, rel.quantity)
+                for rel in self.relationships]
+        data = self.post_data(rows, initial=len(rows))
+        data['ingredient_form-0-DELETE'] = 'on'
+        data['ingredient_form-1-ingredient'] = third.pk
+        self.post('/recipe/edit/{}/'.format(self.recipe.pk), data)
+        self.assertEqual(
+            [self.usage(first), self.usage(second), self.usage(third)],
+            [0, 0, 2])
+        self.post('/recipe/vary/{}/'.format(self.recipe.pk),
+                  self.post_data([(None, first, '1 cup')]))
+        self.assertEqual(self.usage(first), 1)
+        self.recipe.delete()
+        self.assertEqual(
+            [self.usage(first), self.usage(second), self.usage(third)],
+            [0, 0, 0])
+
+    def test_refresh_usage(self):
+        """Confirm the refresh command recounts every ingredient."""
+        Ingredient.objects.update(usage_count=7)
+        call_command('refresh_ingredient_usage', stdout=StringIO())
+        self.assertEqual(self.usage(self.ingredients[0]), 1)
+        self.assertEqual(self.usage(IngredientFactory()), 0)
+
+
+class MergeDuplicateIngredients(TestCase):
+    """Test folding duplicate ingredients together."""
+
+    def setUp(self):
+        """Prepare spellings of one ingredient used across the site."""
+        self.tomato = IngredientFactory(name='tomato')
+        self.tomatoes = IngredientFactory(name='Tomatoes')
+        self.spaced = IngredientFactory(name=' tomato')
+        self.basil = IngredientFactory(name='basil')
+        author = UserFactory(username='merge author')
+        self.recipes = [RecipeFactory(author=author) for _ in range(3)]
+        for recipe, ingredient in zip(self.recipes, [self.tomato,
+                                                     self.tomatoes,
+                                                     self.spaced]):
+            RecipeIngredientFactory(recipe=recipe, ingredient=ingredient)
+        RecipeIngredientFactory(recipe=self.recipes[0],
+                                ingredient=self.basil)
+        call_command('refresh_ingredient_usage', stdout=StringIO())
+        self.fan = UserFactory(username='merge fan').profile
+        self.fan.liked_ingredients.add(self.tomato, self.tomatoes)
+        self.critic = UserFactory(username='merge critic').profile
+        self.critic.disliked_ingredients.add(self.spaced)
+
+    def merge(self):
+        """Run the merge command a group at a time, returning its output."""
+        out = StringIO()
+        call_command('merge_duplicate_ingredients', batch_size=1, stdout=out)
+        return out.getvalue()
+
+    def test_merge(self):
+        """Confirm duplicates are folded into the oldest ingredient."""
+        output = self.merge()
+        self.assertIn('Merged 1 of 1 duplicate groups.', output)
+        self.assertIn('Removed 2 duplicate ingredients.', output)
+        self.assertEqual(
+            set(Ingredient.objects.values_list('pk', flat=True)),
+            set([self.tomato.pk, self.basil.pk]))
+        for recipe in self.recipes:
+            self.assertTrue(recipe.ingredients_in_recipe.filter(
+                ingredient=self.tomato).exists())
+        self.assertEqual(list(self.fan.liked_ingredients.all()),
+                         [self.tomato])
+        self.assertEqual(list(self.critic.disliked_ingredients.all()),
+                         [self.tomato])
+        self.assertEqual(Ingredient.objects.get(pk=self.tomato.pk)
+                         .usage_count, 3)
+
+    def test_reindexed(self):
+        """Confirm neighbours are left to rebuild and feeds are dropped."""
+        Recipe.objects.update(privacy='pu')
+        cache.clear()
+        get_personal_feed_ids(self.fan.user)
+        output = self.merge()
+        self.assertIn('Run build_recipe_neighbours', output)
+        self.assertFalse(RecipeNeighbour.objects.exists())
+        refresh_ingredient_ids([self.recipes[0].pk])
+        call_command('build_recipe_neighbours', stdout=StringIO())
+        neighbours = RecipeNeighbour.objects.filter(recipe=self.recipes[1])
+        self.assertEqual(
+            set(neighbours.values_list('neighbour', flat=True)),
+            set([self.recipes[0].pk, self.recipes[2].pk]))
+        self.assertIsNone(cache.get(PERSONAL_FEED_KEY.format(
+            get_feed_version(PERSONAL_FEED_VERSION_KEY), self.fan.user.pk)))
+
+    def test_resume(self):
+        """Confirm running the command again finds nothing left to do."""
+        self.merge()
+        output = self.merge()
+        self.assertIn('Removed 0 duplicate ingredients.', output)
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+    def test_recompute(self):
+        """Confirm stale canonical names are refreshed before merging."""
+        Ingredient.objects.filter(pk=self.tomatoes.pk).update(
+            canonical_name='stale')
+        self.merge()
+        self.assertTrue(Ingredient.objects.filter(pk=self.tomatoes.pk)
+                        .exists())
+        call_command('merge_duplicate_ingredients', recompute=True,
+                     stdout=StringIO())
+        self.assertFalse(Ingredient.objects.filter(pk=self.tomatoes.pk)
+                         .exists())
+
 
 #     def test_autocomplete_can_create(self):
 #         """Confirm autocomplete can confirm records."""
@@ -489,3 +2424,319 @@ class VaryRecipeView(TestView):
 #         # assert tomatoes
 #         queryset = Ingredient.objects.filter(name='tomatoes')
 #         self.assertTrue(queryset)
+
+
+class ImportRecipes(TestCase):
+    """Test importing recipes in bulk from files."""
+
+    def setUp(self):
+        """Prepare an author, a known ingredient and a work directory."""
+        self.author = UserFactory(username='import author')
+        self.tomato = IngredientFactory(name='tomato')
+        ingredient_index.load()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, lines):
+        """Write lines to a file in the work directory and return its path."""
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as output:
+            output.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        return path
+
+    def records(self):
+        """Return JSON lines for a soup, two generations of it and errors."""
+        return [json.dumps(record) for record in [
+            {'id': 'soup', 'title': 'Soup', 'directions': 'Simmer.',
+             'prep_time': 0.5, 'ingredients': [
+                 {'name': 'Tomatoes', 'quantity': '4'},
+                 {'name': 'leek', 'quantity': '1'}]},
+            {'id': 'spicy', 'parent': 'soup', 'title': 'Spicy soup',
+             'directions': 'Simmer hot.', 'ingredients': [
+                 {'name': 'tomato', 'quantity': '4'},
+                 {'name': 'Leeks', 'quantity': '1'},
+                 {'name': 'chili', 'quantity': '2'}]},
+            {'id': 'nameless', 'directions': 'Stir.'},
+            {'id': 'hotter', 'parent': 'spicy', 'title': 'Hotter soup',
+             'directions': 'Simmer very hot.', 'privacy': 'pr',
+             'ingredients': [{'name': 'chili', 'quantity': '6'}]},
+            {'id': 'orphan', 'parent': 'stew', 'title': 'Orphan',
+             'directions': 'Wait.'},
+        ]] + ['{not json']
+
+    def run_import(self, path, **options):
+        """Run the import command, returning its output and errors."""
+        out, err = StringIO(), StringIO()
+        call_command('import_recipes', path, author='import author',
+                     source='test', stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def imported(self, record_id):
+        """Return the recipe imported from the given record."""
+        return Recipe.objects.get(import_key='test:' + record_id)
+
+    def test_import(self):
+        """Confirm recipes, ingredients, lineage and counters are stored."""
+        output, errors = self.run_import(
+            self.write('recipes.jsonl', self.records()), batch_size=2)
+        self.assertIn('Imported 3 recipes and 2 new ingredients from 6 '
+                      'records', output)
+        self.assertIn('Line 3: title:', errors)
+        self.assertIn("Unknown parent 'test:stew'", errors)
+        self.assertIn('Line 6: Invalid JSON', errors)
+        soup, spicy, hotter = [self.imported(record_id) for record_id in
+                               ('soup', 'spicy', 'hotter')]
+        self.assertEqual(soup.author, self.author)
+        self.assertEqual(soup.prep_time, 0.5)
+        self.assertEqual(hotter.privacy, 'pr')
+        self.assertEqual(spicy.parent, soup)
+        self.assertEqual(hotter.parent, spicy)
+        self.assertEqual(
+            set(RecipeLineage.objects.values_list('ancestor', 'descendant',
+                                                  'depth')),
+            set([(soup.pk, spicy.pk, 1), (spicy.pk, hotter.pk, 1),
+                 (soup.pk, hotter.pk, 2)]))
+        self.assertEqual(set(hotter.ancestors.all()), set([soup, spicy]))
+        self.assertEqual((soup.variation_count, soup.descendant_count),
+                         (1, 2))
+        self.assertEqual((spicy.variation_count, spicy.descendant_count),
+                         (1, 1))
+        leek = Ingredient.objects.get(canonical_name='leek')
+        chili = Ingredient.objects.get(name='chili')
+        self.assertEqual(Ingredient.objects.count(), 3)
+        self.assertEqual(leek.name, 'leek')
+        self.assertEqual(
+            Ingredient.objects.get(pk=self.tomato.pk).usage_count, 2)
+        self.assertEqual((leek.usage_count, chili.usage_count), (2, 2))
+        self.assertEqual(soup.ingredient_ids, ' '.join(
+            str(pk) for pk in sorted([self.tomato.pk, leek.pk])))
+        self.assertEqual(spicy.ingredient_count, 3)
+        self.assertEqual(list(hotter.ingredients_in_recipe.values_list(
+            'ingredient', 'quantity')), [(chili.pk, '6')])
+        self.assertEqual(list(ingredient_index.search('lee')), [leek])
+
+    def test_resume(self):
+        """Confirm a repeated import only adds records not yet imported."""
+        records = self.records()
+        self.run_import(self.write('part.jsonl', records[:2]))
+        soup = self.imported('soup')
+        output, errors = self.run_import(
+            self.write('recipes.jsonl', records), batch_size=2)
+        self.assertIn('Imported 1 recipes', output)
+        self.assertIn('2 already there', output)
+        self.assertEqual(Recipe.objects.filter(title='Soup').get(), soup)
+        self.assertEqual(self.imported('hotter').parent,
+                         self.imported('spicy'))
+        soup.refresh_from_db()
+        self.assertEqual(soup.descendant_count, 2)
+
+    def test_csv(self):
+        """Confirm CSV rows are read with their packed ingredients."""
+        path = self.write('recipes.csv', [
+            'id,parent,title,directions,ingredients',
+            'a,,Salad,Toss.,lettuce|1 head;Tomatoes|2',
+            'b,a,"Salad, dressed",Toss again.,oil|1 tbsp',
+        ])
+        output, errors = self.run_import(path)
+        self.assertEqual(errors, '')
+        salad = self.imported('a')
+        self.assertEqual(self.imported('b').parent, salad)
+        self.assertEqual(list(salad.ingredients_in_recipe.values_list(
+            'ingredient__name', 'quantity').order_by('pk')),
+            [('lettuce', '1 head'), ('tomato', '2')])
+
+    def test_csv_non_ascii(self):
+        """Confirm CSV cells outside ASCII are read as UTF-8."""
+        path = self.write('recipes.csv', [
+            'id,title,directions,ingredients',
+            u'c,Cr\u00e8me br\u00fbl\u00e9e,Br\u00fbler.,'
+            u'cr\u00e8me|250 ml;sucre|50 g',
+        ])
+        output, errors = self.run_import(path)
+        self.assertEqual(errors, '')
+        recipe = self.imported('c')
+        self.assertEqual(recipe.title, u'Cr\u00e8me br\u00fbl\u00e9e')
+        self.assertEqual(list(recipe.ingredients_in_recipe.values_list(
+            'ingredient__name', 'quantity').order_by('pk')),
+            [(u'cr\u00e8me', '250 ml'), ('sucre', '50 g')])
+
+    def test_unknown_author(self):
+        """Confirm importing for a missing user is refused."""
+        path = self.write('recipes.jsonl', self.records())
+        with self.assertRaises(CommandError):
+            call_command('import_recipes', path, author='nobody',
+                         stdout=StringIO())
+
+
+class ExportRecipes(TestCase):
+    """Test exporting recipes as JSON lines."""
+
+    def setUp(self):
+        """Prepare a soup, a variation of it and a private recipe."""
+        self.chef = UserFactory(username='export chef')
+        self.rival = UserFactory(username='export rival')
+        self.secret = RecipeFactory(author=self.rival, title='Secret',
+                                    directions='Hush.', privacy='pr')
+        self.soup = RecipeFactory(author=self.chef, title='Soup',
+                                  directions='Simmer.', parent=self.secret)
+        RecipeLineage.objects.add_recipe(self.soup)
+        self.spicy = RecipeFactory(author=self.chef, title='Spicy soup',
+                                   directions='Simmer hot.', parent=self.soup)
+        RecipeLineage.objects.add_recipe(self.spicy)
+        for name, quantity in (('leek', '1'), ('chili', '2')):
+            RecipeIngredientFactory(recipe=self.spicy, quantity=quantity,
+                                    ingredient=IngredientFactory(name=name))
+
+    def test_batches(self):
+        """Confirm keyset batches cost three queries, or four with parents."""
+        with self.assertNumQueries(8):
+            lines = list(export_lines(Recipe.objects.all(), batch_size=2))
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([record['id'] for record in records],
+                         [self.secret.pk, self.soup.pk, self.spicy.pk])
+        spicy = records[2]
+        self.assertEqual(spicy['parent'], self.soup.pk)
+        self.assertEqual(spicy['author'], self.chef.pk)
+        self.assertEqual(spicy['ancestors'], [self.soup.pk, self.secret.pk])
+        self.assertEqual(spicy['ingredients'], [
+            {'name': 'leek', 'quantity': '1'},
+            {'name': 'chili', 'quantity': '2'}])
+
+    def test_round_trip(self):
+        """Confirm an export can be imported again with its lineage."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'recipes.jsonl')
+        out = StringIO()
+        call_command('export_recipes', output=path, stdout=out)
+        self.assertIn('Exported 3 recipes', out.getvalue())
+        call_command('import_recipes', path, author='export rival',
+                     stdout=StringIO())
+        spicy = Recipe.objects.get(
+            import_key='recipes.jsonl:{}'.format(self.spicy.pk))
+        self.assertEqual(spicy.author, self.rival)
+        self.assertEqual([recipe.title for recipe in
+                          Recipe.objects.ancestors_of(spicy)],
+                         ['Soup', 'Secret'])
+        self.assertEqual(spicy.ingredient_count, 2)
+
+    def test_author_round_trip(self):
+        """Confirm parents outside an export are left out, so it imports."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'chef.jsonl')
+        call_command('export_recipes', output=path, author='export chef',
+                     stdout=StringIO())
+        with open(path) as lines:
+            records = [json.loads(line) for line in lines]
+        self.assertEqual([record['parent'] for record in records],
+                         [None, self.soup.pk])
+        out, err = StringIO(), StringIO()
+        call_command('import_recipes', path, author='export rival',
+                     stdout=out, stderr=err)
+        self.assertEqual(err.getvalue(), '')
+        self.assertIn('Imported 2 recipes', out.getvalue())
+        soup = Recipe.objects.get(import_key='chef.jsonl:{}'.format(
+            self.soup.pk))
+        spicy = Recipe.objects.get(import_key='chef.jsonl:{}'.format(
+            self.spicy.pk))
+        self.assertIsNone(soup.parent)
+        self.assertEqual(spicy.parent, soup)
+
+    def test_author(self):
+        """Confirm --author limits the export to one chef's recipes."""
+        out, err = StringIO(), StringIO()
+        call_command('export_recipes', author='export chef', stdout=out,
+                     stderr=err)
+        self.assertEqual([json.loads(line)['id'] for line in
+                          out.getvalue().splitlines()],
+                         [self.soup.pk, self.spicy.pk])
+        self.assertIn('Exported 2 recipes', err.getvalue())
+
+    def test_endpoint(self):
+        """Confirm the endpoint streams only recipes the user can see."""
+        response = Client().get('/recipe/api/recipes/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('private', response['Cache-Control'])
+        records = [json.loads(line) for line in b''.join(
+            response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([record['id'] for record in records],
+                         [self.soup.pk, self.spicy.pk])
+        self.assertEqual(records[1]['ancestors'], [self.soup.pk])
+        client = Client()
+        client.force_login(self.rival)
+        response = client.get('/recipe/api/recipes/export/',
+                              {'author': self.rival.pk})
+        self.assertEqual(len(b''.join(
+            response.streaming_content).splitlines()), 1)
+
+
+class ForkRecipe(TestCase):
+    """Test copying a recipe as a variation in one step."""
+
+    def setUp(self):
+        """Prepare a soup with a parent and a cook to fork it."""
+        self.chef = UserFactory(username='fork chef')
+        self.cook = UserFactory(username='fork cook')
+        self.stock = RecipeFactory(author=self.chef, title='Stock',
+                                   directions='Boil.')
+        self.soup = RecipeFactory(author=self.chef, title='Soup',
+                                  description='Warm.', directions='Simmer.',
+                                  prep_time=.5, parent=self.stock)
+        RecipeLineage.objects.add_recipe(self.soup)
+        self.ingredients = [IngredientFactory(name=name)
+                            for name in ('leek', 'potato')]
+        for ingredient, quantity in zip(self.ingredients, ('1', '3')):
+            RecipeIngredientFactory(recipe=self.soup, ingredient=ingredient,
+                                    quantity=quantity)
+        adjust_ingredient_usage(dict((ingredient.pk, 1) for ingredient in
+                                     self.ingredients))
+        refresh_ingredient_ids([self.soup.pk])
+        set_favorite(self.chef, self.soup)
+        self.client = Client()
+        self.client.force_login(self.cook)
+        self.url = '/recipe/view/{}/fork/'.format(self.soup.pk)
+
+    def test_fork(self):
+        """Confirm the copy, its ingredients, lineage and counters."""
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 201)
+        fork = Recipe.objects.get(pk=response.json()['recipe'])
+        self.assertEqual(response.json()['parent'], self.soup.pk)
+        self.assertEqual((fork.title, fork.description, fork.directions,
+                          fork.prep_time), ('Soup', 'Warm.', 'Simmer.', .5))
+        self.assertEqual(fork.author, self.cook)
+        self.assertEqual(fork.parent, self.soup)
+        self.assertEqual((fork.favorite_count, fork.variation_count,
+                          fork.ingredient_count), (0, 0, 2))
+        self.assertGreater(fork.created, self.soup.created)
+        self.assertEqual(list(fork.ingredients_in_recipe.order_by('pk')
+                              .values_list('ingredient', 'quantity')),
+                         [(self.ingredients[0].pk, '1'),
+                          (self.ingredients[1].pk, '3')])
+        self.assertEqual(list(Recipe.objects.ancestors_of(fork)),
+                         [self.soup, self.stock])
+        self.assertEqual(set(fork.ancestors.all()),
+                         set([self.soup, self.stock]))
+        soup = Recipe.objects.get(pk=self.soup.pk)
+        stock = Recipe.objects.get(pk=self.stock.pk)
+        self.assertEqual((soup.variation_count, soup.descendant_count),
+                         (1, 1))
+        self.assertEqual(stock.descendant_count, 2)
+        self.assertGreater(soup.version, self.soup.version)
+        self.assertEqual([ingredient.usage_count for ingredient in
+                          Ingredient.objects.filter(
+                              pk__in=[i.pk for i in self.ingredients])],
+                         [2, 2])
+
+    def test_hidden(self):
+        """Confirm only recipes the cook can see are forked, by POST."""
+        Recipe.objects.filter(pk=self.soup.pk).update(privacy='pr')
+        self.assertEqual(self.client.post(self.url).status_code, 404)
+        self.client.force_login(self.chef)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.assertEqual(self.client.post(self.url).status_code, 201)
+        self.assertEqual(Recipe.objects.filter(parent=self.soup,
+                                               privacy='pr').count(), 1)
+        response = Client().post(self.url)
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,71 @@
+"""Render recipe tiles through a versioned per-recipe fragment cache."""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .models import Recipe
+
+TILE_TEMPLATE = 'recipe/recipe_tile.html'
+VERSION_KEY = 'recipe-tile-version:{}'
+TILE_KEY = 'recipe-tile:{}:{}'
+
+
+def get_tile_versions(recipe_ids):
+    """Return the current tile version of each recipe, starting new ones.
+
+    New versions start from the clock so a version that was evicted from
+    the cache never lines up with tiles stored under its old value.
+    """
+    keys = dict((VERSION_KEY.format(pk), pk) for pk in recipe_ids)
+    found = cache.get_many(keys)
+    start = int(time.time() * 1000)
+    missing = dict((key, start) for key in keys if key not in found)
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return dict((keys[key], version) for key, version in found.items())
+
+
+def bump_tile_versions(recipe_ids):
+    """Invalidate the cached tiles of the given recipes once committed.
+
+    Bumping earlier would let a concurrent request cache a tile of the
+    old rows under the new version, and a rollback would still bump.
+    Outside a transaction the versions move at once.
+    """
+    recipe_ids = set(pk for pk in recipe_ids if pk is not None)
+    if recipe_ids:
+        transaction.on_commit(lambda: incr_tile_versions(recipe_ids))
+
+
+def incr_tile_versions(recipe_ids):
+    """Move the tile versions of the given recipes on."""
+    for pk in recipe_ids:
+        try:
+            cache.incr(VERSION_KEY.format(pk))
+        except ValueError:
+            pass
+
+
+def render_tiles(recipe_ids):
+    """Return the rendered tile of each recipe id, in the given order.
+
+    Cached tiles are returned without touching the database; the rest
+    are loaded with the tile queryset, rendered and cached together.
+    """
+    recipe_ids = list(recipe_ids)
+    versions = get_tile_versions(recipe_ids)
+    keys = dict((pk, TILE_KEY.format(pk, versions[pk])) for pk in recipe_ids)
+    tiles = cache.get_many(keys.values())
+    missing = [pk for pk in recipe_ids if keys[pk] not in tiles]
+    if missing:
+        rendered = {}
+        for recipe in Recipe.objects.filter(pk__in=missing).tiles():
+            rendered[keys[recipe.pk]] = render_to_string(TILE_TEMPLATE,
+                                                         {'recipe': recipe})
+        cache.set_many(rendered, settings.RECIPE_TILE_TIMEOUT)
+        tiles.update(rendered)
+    return [mark_safe(tiles[keys[pk]]) for pk in recipe_ids
+            if keys[pk] in tiles]
@@ -2,14 +2,27 @@ from django.conf.urls import url
 from .views import add_recipe, IngredientAutocomplete, Ingredient, edit_recipe
 from django.contrib.auth.decorators import login_required
 from django.views.generic.detail import DetailView
+from .api import (
+    IngredientListApi,
+    RecipeDetailApi,
+    RecipeExportApi,
+    RecipeLineageApi,
+    RecipeListApi
+)
 from .models import Recipe
 from .views import (
     add_recipe,
     FavoriteRecipesView,
+    favorite_recipe,
+    fork_recipe,
     IngredientAutocomplete,
     Ingredient,
     MyRecipesListView,
+    PantryView,
+    PopularRecipesView,
     RecipeDetailView,
+    RecipeLineageView,
+    RecipeSearchView,
     vary_recipe
 )
 
@@ -18,6 +31,10 @@ urlpatterns = [
         login_required(IngredientAutocomplete.as_view(model=Ingredient,
                                                       create_field='name')),
         name='ingredient-autocomplete',),
+    url(r'^cook/ingredient-autocomplete/$',
+        IngredientAutocomplete.as_view(model=Ingredient,
+                                       http_method_names=['get']),
+        name='pantry-ingredient-autocomplete'),
     url(r'^add/$', login_required(add_recipe), name='add-recipe'),
     url(r'^view/(?P<pk>[0-9]+)/$',
         RecipeDetailView.as_view(
@@ -25,6 +42,36 @@ urlpatterns = [
             template_name='recipe/view-recipe.html'
         ),
         name='view-recipe'),
+    url(r'^view/(?P<pk>[0-9]+)/lineage/$',
+        RecipeLineageView.as_view(
+            model=Recipe,
+            template_name='recipe/lineage.html'
+        ),
+        name='recipe-lineage'),
+    url(r'^search/$',
+        RecipeSearchView.as_view(
+            model=Recipe,
+            template_name='recipe/search.html'
+        ),
+        name='search-recipes'),
+    url(r'^popular/$',
+        PopularRecipesView.as_view(
+            model=Recipe,
+            template_name='recipe/popular.html'
+        ),
+        name='popular-recipes'),
+    url(r'^cook/$',
+        PantryView.as_view(
+            model=Recipe,
+            template_name='recipe/cook.html'
+        ),
+        name='what-can-i-cook'),
+    url(r'^view/(?P<pk>[0-9]+)/favorite/$',
+        login_required(favorite_recipe),
+        name='favorite-recipe'),
+    url(r'^view/(?P<pk>[0-9]+)/fork/$',
+        login_required(fork_recipe),
+        name='fork-recipe'),
     url(r'^edit/(?P<pk>[0-9]+)/$',
         login_required(edit_recipe), name='edit-recipe'),
     url(r'^vary/(?P<pk>[0-9]+)/$',
@@ -41,5 +88,18 @@ urlpatterns = [
             model=Recipe,
             template_name='recipe/favorites.html'
         )),
-        name='favorites')
+        name='favorites'),
+    url(r'^api/recipes/$', RecipeListApi.as_view(), name='api-recipes'),
+    url(r'^api/recipes/export/$',
+        RecipeExportApi.as_view(),
+        name='api-recipes-export'),
+    url(r'^api/recipes/(?P<pk>[0-9]+)/$',
+        RecipeDetailApi.as_view(),
+        name='api-recipe'),
+    url(r'^api/recipes/(?P<pk>[0-9]+)/lineage/$',
+        RecipeLineageApi.as_view(),
+        name='api-recipe-lineage'),
+    url(r'^api/ingredients/$',
+        IngredientListApi.as_view(),
+        name='api-ingredients'),
 ]
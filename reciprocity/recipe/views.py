@@ -1,25 +1,92 @@
 from dal import autocomplete
-from django.http import Http404, HttpResponseRedirect
-from django.shortcuts import render
+from django.http import (
+    Http404,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+    JsonResponse
+)
+from django.middleware.csrf import get_token
+from django.shortcuts import get_object_or_404, render
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import require_http_methods
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
-from .forms import RecipeIngredientRelationshipFormSet, RecipeForm
-from .models import Ingredient, Recipe, RecipeIngredientRelationship
+from .conditional import not_modified, set_validators
+from .forms import PantryForm, RecipeIngredientRelationshipFormSet, RecipeForm
+from .ingredient_index import ingredient_index
+from .models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredientRelationship,
+    RecipeNeighbour
+)
+from .pagination import KeysetPaginationMixin
+from .pantry import rank_by_coverage
+from .search import search_recipes
+from .services import create_variation, save_recipe, set_favorite
+from .tiles import render_tiles
 
 
-class FavoriteRecipesView(ListView):
+LINEAGE_PREVIEW = 6
+
+
+class FavoriteRecipesView(KeysetPaginationMixin, ListView):
     def get_queryset(self):
-        """Return favorited recipes."""
-        return Recipe.objects.filter(favorite_of=self.request.user.profile)
+        """Return ids of a page of visible favorited recipes."""
+        recipes = Recipe.objects.visible_to(self.request.user)
+        return self.paginate_keyset(
+            recipes.filter(favorite_of__user=self.request.user))
+
+    def get_context_data(self, **kwargs):
+        """Add rendered tiles for the page of favorites."""
+        context = super(FavoriteRecipesView, self).get_context_data(**kwargs)
+        context['tiles'] = render_tiles(context['object_list'])
+        return context
 
 
-class MyRecipesListView(ListView):
+class MyRecipesListView(KeysetPaginationMixin, ListView):
     def get_queryset(self):
-        """Return authored recipes."""
-        return Recipe.objects.filter(author=self.request.user)
+        """Return ids of a page of authored recipes."""
+        return self.paginate_keyset(
+            Recipe.objects.filter(author=self.request.user))
+
+    def get_context_data(self, **kwargs):
+        """Add rendered tiles for the authored recipes."""
+        context = super(MyRecipesListView, self).get_context_data(**kwargs)
+        context['tiles'] = render_tiles(context['object_list'])
+        return context
 
 
 class RecipeDetailView(DetailView):
+    def get(self, request, *args, **kwargs):
+        """Render the recipe, or answer 304 if the client's copy is current.
+
+        get_object() checks privacy with the page's only recipe lookup,
+        and the row it loads carries the validators: its version, with
+        the viewing chef for the ETag, and its updated time. Titles of
+        related recipes shown on the page may lag until the recipe
+        itself changes. Chefs' pages read the CSRF token from its cookie,
+        which is set on 304s too, since a revalidated copy may predate the
+        current token.
+        """
+        self.object = self.get_object()
+        if request.user.is_authenticated():
+            get_token(request)
+        etag = '{}-{}-{}'.format(self.object.pk, self.object.version,
+                                 request.user.pk or 0)
+        if not_modified(request, etag, self.object.updated):
+            response = HttpResponseNotModified()
+        else:
+            response = self.render_to_response(
+                self.get_context_data(object=self.object))
+        set_validators(response, etag, self.object.updated, weak=True)
+        if self.object.privacy == 'pu' and not request.user.is_authenticated():
+            patch_cache_control(response, public=True, max_age=0)
+        else:
+            patch_cache_control(response, private=True, max_age=0)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
     def get_object(self, queryset=None):
         """Secure private recipes."""
         recipe = super(DetailView, self).get_object()
@@ -27,29 +94,168 @@ class RecipeDetailView(DetailView):
             raise Http404
         return recipe
 
+    def get_context_data(self, **kwargs):
+        """Add ingredients, similar recipes and a preview of the lineage."""
+        context = super(RecipeDetailView, self).get_context_data(**kwargs)
+        recipes = Recipe.objects.visible_to(self.request.user)
+        ancestors = recipes.ancestors_of(self.object)
+        descendants = recipes.descendants_of(self.object)
+        context['ingredients'] = (self.object.ingredients_in_recipe
+                                  .select_related('ingredient'))
+        context['ancestors'] = render_tiles(
+            ancestors.values_list('pk', flat=True)[:LINEAGE_PREVIEW])
+        context['ancestor_count'] = ancestors.count()
+        context['descendants'] = render_tiles(
+            descendants.values_list('pk', flat=True)[:LINEAGE_PREVIEW])
+        context['descendant_count'] = descendants.count()
+        if self.request.user.is_authenticated():
+            context['is_favorite'] = Recipe.favorite_of.through.objects.filter(
+                recipe=self.object,
+                chefprofile__user=self.request.user).exists()
+        context['similar'] = render_tiles(
+            RecipeNeighbour.objects
+            .filter(recipe=self.object, neighbour__privacy='pu')
+            .order_by('-similarity', 'neighbour')
+            .values_list('neighbour', flat=True))
+        return context
+
+
+class RecipeLineageView(ListView):
+    paginate_by = 24
+
+    def get_queryset(self):
+        """Return ids from a visible recipe's lineage."""
+        recipes = Recipe.objects.visible_to(self.request.user)
+        self.recipe = get_object_or_404(recipes, pk=self.kwargs.get('pk'))
+        self.direction = self.request.GET.get('direction')
+        if self.direction == 'ancestors':
+            lineage = recipes.ancestors_of(self.recipe)
+        else:
+            self.direction = 'descendants'
+            lineage = recipes.descendants_of(self.recipe)
+        return lineage.values_list('pk', flat=True)
+
+    def get_context_data(self, **kwargs):
+        """Add the recipe whose lineage is listed and the page's tiles."""
+        context = super(RecipeLineageView, self).get_context_data(**kwargs)
+        context['tiles'] = render_tiles(context['object_list'])
+        context['recipe'] = self.recipe
+        context['direction'] = self.direction
+        return context
+
+
+class PopularRecipesView(ListView):
+    paginate_by = 24
+    orderings = {
+        'favorites': 'favorite_count',
+        'variations': 'variation_count',
+    }
+
+    def get_queryset(self):
+        """Return ids of public recipes by a stored counter, highest first."""
+        self.by = self.request.GET.get('by')
+        if self.by not in self.orderings:
+            self.by = 'favorites'
+        recipes = Recipe.objects.filter(privacy='pu')
+        recipes = recipes.order_by('-' + self.orderings[self.by], '-pk')
+        return recipes.values_list('pk', flat=True)
+
+    def get_context_data(self, **kwargs):
+        """Add the chosen ordering and the page's tiles."""
+        context = super(PopularRecipesView, self).get_context_data(**kwargs)
+        context['tiles'] = render_tiles(context['object_list'])
+        context['by'] = self.by
+        return context
+
+
+class RecipeSearchView(ListView):
+    paginate_by = 24
+
+    def get_queryset(self):
+        """Return ids of visible recipes matching the query, best first."""
+        self.query = self.request.GET.get('q', '').strip()
+        return search_recipes(self.query, self.request.user)
+
+    def get_context_data(self, **kwargs):
+        """Add the query and the page's tiles."""
+        context = super(RecipeSearchView, self).get_context_data(**kwargs)
+        context['tiles'] = render_tiles(context['object_list'])
+        context['query'] = self.query
+        return context
+
+
+class PantryView(ListView):
+    paginate_by = 24
+
+    def get_queryset(self):
+        """Return ids of public recipes the chosen ingredients cover best.
+
+        Recipes using ingredients the user dislikes are left out.
+        """
+        self.form = PantryForm(self.request.GET or None)
+        if not self.form.is_valid():
+            return []
+        have = [ingredient.pk for ingredient
+                in self.form.cleaned_data['ingredients']]
+        excluded = []
+        if self.request.user.is_authenticated():
+            excluded = (Ingredient.objects
+                        .filter(disliked_by__user=self.request.user)
+                        .values_list('pk', flat=True))
+        return [pk for pk, matched, total
+                in rank_by_coverage(have, excluded)]
+
+    def get_context_data(self, **kwargs):
+        """Add the ingredient form and the page's tiles."""
+        context = super(PantryView, self).get_context_data(**kwargs)
+        context['form'] = self.form
+        context['tiles'] = render_tiles(context['object_list'])
+        return context
+
 
 class IngredientAutocomplete(autocomplete.Select2QuerySetView):
     def get_queryset(self):
-        qs = Ingredient.objects.all()
-        if self.q:
-            qs = qs.filter(name__istartswith=self.q)
-        return qs
+        """Return ingredients starting with the query from the index."""
+        return ingredient_index.search(self.q)
+
+    def create_object(self, text):
+        """Return the ingredient the typed text names, creating it if new."""
+        return Ingredient.objects.get_or_create_by_name(text)
+
+
+@require_http_methods(['POST', 'DELETE'])
+def favorite_recipe(request, **kwargs):
+    """Favorite a visible recipe on POST or unfavorite it on DELETE."""
+    recipes = Recipe.objects.visible_to(request.user).only('favorite_count')
+    recipe = get_object_or_404(recipes, pk=kwargs.get('pk'))
+    favorite = request.method == 'POST'
+    count = recipe.favorite_count
+    if set_favorite(request.user, recipe, favorite):
+        count += 1 if favorite else -1
+    return JsonResponse({'recipe': recipe.pk,
+                         'favorite': favorite,
+                         'favorite_count': count})
+
+
+@require_http_methods(['POST'])
+def fork_recipe(request, **kwargs):
+    """Copy a visible recipe as the user's variation in one step."""
+    recipes = Recipe.objects.visible_to(request.user).only('privacy')
+    parent = get_object_or_404(recipes, pk=kwargs.get('pk'))
+    recipe_id = create_variation(parent, request.user)
+    return JsonResponse({'recipe': recipe_id, 'parent': parent.pk},
+                        status=201)
 
 
 def add_recipe(request):
     if request.method == 'POST':
         recipe_form = RecipeForm(request.POST, request.FILES)
-        formset = RecipeIngredientRelationshipFormSet(request.POST,
-                                                      prefix='ingredient_form')
+        formset = RecipeIngredientRelationshipFormSet(
+            request.POST,
+            queryset=RecipeIngredientRelationship.objects.none(),
+            prefix='ingredient_form')
         if formset.is_valid() and recipe_form.is_valid():
-            recipe_form.instance.author = request.user
-            recipe_form.save()
-            for ingredient in formset.cleaned_data:
-                if ingredient:
-                    new = RecipeIngredientRelationship(recipe=recipe_form.instance,
-                                                       quantity=ingredient['quantity'],
-                                                       ingredient=ingredient['ingredient'])
-                    new.save()
+            save_recipe(recipe_form, formset, author=request.user)
             return HttpResponseRedirect('/')
     else:
         recipe_form = RecipeForm()
@@ -70,22 +276,12 @@ def edit_recipe(request, **kwargs):
     recipe = Recipe.objects.get(pk=pk)
     if request.method == 'POST':
         recipe_form = RecipeForm(request.POST, request.FILES, instance=recipe)
-        formset = RecipeIngredientRelationshipFormSet(request.POST,
-                                                      prefix='ingredient_form')
+        formset = RecipeIngredientRelationshipFormSet(
+            request.POST,
+            queryset=recipe.ingredients_in_recipe.all(),
+            prefix='ingredient_form')
         if formset.is_valid() and recipe_form.is_valid():
-            recipe_form.save()
-            for ingredient in formset.cleaned_data:
-                if ingredient:
-                    if ingredient['id']:
-                        relationship = RecipeIngredientRelationship.objects.get(id=ingredient['id'].id)
-                        relationship.quantity = ingredient['quantity']
-                        relationship.ingredient = ingredient['ingredient']
-                        relationship.save()
-                    else:
-                        new = RecipeIngredientRelationship(recipe=recipe,
-                                                           quantity=ingredient['quantity'],
-                                                           ingredient=ingredient['ingredient'])
-                        new.save()
+            save_recipe(recipe_form, formset)
             return HttpResponseRedirect('/')
     else:
         recipe_form = RecipeForm(instance=recipe)
@@ -101,26 +297,15 @@ def vary_recipe(request, **kwargs):
     parent_recipe = Recipe.objects.get(pk=pk)
     if request.method == 'POST':
         recipe_form = RecipeForm(request.POST, request.FILES)
-        formset = RecipeIngredientRelationshipFormSet(request.POST,
-                                                      prefix='ingredient_form')
+        formset = RecipeIngredientRelationshipFormSet(
+            request.POST,
+            queryset=parent_recipe.ingredients_in_recipe.all(),
+            prefix='ingredient_form')
         if formset.is_valid() and recipe_form.is_valid():
-            recipe_form.instance.author = request.user
-            recipe_form.instance.parent = parent_recipe
-            recipe_form.save()
-            for ingredient in formset.cleaned_data:
-                if ingredient:
-                    new = RecipeIngredientRelationship(recipe=recipe_form.instance,
-                                                       quantity=ingredient['quantity'],
-                                                       ingredient=ingredient['ingredient'])
-                    new.save()
-            cur = parent_recipe
-            while cur:
-                recipe_form.instance.ancestors.add(cur)
-                recipe_form.save()
-                if cur.parent:
-                    cur = cur.parent
-                else:
-                    break
+            save_recipe(recipe_form,
+                        formset,
+                        author=request.user,
+                        parent=parent_recipe)
             return HttpResponseRedirect('/')
     else:
         recipe_form = RecipeForm(instance=parent_recipe)
@@ -91,6 +91,24 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'reciprocity'),
+    }
+}
+
+RECIPE_TILE_TIMEOUT = 60 * 60 * 24
+HOME_PAGE_TIMEOUT = 60 * 60
+LATEST_PUBLIC_FEED_TIMEOUT = 60 * 60 * 24
+PERSONAL_FEED_TIMEOUT = 60 * 10
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -134,6 +152,7 @@ STATICFILES_DIRS = (os.path.join(BASE_DIR, "static"), )
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+RECIPE_PHOTO_STORAGE = 'recipe.storage.ContentAddressedStorage'
 
 ACCOUNT_ACTIVATION_DAYS = 7
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -1,9 +1,16 @@
+from django.core.cache import cache
 from django.test import Client, TestCase
-from recipe.tests import RecipeFactory, UserFactory
+from recipe.tests import (
+    PASSWORD,
+    RecipeFactory,
+    UserFactory,
+    run_commit_hooks
+)
 
 
 class ViewHome(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.user = UserFactory()
         self.public_recipe = RecipeFactory(author=self.user, privacy='pu')
@@ -18,3 +25,56 @@ class ViewHome(TestCase):
         """Confirm view excludes non-authored recipes."""
         response = self.client.get('/')
         self.assertNotIn(str(self.private_recipe), str(response.content))
+
+    def test_query_count(self):
+        """Confirm home page tiles do not query per recipe."""
+        for _ in range(18):
+            parent = RecipeFactory(author=self.user, parent=self.public_recipe)
+            RecipeFactory(author=self.user, parent=parent)
+        with self.assertNumQueries(4):
+            self.client.get('/')
+        with self.assertNumQueries(0):
+            self.client.get('/')
+
+    def test_vary_cookie(self):
+        """Confirm cached and uncached home pages vary on cookies."""
+        self.assertIn('Cookie', self.client.get('/')['Vary'])
+        self.assertIn('Cookie', self.client.get('/')['Vary'])
+
+    def test_cached_page_updates(self):
+        """Confirm the cached page picks up new and edited recipes."""
+        self.client.get('/')
+        new_recipe = RecipeFactory(author=self.user, title='Brand New')
+        run_commit_hooks()
+        self.assertIn('Brand New', str(self.client.get('/').content))
+        new_recipe.title = 'Renamed'
+        new_recipe.save()
+        run_commit_hooks()
+        content = str(self.client.get('/').content)
+        self.assertIn('Renamed', content)
+        self.assertNotIn('Brand New', content)
+
+    def test_authenticated_not_cached(self):
+        """Confirm logged in users do not get the anonymous page."""
+        self.client.get('/')
+        self.user.set_password(PASSWORD)
+        self.user.save()
+        self.client.login(username=self.user.username, password=PASSWORD)
+        self.assertIn('Logout', str(self.client.get('/').content))
+
+    def test_older_pages(self):
+        """Confirm the feed links to older public recipes by cursor."""
+        self.assertIsNone(self.client.get('/').context['next_cursor'])
+        recipes = [RecipeFactory(author=self.user) for _ in range(18)]
+        run_commit_hooks()
+        response = self.client.get('/')
+        self.assertNotIn(str(self.public_recipe), str(response.content))
+        response = self.client.get('/?after=' +
+                                   response.context['next_cursor'])
+        self.assertEqual(response.context['view'].recipe_ids,
+                         [self.public_recipe.pk])
+        self.assertIsNone(response.context['next_cursor'])
+        response = self.client.get('/?before=' +
+                                   response.context['previous_cursor'])
+        self.assertEqual(response.context['view'].recipe_ids,
+                         [recipe.pk for recipe in reversed(recipes)])
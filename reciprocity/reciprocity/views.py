@@ -1,13 +1,77 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.views.generic import TemplateView
+from django.views.static import serve
+from recipe.feed import (
+    FEED_SIZE,
+    get_latest_public_entries,
+    get_personal_feed_ids
+)
 from recipe.models import Recipe
+from recipe.pagination import KeysetPaginationMixin, encode_cursor
+from recipe.storage import IMMUTABLE_MAX_AGE, is_content_addressed
+from recipe.tiles import get_tile_versions, render_tiles
 
+HOME_PAGE_KEY = 'home-page:{}'
 
-class HomeView(TemplateView):
+
+class HomeView(KeysetPaginationMixin, TemplateView):
     """Home page view showing latest recipes."""
     template_name = 'reciprocity/home.html'
+    page_size = FEED_SIZE
+
+    def get(self, request, *args, **kwargs):
+        """Serve anonymous visitors a cached copy of the whole page.
+
+        The page is keyed on the feed's recipe ids and their tile
+        versions, so any change to the feed or its tiles misses. Logged
+        in users get a feed personalized by their ingredient tastes.
+        Older pages list public recipes by cursor and are not cached.
+        """
+        if request.GET.get('after') or request.GET.get('before'):
+            self.recipe_ids = self.paginate_keyset(
+                Recipe.objects.filter(privacy='pu'))
+            return super(HomeView, self).get(request, *args, **kwargs)
+        entries = get_latest_public_entries(FEED_SIZE + 1)
+        self.previous_cursor = self.next_cursor = None
+        if len(entries) > FEED_SIZE:
+            self.next_cursor = encode_cursor(*entries[FEED_SIZE - 1])
+        if request.user.is_authenticated():
+            self.recipe_ids = get_personal_feed_ids(request.user)
+            return super(HomeView, self).get(request, *args, **kwargs)
+        self.recipe_ids = [pk for created, pk in entries[:FEED_SIZE]]
+        versions = get_tile_versions(self.recipe_ids)
+        feed = ','.join('{}:{}'.format(pk, versions[pk])
+                        for pk in self.recipe_ids)
+        key = HOME_PAGE_KEY.format(
+            hashlib.md5(feed.encode('utf-8')).hexdigest())
+        content = cache.get(key)
+        if content is None:
+            response = super(HomeView, self).get(request, *args, **kwargs)
+            response.render()
+            cache.set(key, response.content, settings.HOME_PAGE_TIMEOUT)
+        else:
+            response = HttpResponse(content)
+        patch_vary_headers(response, ('Cookie',))
+        return response
 
     def get_context_data(self, *args, **kwargs):
         context_data = super(HomeView, self).get_context_data(*args, **kwargs)
-        queryset = Recipe.objects.filter(privacy='pu')
-        context_data['latest_recipes'] = queryset.order_by('-created')[:18]
+        context_data['latest_recipes'] = render_tiles(self.recipe_ids)
         return context_data
+
+
+def serve_media(request, path, document_root=None):
+    """Serve uploaded files, letting content addressed ones cache forever.
+
+    Only used with DEBUG on; in production the web server serving
+    MEDIA_ROOT should send the same headers for hashed names.
+    """
+    response = serve(request, path, document_root=document_root)
+    if response.status_code == 200 and is_content_addressed(path):
+        patch_cache_control(response, public=True, immutable=True,
+                            max_age=IMMUTABLE_MAX_AGE)
+    return response